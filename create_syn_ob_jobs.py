@@ -13,6 +13,7 @@ Date Created: 15 June 2023
 #---------------------------------------------------------------------------------------------------
 
 import numpy as np
+import io
 import os
 import sys
 import datetime as dt
@@ -150,6 +151,231 @@ def close_file(fptr):
     return None
 
 
+def write_prepbufr_csv(fptr, param, fname):
+    """
+    Write commands to create prepbufr.csv (the input for prepbufr_encode_csv.x) in the current 
+    directory. Parquet files are converted to CSV
+
+    Parameters
+    ----------
+    fptr : file pointer
+        Batch script file pointer
+    param : dictionary
+        Dictionary containing parameters from synthetic_ob_creator_param.yml
+    fname : string
+        Observation file (CSV or Parquet)
+
+    Returns
+    -------
+    None
+
+    """
+
+    if fname.endswith('.parquet'):
+        fptr.write('source %s/activate_python_env.sh\n' % param['paths']['osse_code'])
+        fptr.write('python -u %s/main/convert_ob_file.py %s ./prepbufr.csv\n' % 
+                   (param['paths']['osse_code'], fname))
+    else:
+        fptr.write('cp %s ./prepbufr.csv \n' % fname)
+
+    return None
+
+
+def write_interpolator(fptr, param, in_yaml, bufr_t, wrf_start, wrf_end, tag):
+    """
+    Write commands to run the interpolator (create_synthetic_obs.py)
+
+    Parameters
+    ----------
+    fptr : file pointer
+        Batch script file pointer
+    param : dictionary
+        Dictionary containing parameters from synthetic_ob_creator_param.yml
+    in_yaml : string
+        YAML file with program parameters
+    bufr_t : list of dt.datetime
+        prepBUFR times. All times are processed by a single call to create_synthetic_obs.py
+    wrf_start : dt.datetime
+        First UPP output time
+    wrf_end : dt.datetime
+        Last UPP output time
+    tag : string
+        prepBUFR tag (e.g., 'rap')
+
+    Returns
+    -------
+    None
+
+    """
+
+    fptr.write('# Perform interpolation from model grid to obs location\n')
+    fptr.write('echo ""\n')
+    fptr.write('echo "=============================================================="\n')
+    fptr.write('echo "Perform interpolation from model grid to obs location"\n')
+    fptr.write('echo ""\n')
+    fptr.write('source %s/activate_python_env.sh\n' % param['paths']['osse_code'])
+    fptr.write('cd %s/main\n' % param['paths']['osse_code'])
+    fptr.write('echo "Using osse_ob_creator version `git describe`"\n')
+    fptr.write('python -u create_synthetic_obs.py %s \\\n' % param['paths']['model'])
+    if param['create_csv']['use']:
+        fptr.write('                                  %s \\\n' % param['paths']['syn_bogus_csv'])
+    else:
+        fptr.write('                                  %s \\\n' % param['paths']['real_csv'])
+    fptr.write('                                  %s \\\n' % param['paths']['syn_perf_csv'])
+    fptr.write('                                  %s \\\n' % ','.join([t.strftime('%Y%m%d%H') for t in bufr_t]))
+    fptr.write('                                  %s \\\n' % wrf_start.strftime('%Y%m%d%H%M'))
+    fptr.write('                                  %s \\\n' % wrf_end.strftime('%Y%m%d%H%M'))
+    fptr.write('                                  %s \\\n' % tag)
+    fptr.write('                                  %s/%s \n\n' % (param['paths']['osse_code'], in_yaml))
+
+    return None
+
+
+def write_run_pipeline(fptr, param, in_yaml, t_str, tag, wrf_start=None, wrf_end=None):
+    """
+    Write commands to run the interpolator and the components that follow it in a single process
+    (run_pipeline.py)
+
+    Parameters
+    ----------
+    fptr : file pointer
+        Batch script file pointer
+    param : dictionary
+        Dictionary containing parameters from synthetic_ob_creator_param.yml
+    in_yaml : string
+        YAML file with program parameters
+    t_str : string
+        prepBUFR time (YYYYMMDDHHMM)
+    tag : string
+        prepBUFR tag (e.g., 'rap')
+    wrf_start : dt.datetime, optional
+        First UPP output time. The interpolator is only run if wrf_start and wrf_end are provided
+    wrf_end : dt.datetime, optional
+        Last UPP output time
+
+    Returns
+    -------
+    None
+
+    """
+
+    fptr.write('# Run components in a single process\n')
+    fptr.write('echo ""\n')
+    fptr.write('echo "=============================================================="\n')
+    fptr.write('echo "Run components in a single process"\n')
+    fptr.write('echo ""\n')
+    fptr.write('source %s/activate_python_env.sh\n' % param['paths']['osse_code'])
+    fptr.write('cd %s/main\n' % param['paths']['osse_code'])
+    fptr.write('echo "Using osse_ob_creator version `git describe`"\n')
+    fptr.write('python -u run_pipeline.py %s \\\n' % t_str)
+    fptr.write('                          %s \\\n' % tag)
+    if (wrf_start is not None) and (wrf_end is not None):
+        fptr.write('                          %s/%s \\\n' % (param['paths']['osse_code'], in_yaml))
+        fptr.write('                          %s \\\n' % wrf_start.strftime('%Y%m%d%H%M'))
+        fptr.write('                          %s \n\n' % wrf_end.strftime('%Y%m%d%H%M'))
+    else:
+        fptr.write('                          %s/%s \n\n' % (param['paths']['osse_code'], in_yaml))
+
+    return None
+
+
+def write_limit_uas_plot(fptr, param, in_yaml, t_str, tag):
+    """
+    Write commands to plot timeseries of UAS obs before and after limiting UAS flights
+
+    Parameters
+    ----------
+    fptr : file pointer
+        Batch script file pointer
+    param : dictionary
+        Dictionary containing parameters from synthetic_ob_creator_param.yml
+    in_yaml : string
+        YAML file with program parameters
+    t_str : string
+        prepBUFR time (YYYYMMDDHHMM)
+    tag : string
+        prepBUFR tag (e.g., 'rap')
+
+    Returns
+    -------
+    None
+
+    """
+
+    fptr.write('mkdir -p %s/%s\n' % (param['paths']['plots'], t_str))
+    fptr.write('cd %s/plotting\n' % param['paths']['osse_code'])
+    fptr.write('python -u plot_full_limited_uas_timeseries.py %s \\\n' % t_str)
+    fptr.write('                                              %s \\\n' % tag)
+    fptr.write('                                              %s/%s \n\n' % (param['paths']['osse_code'], in_yaml))
+
+    return None
+
+
+def write_superob_plot(fptr, param, in_yaml, t_str, tag):
+    """
+    Write commands to plot vertical profiles of raw UAS obs and UAS superobs
+
+    Parameters
+    ----------
+    fptr : file pointer
+        Batch script file pointer
+    param : dictionary
+        Dictionary containing parameters from synthetic_ob_creator_param.yml
+    in_yaml : string
+        YAML file with program parameters
+    t_str : string
+        prepBUFR time (YYYYMMDDHHMM)
+    tag : string
+        prepBUFR tag (e.g., 'rap')
+
+    Returns
+    -------
+    None
+
+    """
+
+    fptr.write('mkdir -p %s/%s\n' % (param['paths']['plots'], t_str))
+    fptr.write('cd %s/plotting\n' % param['paths']['osse_code'])
+    fptr.write('python -u plot_raw_superob_uas_vprofs.py %s \\\n' % t_str)
+    fptr.write('                                         %s \\\n' % tag)
+    fptr.write('                                         %s/%s \n\n' % (param['paths']['osse_code'], in_yaml))
+
+    return None
+
+
+def close_multi_cycle_file(fptr, post_fptr, param, in_yaml, group):
+    """
+    Finish a batch script that covers multiple prepBUFR times. The interpolator is run once for
+    all prepBUFR times, followed by the remaining components for each prepBUFR time
+
+    Parameters
+    ----------
+    fptr : file pointer
+        Batch script file pointer. Contains all components prior to the interpolator
+    post_fptr : io.StringIO
+        All components after the interpolator
+    param : dictionary
+        Dictionary containing parameters from synthetic_ob_creator_param.yml
+    in_yaml : string
+        YAML file with program parameters
+    group : dictionary
+        Contains the prepBUFR times ('bufr_t'), first and last UPP times ('wrf_start' and 
+        'wrf_end'), and prepBUFR tag ('tag') for this batch script
+
+    Returns
+    -------
+    None
+
+    """
+
+    write_interpolator(fptr, param, in_yaml, group['bufr_t'], group['wrf_start'], 
+                       group['wrf_end'], group['tag'])
+    fptr.write(post_fptr.getvalue())
+    close_file(fptr)
+
+    return None
+
+
 #---------------------------------------------------------------------------------------------------
 # Create Job Scripts
 #---------------------------------------------------------------------------------------------------
@@ -177,10 +403,38 @@ bufr_end_time = dt.datetime.strptime(param['shared']['bufr_end'], '%Y%m%d%H%M')
 while bufr_times[-1] < bufr_end_time:
     bufr_times.append(bufr_times[-1] + dt.timedelta(minutes=param['shared']['bufr_step']))
 
+# File format for intermediate observation files
+ob_fmt = param['shared']['ob_file_format']
+if ob_fmt not in ['csv', 'parquet']:
+    raise ValueError("ob_file_format must be 'csv' or 'parquet', not %s" % ob_fmt)
+
+# Option to run the interpolator and the components that follow it in a single process
+in_process = param['jobs']['in_process']
+if in_process and param['jobs']['use_rocoto']:
+    raise ValueError('in_process = True is not supported when use_rocoto = True')
+
+# seed, workers, and error_state are only used by the vectorized obs error engine
+if param['obs_errors']['use'] and (param['obs_errors']['engine'] == 'pyDA_utils'):
+    if ((param['obs_errors']['seed'] is not None) or (param['obs_errors']['workers'] != 1) or
+        (param['obs_errors']['error_state'] is not None)):
+        raise ValueError("obs_errors seed, workers, and error_state are not supported when engine = 'pyDA_utils'")
+
 # Keep track of job names if not using rocoto
 if not param['jobs']['use_rocoto']:
     j_names = []
 
+# Option to run the interpolator for multiple prepBUFR times in the same job so that each UPP file is
+# only read once per group of prepBUFR times. Each job contains all components for cycles_per_job 
+# prepBUFR times. Only supported when not using rocoto
+cycles_per_job = param['interpolator']['cycles_per_job']
+multi_cycle = param['interpolator']['use'] and (cycles_per_job > 1)
+if multi_cycle:
+    if param['jobs']['use_rocoto']:
+        raise ValueError('interpolator cycles_per_job > 1 is not supported when use_rocoto = True')
+    group_fptr = {}
+    group_post = {}
+    group_info = {}
+
 # Create job submission files
 for bufr_t in bufr_times:
 
@@ -206,6 +460,8 @@ for bufr_t in bufr_times:
         hr = hr - 0.25
 
     t_str = bufr_t.strftime('%Y%m%d%H%M')
+    last_in_group = (((bufr_times.index(bufr_t) + 1) % cycles_per_job == 0) or 
+                     (bufr_t == bufr_times[-1]))
     
     for tag in param['shared']['bufr_tag']:
 
@@ -217,17 +473,17 @@ for bufr_t in bufr_times:
                                                            bufr_t.strftime('%H'))
         real_csv_fname = '%s/%s.%s.prepbufr.csv' % (param['paths']['real_csv'], t_str, tag)
         fake_csv_bogus_fname = param['paths']['syn_bogus_csv'] + '/%s.' + tag + '.prepbufr.csv'
-        fake_csv_perf_fname = '%s/%s.%s.fake.prepbufr.csv' % (param['paths']['syn_perf_csv'], t_str, tag)
-        real_red_csv_fname = '%s/%s.%s.real_red.prepbufr.csv' % (param['paths']['syn_perf_csv'], t_str, tag)
-        in_csv_limit_uas_fname = '%s/%s.%s.fake.prepbufr.csv' % (param['paths'][param['limit_uas']['in_csv_dir']], t_str, tag)
-        fake_csv_limit_uas_fname = '%s/%s.%s.fake.prepbufr.csv' % (param['paths']['syn_limit_uas_csv'], t_str, tag)
-        fake_csv_err_fname = '%s/%s.%s.fake.prepbufr.csv' % (param['paths']['syn_err_csv'], t_str, tag)
+        fake_csv_perf_fname = '%s/%s.%s.fake.prepbufr.%s' % (param['paths']['syn_perf_csv'], t_str, tag, ob_fmt)
+        real_red_csv_fname = '%s/%s.%s.real_red.prepbufr.%s' % (param['paths']['syn_perf_csv'], t_str, tag, ob_fmt)
+        in_csv_limit_uas_fname = '%s/%s.%s.fake.prepbufr.%s' % (param['paths'][param['limit_uas']['in_csv_dir']], t_str, tag, ob_fmt)
+        fake_csv_limit_uas_fname = '%s/%s.%s.fake.prepbufr.%s' % (param['paths']['syn_limit_uas_csv'], t_str, tag, ob_fmt)
+        fake_csv_err_fname = '%s/%s.%s.fake.prepbufr.%s' % (param['paths']['syn_err_csv'], t_str, tag, ob_fmt)
         csv_comb_list_fname = '%s/combine_csv_list_%s_%s.txt' % (param['paths']['syn_combine_csv'], t_str, tag)
-        fake_csv_comb_fname = '%s/%s.%s.fake.prepbufr.csv' % (param['paths']['syn_combine_csv'], t_str, tag)
-        in_csv_select_fname = '%s/%s.%s.fake.prepbufr.csv' % (param['paths'][param['select_obs']['in_csv_dir']], t_str, tag)
-        fake_csv_select_fname = '%s/%s.%s.fake.prepbufr.csv' % (param['paths']['syn_select_csv'], t_str, tag)
-        in_csv_superob_fname = '%s/%s.%s.fake.prepbufr.csv' % (param['paths'][param['superobs']['in_csv_dir']], t_str, tag)
-        fake_csv_superob_fname = '%s/%s.%s.fake.prepbufr.csv' % (param['paths']['syn_superob_csv'], t_str, tag)
+        fake_csv_comb_fname = '%s/%s.%s.fake.prepbufr.%s' % (param['paths']['syn_combine_csv'], t_str, tag, ob_fmt)
+        in_csv_select_fname = '%s/%s.%s.fake.prepbufr.%s' % (param['paths'][param['select_obs']['in_csv_dir']], t_str, tag, ob_fmt)
+        fake_csv_select_fname = '%s/%s.%s.fake.prepbufr.%s' % (param['paths']['syn_select_csv'], t_str, tag, ob_fmt)
+        in_csv_superob_fname = '%s/%s.%s.fake.prepbufr.%s' % (param['paths'][param['superobs']['in_csv_dir']], t_str, tag, ob_fmt)
+        fake_csv_superob_fname = '%s/%s.%s.fake.prepbufr.%s' % (param['paths']['syn_superob_csv'], t_str, tag, ob_fmt)
         fake_bufr_fname = '%s/%s.%s.t%sz.prepbufr.tm00' % (param['paths']['syn_bufr'], 
                                                            bufr_t.strftime('%Y%m%d%H'),
                                                            tag,
@@ -236,12 +492,27 @@ for bufr_t in bufr_times:
                                                                bufr_t.strftime('%Y%m%d%H'),
                                                                tag,
                                                                bufr_t.strftime('%H'))
+        in_csv_real = '/'.join(in_csv_select_fname.split('/')[:-1] + 
+                               [in_csv_select_fname.split('/')[-1].replace('fake', 'real_red')])
+        out_csv_real = '/'.join(fake_csv_select_fname.split('/')[:-1] + 
+                                [fake_csv_select_fname.split('/')[-1].replace('fake', 'real_red')])
         convert_csv_fname = real_csv_fname
         if not os.path.isfile(real_bufr_fname):
+            if multi_cycle and last_in_group and (tag in group_fptr):
+                close_multi_cycle_file(group_fptr.pop(tag), group_post.pop(tag), param, in_yaml,
+                                       group_info.pop(tag))
             continue 
 
         # Create job script
-        if not param['jobs']['use_rocoto']:
+        if multi_cycle:
+            if tag not in group_fptr:
+                group_fptr[tag], batch_fname = init_file(param, t_str, tag)
+                group_post[tag] = io.StringIO()
+                group_info[tag] = {'bufr_t':[], 'wrf_start':wrf_start, 'wrf_end':wrf_end, 
+                                   'tag':tag}
+                j_names.append(batch_fname)
+            fptr = group_fptr[tag]
+        elif not param['jobs']['use_rocoto']:
             fptr, batch_fname = init_file(param, t_str, tag)
             j_names.append(batch_fname)
 
@@ -303,29 +574,37 @@ for bufr_t in bufr_times:
 
         if param['interpolator']['use']:
             if param['jobs']['use_rocoto']: fptr, batch_fname = init_file(param, t_str, tag, task='interpolator')
-            fptr.write('# Perform interpolation from model grid to obs location\n')
-            fptr.write('echo ""\n')
-            fptr.write('echo "=============================================================="\n')
-            fptr.write('echo "Perform interpolation from model grid to obs location"\n')
-            fptr.write('echo ""\n')
-            fptr.write('source %s/activate_python_env.sh\n' % param['paths']['osse_code'])
-            fptr.write('cd %s/main\n' % param['paths']['osse_code'])
-            fptr.write('echo "Using osse_ob_creator version `git describe`"\n')
-            fptr.write('python -u create_synthetic_obs.py %s \\\n' % param['paths']['model'])
-            if param['create_csv']['use']:
-                fptr.write('                                  %s \\\n' % param['paths']['syn_bogus_csv'])
-            else:
-                fptr.write('                                  %s \\\n' % param['paths']['real_csv'])
-            fptr.write('                                  %s \\\n' % param['paths']['syn_perf_csv'])
-            fptr.write('                                  %s \\\n' % bufr_t.strftime('%Y%m%d%H'))
-            fptr.write('                                  %s \\\n' % wrf_start.strftime('%Y%m%d%H%M'))
-            fptr.write('                                  %s \\\n' % wrf_end.strftime('%Y%m%d%H%M'))
-            fptr.write('                                  %s \\\n' % tag)
-            fptr.write('                                  %s/%s \n\n' % (param['paths']['osse_code'], in_yaml))
+            if multi_cycle:
+                # The interpolator is run for all prepBUFR times in this group once the last 
+                # prepBUFR time is reached. Remaining components are written to a buffer that is 
+                # appended to the batch script after the interpolator
+                group_info[tag]['bufr_t'].append(bufr_t)
+                group_info[tag]['wrf_start'] = min(group_info[tag]['wrf_start'], wrf_start)
+                group_info[tag]['wrf_end'] = max(group_info[tag]['wrf_end'], wrf_end)
+                fptr = group_post[tag]
+            elif not in_process:
+                write_interpolator(fptr, param, in_yaml, [bufr_t], wrf_start, wrf_end, tag)
             convert_csv_fname = fake_csv_perf_fname        
             if param['jobs']['use_rocoto']: close_file(fptr)
 
-        if param['obs_errors']['use']:
+        if in_process:
+            # The interpolator is run by run_pipeline.py unless it is run for multiple prepBUFR times
+            if param['interpolator']['use'] and not multi_cycle:
+                write_run_pipeline(fptr, param, in_yaml, t_str, tag, wrf_start=wrf_start, 
+                                   wrf_end=wrf_end)
+            else:
+                write_run_pipeline(fptr, param, in_yaml, t_str, tag)
+            for c, fname in zip(['obs_errors', 'limit_uas', 'combine_csv', 'select_obs', 'superobs'],
+                                [fake_csv_err_fname, fake_csv_limit_uas_fname, fake_csv_comb_fname,
+                                 fake_csv_select_fname, fake_csv_superob_fname]):
+                if param[c]['use']:
+                    convert_csv_fname = fname
+            if param['limit_uas']['use'] and param['limit_uas']['plot_timeseries']['use']:
+                write_limit_uas_plot(fptr, param, in_yaml, t_str, tag)
+            if param['superobs']['use'] and param['superobs']['plot_vprof']['use']:
+                write_superob_plot(fptr, param, in_yaml, t_str, tag)
+
+        if param['obs_errors']['use'] and not in_process:
             if param['jobs']['use_rocoto']: fptr, batch_fname = init_file(param, t_str, tag, task='obs_errors')
             fptr.write('# Add observation errors\n')
             fptr.write('echo ""\n')
@@ -333,21 +612,21 @@ for bufr_t in bufr_times:
             fptr.write('echo "Add observation errors"\n')
             fptr.write('echo ""\n')
             fptr.write('source %s/activate_python_env.sh\n' % param['paths']['osse_code'])
-            fptr.write('ln -sf %s %s/%s.%s.input.csv\n' % (fake_csv_perf_fname,
+            fptr.write('ln -sf %s %s/%s.%s.input.%s\n' % (fake_csv_perf_fname,
                                                            param['paths']['syn_err_csv'], 
-                                                           t_str, tag))
+                                                           t_str, tag, ob_fmt))
             fptr.write('cd %s/main\n' % param['paths']['osse_code'])
             fptr.write('echo "Using osse_ob_creator version `git describe`"\n')
             fptr.write('python -u add_obs_errors.py %s \\\n' % t_str)
             fptr.write('                            %s \\\n' % tag)
             fptr.write('                            %s/%s \n' % (param['paths']['osse_code'], in_yaml))
-            fptr.write('mv %s/%s.%s.output.csv %s\n\n' % (param['paths']['syn_err_csv'], 
-                                                          t_str, tag, 
+            fptr.write('mv %s/%s.%s.output.%s %s\n\n' % (param['paths']['syn_err_csv'], 
+                                                          t_str, tag, ob_fmt, 
                                                           fake_csv_err_fname))
             convert_csv_fname = fake_csv_err_fname        
             if param['jobs']['use_rocoto']: close_file(fptr)
 
-        if param['limit_uas']['use']:
+        if param['limit_uas']['use'] and not in_process:
             if param['jobs']['use_rocoto']: fptr, batch_fname = init_file(param, t_str, tag, task='limit_uas')
             fptr.write('# Limiting UAS flights\n')
             fptr.write('echo ""\n')
@@ -355,33 +634,29 @@ for bufr_t in bufr_times:
             fptr.write('echo "Limiting UAS flights"\n')
             fptr.write('echo ""\n')
             fptr.write('source %s/activate_python_env.sh\n' % param['paths']['osse_code'])
-            fptr.write('ln -sf %s %s/%s.%s.input.csv\n' % (in_csv_limit_uas_fname,
+            fptr.write('ln -sf %s %s/%s.%s.input.%s\n' % (in_csv_limit_uas_fname,
                                                            param['paths']['syn_limit_uas_csv'], 
-                                                           t_str, tag))
+                                                           t_str, tag, ob_fmt))
             fptr.write('cd %s/main\n' % param['paths']['osse_code'])
             fptr.write('echo "Using osse_ob_creator version `git describe`"\n')
             fptr.write('python -u limit_uas_flights.py %s \\\n' % t_str)
             fptr.write('                               %s \\\n' % tag)
             fptr.write('                               %s/%s \n' % (param['paths']['osse_code'], in_yaml))
-            fptr.write('mv %s/%s.%s.output.csv %s\n\n' % (param['paths']['syn_limit_uas_csv'], 
-                                                          t_str, tag, 
+            fptr.write('mv %s/%s.%s.output.%s %s\n\n' % (param['paths']['syn_limit_uas_csv'], 
+                                                          t_str, tag, ob_fmt, 
                                                           fake_csv_limit_uas_fname))
             if param['limit_uas']['plot_timeseries']['use']:
-                fptr.write('mkdir -p %s/%s\n' % (param['paths']['plots'], t_str))
-                fptr.write('cd %s/plotting\n' % param['paths']['osse_code'])
-                fptr.write('python -u plot_full_limited_uas_timeseries.py %s \\\n' % t_str)
-                fptr.write('                                              %s \\\n' % tag)
-                fptr.write('                                              %s/%s \n\n' % (param['paths']['osse_code'], in_yaml))
+                write_limit_uas_plot(fptr, param, in_yaml, t_str, tag)
             convert_csv_fname = fake_csv_limit_uas_fname        
             if param['jobs']['use_rocoto']: close_file(fptr)
 
-        if param['combine_csv']['use']:
+        if param['combine_csv']['use'] and not in_process:
             if param['jobs']['use_rocoto']: fptr, batch_fname = init_file(param, t_str, tag, task='combine_csv')
 
             # First, create file with CSV file names to be combined
             comb_fptr = open(csv_comb_list_fname, 'w')
             for d in param['combine_csv']['csv_dirs']:
-                comb_fptr.write('%s/%s.%s.fake.prepbufr.csv\n' % (d, t_str, tag))
+                comb_fptr.write('%s/%s.%s.fake.prepbufr.%s\n' % (d, t_str, tag, ob_fmt))
             comb_fptr.close()
 
             fptr.write('# Combine CSV files\n')
@@ -397,7 +672,7 @@ for bufr_t in bufr_times:
             convert_csv_fname = fake_csv_comb_fname        
             if param['jobs']['use_rocoto']: close_file(fptr)
         
-        if param['select_obs']['use']:
+        if param['select_obs']['use'] and not in_process:
             if param['jobs']['use_rocoto']: fptr, batch_fname = init_file(param, t_str, tag, task='select_obs')
             fptr.write('# Only select certain ob types for CSV files\n')
             fptr.write('echo ""\n')
@@ -411,17 +686,13 @@ for bufr_t in bufr_times:
             fptr.write('                            %s \\\n' % fake_csv_select_fname)
             fptr.write('                            %s/%s \n' % (param['paths']['osse_code'], in_yaml))
             if param['select_obs']['include_real_red']:
-                in_csv_real = '/'.join(in_csv_select_fname.split('/')[:-1] + 
-                                       [in_csv_select_fname.split('/')[-1].replace('fake', 'real_red')])
-                out_csv_real = '/'.join(fake_csv_select_fname.split('/')[:-1] + 
-                                        [fake_csv_select_fname.split('/')[-1].replace('fake', 'real_red')])
                 fptr.write('python -u select_obtypes.py %s \\\n' % in_csv_real)
                 fptr.write('                            %s \\\n' % out_csv_real)
                 fptr.write('                            %s/%s \n\n' % (param['paths']['osse_code'], in_yaml))
             convert_csv_fname = fake_csv_select_fname        
             if param['jobs']['use_rocoto']: close_file(fptr)
 
-        if param['superobs']['use']:
+        if param['superobs']['use'] and not in_process:
             if param['jobs']['use_rocoto']: fptr, batch_fname = init_file(param, t_str, tag, task='superobs')
             fptr.write('# Creating superobs\n')
             fptr.write('echo ""\n')
@@ -429,23 +700,19 @@ for bufr_t in bufr_times:
             fptr.write('echo "Create superobs"\n')
             fptr.write('echo ""\n')
             fptr.write('source %s/activate_python_env.sh\n' % param['paths']['osse_code'])
-            fptr.write('ln -sf %s %s/%s.%s.input.csv\n' % (in_csv_superob_fname,
+            fptr.write('ln -sf %s %s/%s.%s.input.%s\n' % (in_csv_superob_fname,
                                                            param['paths']['syn_superob_csv'], 
-                                                           t_str, tag))
+                                                           t_str, tag, ob_fmt))
             fptr.write('cd %s/main\n' % param['paths']['osse_code'])
             fptr.write('echo "Using osse_ob_creator version `git describe`"\n')
             fptr.write('python -u create_superobs.py %s \\\n' % t_str)
             fptr.write('                             %s \\\n' % tag)
             fptr.write('                             %s/%s \n' % (param['paths']['osse_code'], in_yaml))
-            fptr.write('mv %s/%s.%s.output.csv %s\n\n' % (param['paths']['syn_superob_csv'], 
-                                                          t_str, tag, 
+            fptr.write('mv %s/%s.%s.output.%s %s\n\n' % (param['paths']['syn_superob_csv'], 
+                                                          t_str, tag, ob_fmt, 
                                                           fake_csv_superob_fname))
             if param['superobs']['plot_vprof']['use']:
-                fptr.write('mkdir -p %s/%s\n' % (param['paths']['plots'], t_str))
-                fptr.write('cd %s/plotting\n' % param['paths']['osse_code'])
-                fptr.write('python -u plot_raw_superob_uas_vprofs.py %s \\\n' % t_str)
-                fptr.write('                                         %s \\\n' % tag)
-                fptr.write('                                         %s/%s \n\n' % (param['paths']['osse_code'], in_yaml))
+                write_superob_plot(fptr, param, in_yaml, t_str, tag)
             convert_csv_fname = fake_csv_superob_fname        
             if param['jobs']['use_rocoto']: close_file(fptr)
 
@@ -461,7 +728,7 @@ for bufr_t in bufr_times:
             fptr.write('cd tmp_%s_%s\n' % (t_str, tag))
             fptr.write('cp -r %s/bin/* .\n' % param['paths']['bufr_code']) 
             fptr.write('source %s/env/bufr_%s.env\n' % (param['paths']['bufr_code'], param['shared']['machine']))
-            fptr.write('cp %s ./prepbufr.csv \n' % convert_csv_fname)
+            write_prepbufr_csv(fptr, param, convert_csv_fname)
             fptr.write('./prepbufr_encode_csv.x\n')
             fptr.write('mv ./prepbufr %s\n' % fake_bufr_fname)
             fptr.write('cd ..\n')
@@ -481,9 +748,9 @@ for bufr_t in bufr_times:
             fptr.write('cp -r %s/bin/* .\n' % param['paths']['bufr_code']) 
             fptr.write('source %s/env/bufr_%s.env\n' % (param['paths']['bufr_code'], param['shared']['machine']))
             if param['select_obs']['use'] and param['select_obs']['include_real_red']:
-                fptr.write('cp %s ./prepbufr.csv \n' % out_csv_real)
+                write_prepbufr_csv(fptr, param, out_csv_real)
             else:
-                fptr.write('cp %s ./prepbufr.csv \n' % real_red_csv_fname)
+                write_prepbufr_csv(fptr, param, real_red_csv_fname)
             fptr.write('./prepbufr_encode_csv.x\n')
             fptr.write('mv ./prepbufr %s\n' % real_red_bufr_fname)
             fptr.write('cd ..\n')
@@ -514,7 +781,12 @@ for bufr_t in bufr_times:
                 fptr.write('                               %s \\\n' % t_str)
                 fptr.write('                               %s/%s \n\n' % (param['paths']['osse_code'], in_yaml))
 
-        close_file(fptr)
+        if multi_cycle:
+            if last_in_group:
+                close_multi_cycle_file(group_fptr.pop(tag), group_post.pop(tag), param, in_yaml,
+                                       group_info.pop(tag))
+        else:
+            close_file(fptr)
   
 if param['jobs']['use_rocoto']:
     # Change bash script permissions and create rocoto workflow
@@ -31,143 +31,160 @@ import metpy.calc as mc
 from metpy.units import units
 
 import pyDA_utils.meteo_util as mu
-import pyDA_utils.gsi_fcts as gf
 import pyDA_utils.bufr as bufr
 
-
-#---------------------------------------------------------------------------------------------------
-# Input Parameters
-#---------------------------------------------------------------------------------------------------
-
-# Input and output file names
-in_fnames = ['/work2/noaa/wrfruc/murdzek/real_obs/obs_rap_csv/202205030000.rap.prepbufr.csv']
-out_fnames = ['./tmp.prepbufr.csv']
-
-errtable = '/work2/noaa/wrfruc/murdzek/real_obs/errtable.rrfs'
-
-# Observation types to use autocorrelated errors for
-autocor_POB_obs = [120, 220]
-autocor_DHR_obs = [130, 131, 133, 134, 135, 230, 231, 233, 234, 235]
-autocor_ZOB_partition_DHR_obs = [126, 223, 224, 227, 228, 229]
-auto_reg_parm = 0.5
-
-# Verbose output when adding obs errors?
-verbose = False
-
-# Option to perform dewpoint check (i.e., is the dewpoint consistent with the errors added to TOB 
-# and QOB?)
-dewpt_check = False
-
-# Option to check obs errors by plotting differences between obs w/ and w/out errors (plots will
-# be made for the last BUFR CSV file)
-plot_diff_hist = False
-plot_dir = './'
-
-# Option to check autocorrelated obs errors by plotting timeseries or vertical profiles of errors
-# from a single station (plots will be made for the last BUFR CSV file)
-check_autocorr_err = False
-timeseries_ob_types = [133,           135,           233,           235]
-timeseries_stations = ['3OXWUWJA', 'CNJCA111', '3OXWUWJA', 'CNJCA111']
-vprof_ob_types = [120,     120,     220,     220]
-vprof_stations = ['72520', '72476', '72520', '72476']
-
-# Option to check autocorrelated obs errors with DHR partitioning by creating 2D plots of errors
-# from a single station (plots will be made for the last BUFR CSV file)
-check_autocorr_partition_err = False
-autocorr_partition_ob_types = [126, 224, 227]
-autocorr_partition_stations = ['SLDUT', 'KFDX', 'CFDUT']
-
-# Option to use inputs from YAML file
-if len(sys.argv) > 1:
-    bufr_t = sys.argv[1]
-    tag = sys.argv[2]
-    with open(sys.argv[3], 'r') as fptr:
-        param = yaml.safe_load(fptr)
-    in_fnames = ['%s/%s.%s.input.csv' % (param['paths']['syn_err_csv'], bufr_t, tag)]
-    out_fnames = ['%s/%s.%s.output.csv' % (param['paths']['syn_err_csv'], bufr_t, tag)]
-    errtable = param['obs_errors']['errtable']
-    autocor_POB_obs = param['obs_errors']['autocor_POB_obs']
-    autocor_DHR_obs = param['obs_errors']['autocor_DHR_obs']
-    autocor_ZOB_partition_DHR_obs = param['obs_errors']['autocor_ZOB_partition_DHR_obs']
-    auto_reg_parm = param['obs_errors']['auto_reg_parm']
-    verbose = param['obs_errors']['verbose']
-    dewpt_check = param['obs_errors']['dewpt_check']
-    plot_diff_hist = param['obs_errors']['plot_diff_hist']
-    plot_dir = '%s/err_diff_plots' % param['paths']['plots']
-    if plot_diff_hist:
-        os.system('mkdir -p %s' % plot_dir)
+import ob_io
+import obs_err_utils as oeu
+import errtable_index as eti
+import err_stats as es
 
 
 #---------------------------------------------------------------------------------------------------
-# Add Observation Errors
+# Functions
 #---------------------------------------------------------------------------------------------------
 
-start = dt.datetime.now()
-print('start time = %s' % start.strftime('%H:%M:%S'))
-
-for i, (in_name, out_name) in enumerate(zip(in_fnames, out_fnames)):
-
-    print('-------------------------------------------------')
-    print('file %d of %d' % (i+1, len(in_fnames)))
-    cycle_start = dt.datetime.now()
-
-    in_csv = bufr.bufrCSV(in_name)
+def add_obs_errors(df, errtable, autocor_POB_obs=[], autocor_DHR_obs=[], 
+                   autocor_ZOB_partition_DHR_obs=[], auto_reg_parm=0.5, verbose=False,
+                   engine='pyDA_utils', seed=None, cycle=0, workers=1, state_file=None,
+                   stats=None):
+    """
+    Add random observation errors to perfect synthetic observations
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Perfect synthetic observations
+    errtable : string or errtable_index.errtableIndex
+        GSI errtable file (or errtable index) containing the observation error standard deviations
+    autocor_POB_obs : list of integers, optional
+        Observation types with errors that are autocorrelated in the vertical (using POB)
+    autocor_DHR_obs : list of integers, optional
+        Observation types with errors that are autocorrelated in time (using DHR)
+    autocor_ZOB_partition_DHR_obs : list of integers, optional
+        Observation types with errors that are autocorrelated in the vertical (using ZOB), with 
+        separate profiles identified using DHR
+    auto_reg_parm : float, optional
+        Autoregression parameter for autocorrelated errors
+    verbose : boolean, optional
+        Option for verbose output
+    engine : string, optional
+        Method used to add the errors. Options:
+            'pyDA_utils' : Use pyDA_utils.bufr.add_obs_err
+            'vectorized' : Use the vectorized AR1 engine in obs_err_utils.py
+    seed : integer, optional
+        Base seed for the random error streams (vectorized engine only). A random seed is used if
+        None
+    cycle : integer or string, optional
+        Cycle time (YYYYMMDDHHMM). Used with seed to create the random error streams (vectorized
+        engine only)
+    workers : integer, optional
+        Number of processes used to add errors (vectorized engine only). Results do not depend on
+        the number of processes
+    state_file : string, optional
+        Parquet file used to continue errors in autocor_DHR_obs from one cycle to the next
+        (vectorized engine only). Set to None to restart the errors each cycle
+    stats : err_stats.errStats, optional
+        Statistics of the errors added to each observed variable are accumulated in stats
+
+    Returns
+    -------
+    out_df : pd.DataFrame
+        Observations with random errors added
+
+    """
+
+    # Parse the errtable once so it can be shared by all error passes
+    if isinstance(errtable, str):
+        errtable = eti.read_errtable(errtable, verbose=verbose)
+
+    if engine == 'vectorized':
+        out_df = oeu.add_obs_errors_vectorized(df, errtable, autocor_POB_obs=autocor_POB_obs,
+                                               autocor_DHR_obs=autocor_DHR_obs,
+                                               autocor_ZOB_partition_DHR_obs=autocor_ZOB_partition_DHR_obs,
+                                               auto_reg_parm=auto_reg_parm, verbose=verbose,
+                                               seed=seed, cycle=cycle, workers=workers,
+                                               state_file=state_file, stats=stats)
+        return bufr.match_bufr_prec(out_df)
+    elif engine != 'pyDA_utils':
+        raise ValueError('engine must be pyDA_utils or vectorized, not %s' % engine)
+    if (seed is not None) or (workers != 1) or (state_file is not None):
+        raise ValueError('seed, workers, and error_state are only supported by the vectorized engine')
 
     remaining_obs = []
-    for o in np.int32(in_csv.df['TYP'].unique()):
+    for o in np.int32(df['TYP'].unique()):
         if ((o not in autocor_POB_obs) and (o not in autocor_DHR_obs) and 
             (o not in autocor_ZOB_partition_DHR_obs)):
             remaining_obs.append(o)
 
-    #in_csv.df = in_csv.df.loc[in_csv.df['TYP'] == 192]
-    #in_csv.df = in_csv.df.iloc[:10]
-    #in_csv.df.reset_index(inplace=True, drop=True)
-    #out_df = bufr.add_obs_err(in_csv.df, errtable, ob_typ=[192], verbose=verbose)
-
-    # Add random errors
-    out_df = bufr.add_obs_err(in_csv.df, errtable, ob_typ=autocor_POB_obs, correlated='POB', 
+    # Add random errors. pyDA_utils reads the errtable file itself
+    errtable_fname = errtable.fname
+    out_df = bufr.add_obs_err(df, errtable_fname, ob_typ=autocor_POB_obs, correlated='POB', 
                               auto_reg_parm=auto_reg_parm, min_d=10., verbose=verbose)
-    out_df = bufr.add_obs_err(out_df, errtable, ob_typ=autocor_DHR_obs, correlated='DHR', 
+    out_df = bufr.add_obs_err(out_df, errtable_fname, ob_typ=autocor_DHR_obs, correlated='DHR', 
                               auto_reg_parm=auto_reg_parm, verbose=verbose)
-    out_df = bufr.add_obs_err(out_df, errtable, ob_typ=autocor_ZOB_partition_DHR_obs, 
+    out_df = bufr.add_obs_err(out_df, errtable_fname, ob_typ=autocor_ZOB_partition_DHR_obs, 
                               correlated='DHR', partition_dim='DHR',
                               auto_reg_parm=auto_reg_parm, min_d=50., verbose=verbose)
-    out_df = bufr.add_obs_err(out_df, errtable, ob_typ=remaining_obs, verbose=verbose)
+    out_df = bufr.add_obs_err(out_df, errtable_fname, ob_typ=remaining_obs, verbose=verbose)
 
     # Make precision match what is typically found in a prepBUFR file
     out_df = bufr.match_bufr_prec(out_df)
 
-    bufr.df_to_csv(out_df, out_name)
+    if stats is not None:
+        oeu.update_stats_from_diff(stats, errtable, df, out_df)
 
-    print('time = %.2f s' % (dt.datetime.now() - cycle_start).total_seconds())
+    return out_df
 
-end = dt.datetime.now()
-print('elapsed time = %s s' % (end - start).total_seconds()) 
 
+def dewpt_check_rmse(df):
+    """
+    Check whether TDO is consistent with the errors added to TOB and QOB by computing the RMSE 
+    between TDO and the dewpoint computed using RH
 
-#---------------------------------------------------------------------------------------------------
-# Dewpoint Check
-#---------------------------------------------------------------------------------------------------
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Observations with random errors added
 
-out_df = bufr.compute_RH(out_df)
-out_df = bufr.compute_Tsens(out_df)
-Td_from_RH = mc.dewpoint_from_relative_humidity(out_df['Tsens'].values * units.degC, 
-                                                out_df['RHOB'].values * 0.01).to('degC').magnitude
-Td_rmse = np.sqrt(np.nanmean((Td_from_RH - out_df['TDO'])**2))
+    Returns
+    -------
+    Td_rmse : float
+        Dewpoint RMSE (deg C)
 
-print()
-print('Td RMSE (TDO vs. Td computed w/ RH) = %.3e degC' % Td_rmse)
-print()
+    """
 
+    df = bufr.compute_RH(df.copy())
+    df = bufr.compute_Tsens(df)
+    Td_from_RH = mc.dewpoint_from_relative_humidity(df['Tsens'].values * units.degC, 
+                                                    df['RHOB'].values * 0.01).to('degC').magnitude
+    Td_rmse = np.sqrt(np.nanmean((Td_from_RH - df['TDO'])**2))
 
-#---------------------------------------------------------------------------------------------------
-# Plot Histograms of Differences
-#---------------------------------------------------------------------------------------------------
+    return Td_rmse
+
+
+def plot_err_diff_hist(in_csv, out_df, errtable, plot_dir):
+    """
+    Plot histograms of the differences between the perfect obs and obs with added errors
+
+    Parameters
+    ----------
+    in_csv : bufr.bufrCSV
+        Perfect observations. RHOB is added to in_csv.df
+    out_df : pd.DataFrame
+        Observations with random errors added
+    errtable : string or errtable_index.errtableIndex
+        GSI errtable file (or errtable index) containing the observation error standard deviations
+    plot_dir : string
+        Output directory for plots
 
-obs_err_names = {'TOB':'Terr', 'RHOB':'RHerr', 'UOB':'UVerr', 'VOB':'UVerr', 'PRSS':'PSerr', 
-                'PWO':'PWerr', 'PMO':'PSerr'}
+    Returns
+    -------
+    None
 
-if plot_diff_hist:
+    """
+
+    obs_err_names = {'TOB':'Terr', 'RHOB':'RHerr', 'UOB':'UVerr', 'VOB':'UVerr', 'PRSS':'PSerr', 
+                    'PWO':'PWerr', 'PMO':'PSerr'}
 
     # Compute RH
     in_csv.df = bufr.compute_RH(in_csv.df)
@@ -176,8 +193,10 @@ if plot_diff_hist:
     in_csv.meta['RHOB']['units'] = '%'
 
     # Read in error tables
-    etable = gf.read_errtable(errtable)
-    eprs = etable[100]['prs'].values
+    if isinstance(errtable, str):
+        errtable = eti.read_errtable(errtable)
+    etable = errtable.to_dict()
+    eprs = errtable.prs(100)
     for e in etable.keys():
         etable[e]['RHerr'] = etable[e]['RHerr'] * 10
     typ = out_df['TYP'].unique()
@@ -230,8 +249,9 @@ if plot_diff_hist:
                 maxval = np.amax(np.abs(diff))
                 bins = np.linspace(-maxval - (0.25*maxval), maxval + (0.25*maxval), 22)
                 eprs_plt = (eprs[1:] + eprs[:-1]) / 2.
+                kbin = errtable.prs_bin(prs, typ=100)
                 for k in range(len(eprs)-1):
-                    idx = np.where(np.logical_and(prs <= eprs[k], prs > eprs[k+1]))[0]
+                    idx = np.where(kbin == k)[0]
                     if len(idx) == 0:
                         continue  
                     cts[k, :] = np.histogram(diff[idx], bins=bins)[0]
@@ -285,12 +305,161 @@ if plot_diff_hist:
         plt.savefig('%s/diff_hist_%d.png' % (plot_dir, t))
         plt.close()
 
+    return None
+
+
+#---------------------------------------------------------------------------------------------------
+# Input Parameters
+#---------------------------------------------------------------------------------------------------
+
+# Input and output file names
+in_fnames = ['/work2/noaa/wrfruc/murdzek/real_obs/obs_rap_csv/202205030000.rap.prepbufr.csv']
+out_fnames = ['./tmp.prepbufr.csv']
+
+errtable = '/work2/noaa/wrfruc/murdzek/real_obs/errtable.rrfs'
+
+# Observation types to use autocorrelated errors for
+autocor_POB_obs = [120, 220]
+autocor_DHR_obs = [130, 131, 133, 134, 135, 230, 231, 233, 234, 235]
+autocor_ZOB_partition_DHR_obs = [126, 223, 224, 227, 228, 229]
+auto_reg_parm = 0.5
+
+# Method used to add errors ('pyDA_utils' or 'vectorized'). The vectorized engine generates the
+# autocorrelated errors for all stations at once (see obs_err_utils.py)
+engine = 'pyDA_utils'
+
+# Seed for random errors and number of processes (vectorized engine only). Each (cycle, TYP, error
+# pass, SID) has its own random stream, so the errors do not depend on the number of processes. A
+# random seed is used if seed = None
+seed = None
+workers = 1
+
+# Parquet file used to continue time-correlated errors across cycles (vectorized engine only). Set
+# to None to restart the errors each cycle
+error_state = None
+
+# Verbose output when adding obs errors?
+verbose = False
+
+# Option to perform dewpoint check (i.e., is the dewpoint consistent with the errors added to TOB 
+# and QOB?)
+dewpt_check = False
+
+# Option to save statistics of the added errors for each ob type, variable, and pressure bin to
+# stats_dir (one file per BUFR CSV file). Statistics from many files can be combined using
+# plotting/plot_err_stats.py. Set to None to not save statistics
+stats_dir = None
+
+# Option to check obs errors by plotting differences between obs w/ and w/out errors (plots will
+# be made for the last BUFR CSV file)
+plot_diff_hist = False
+plot_dir = './'
+
+# Option to check autocorrelated obs errors by plotting timeseries or vertical profiles of errors
+# from a single station (plots will be made for the last BUFR CSV file)
+check_autocorr_err = False
+timeseries_ob_types = [133,           135,           233,           235]
+timeseries_stations = ['3OXWUWJA', 'CNJCA111', '3OXWUWJA', 'CNJCA111']
+vprof_ob_types = [120,     120,     220,     220]
+vprof_stations = ['72520', '72476', '72520', '72476']
+
+# Option to check autocorrelated obs errors with DHR partitioning by creating 2D plots of errors
+# from a single station (plots will be made for the last BUFR CSV file)
+check_autocorr_partition_err = False
+autocorr_partition_ob_types = [126, 224, 227]
+autocorr_partition_stations = ['SLDUT', 'KFDX', 'CFDUT']
+
+# Option to use inputs from YAML file
+if (__name__ == '__main__') and (len(sys.argv) > 1):
+    bufr_t = sys.argv[1]
+    tag = sys.argv[2]
+    with open(sys.argv[3], 'r') as fptr:
+        param = yaml.safe_load(fptr)
+    ob_fmt = param['shared']['ob_file_format']
+    in_fnames = ['%s/%s.%s.input.%s' % (param['paths']['syn_err_csv'], bufr_t, tag, ob_fmt)]
+    out_fnames = ['%s/%s.%s.output.%s' % (param['paths']['syn_err_csv'], bufr_t, tag, ob_fmt)]
+    errtable = param['obs_errors']['errtable']
+    autocor_POB_obs = param['obs_errors']['autocor_POB_obs']
+    autocor_DHR_obs = param['obs_errors']['autocor_DHR_obs']
+    autocor_ZOB_partition_DHR_obs = param['obs_errors']['autocor_ZOB_partition_DHR_obs']
+    auto_reg_parm = param['obs_errors']['auto_reg_parm']
+    engine = param['obs_errors']['engine']
+    seed = param['obs_errors']['seed']
+    workers = param['obs_errors']['workers']
+    error_state = param['obs_errors']['error_state']
+    verbose = param['obs_errors']['verbose']
+    dewpt_check = param['obs_errors']['dewpt_check']
+    stats_dir = param['obs_errors']['stats_dir']
+    plot_diff_hist = param['obs_errors']['plot_diff_hist']
+    plot_dir = '%s/err_diff_plots' % param['paths']['plots']
+    if plot_diff_hist:
+        os.system('mkdir -p %s' % plot_dir)
+
+
+#---------------------------------------------------------------------------------------------------
+# Add Observation Errors
+#---------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    start = dt.datetime.now()
+    print('start time = %s' % start.strftime('%H:%M:%S'))
+
+    # Read errtable once (cached index is reused if the errtable has not changed)
+    errtable = eti.read_errtable(errtable, verbose=verbose)
+
+    for i, (in_name, out_name) in enumerate(zip(in_fnames, out_fnames)):
+
+        print('-------------------------------------------------')
+        print('file %d of %d' % (i+1, len(in_fnames)))
+        cycle_start = dt.datetime.now()
+
+        in_csv = ob_io.read_ob_file(in_name)
+        if stats_dir is not None:
+            stats = es.errStats(errtable.prs(), oeu.OB_ERR_NAMES.keys())
+        else:
+            stats = None
+        out_df = add_obs_errors(in_csv.df, errtable, autocor_POB_obs=autocor_POB_obs, 
+                                autocor_DHR_obs=autocor_DHR_obs,
+                                autocor_ZOB_partition_DHR_obs=autocor_ZOB_partition_DHR_obs,
+                                auto_reg_parm=auto_reg_parm, verbose=verbose,
+                                engine=engine, seed=seed, workers=workers,
+                                cycle=os.path.basename(in_name).split('.')[0],
+                                state_file=error_state, stats=stats)
+        ob_io.write_ob_file(out_df, out_name)
+        if stats_dir is not None:
+            os.makedirs(stats_dir, exist_ok=True)
+            stats.save(es.stats_fname(stats_dir, out_name))
+
+        print('time = %.2f s' % (dt.datetime.now() - cycle_start).total_seconds())
+
+    end = dt.datetime.now()
+    print('elapsed time = %s s' % (end - start).total_seconds()) 
+
+
+#---------------------------------------------------------------------------------------------------
+# Dewpoint Check
+#---------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    print()
+    print('Td RMSE (TDO vs. Td computed w/ RH) = %.3e degC' % dewpt_check_rmse(out_df))
+    print()
+
+
+#---------------------------------------------------------------------------------------------------
+# Plot Histograms of Differences
+#---------------------------------------------------------------------------------------------------
+
+if (__name__ == '__main__') and plot_diff_hist:
+    plot_err_diff_hist(in_csv, out_df, errtable, plot_dir)
+
 
 #---------------------------------------------------------------------------------------------------
 # Plot Timeseries and Vertical Profiles from a Single Station
 #---------------------------------------------------------------------------------------------------
 
-if check_autocorr_err:
+if (__name__ == '__main__') and check_autocorr_err:
 
     # Compute RH
     in_csv.df = bufr.compute_RH(in_csv.df)
@@ -390,7 +559,7 @@ if check_autocorr_err:
 # Plot Errors From Stations With Autocorrelation and Partitioning with DHR
 #---------------------------------------------------------------------------------------------------
 
-if check_autocorr_partition_err:
+if (__name__ == '__main__') and check_autocorr_partition_err:
 
     # Compute RH
     in_csv.df = bufr.compute_RH(in_csv.df)
@@ -2,8 +2,8 @@
 Combine An Arbitrary Number of BUFR CSV Files
 
 Optional command-line arguments:
-    argv[1] = Text file containing names of input prepBUFR CSV files
-    argv[2] = Name of combined prepBUFR CSV file
+    argv[1] = Text file containing names of input prepBUFR CSV (or Parquet) files
+    argv[2] = Name of combined prepBUFR CSV (or Parquet) file
 
 shawn.s.murdzek@noaa.gov
 Date Created: 25 July 2023
@@ -18,6 +18,33 @@ import sys
 
 import pyDA_utils.bufr as bufr
 
+import ob_io
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def combine_obs(df_list):
+    """
+    Combine observations from several prepBUFR DataFrames
+
+    Parameters
+    ----------
+    df_list : list of pd.DataFrame
+        Observations to combine
+
+    Returns
+    -------
+    out_df : pd.DataFrame
+        Combined observations
+
+    """
+
+    out_df = bufr.combine_bufr(df_list)
+
+    return out_df
+
 
 #---------------------------------------------------------------------------------------------------
 # Input Parameters
@@ -27,7 +54,7 @@ bufr_list_fname = ''
 output_fname = ''
 
 # Option to use command-line arguments
-if len(sys.argv) > 1:
+if (__name__ == '__main__') and (len(sys.argv) > 1):
     bufr_list_fname = sys.argv[1]
     output_fname = sys.argv[2]
 
@@ -36,16 +63,18 @@ if len(sys.argv) > 1:
 # Combine CSV Files
 #---------------------------------------------------------------------------------------------------
 
-# Extract BUFR CSV file names to combine
-csv_in_list = []
-fptr = open(bufr_list_fname, 'r')
-for l in fptr:
-    csv_in_list.append(bufr.bufrCSV(l.strip()).df)
-fptr.close()
+if __name__ == '__main__':
+
+    # Extract BUFR CSV file names to combine
+    csv_in_list = []
+    fptr = open(bufr_list_fname, 'r')
+    for l in fptr:
+        csv_in_list.append(ob_io.read_ob_file(l.strip()).df)
+    fptr.close()
 
-# Combine BUFR CSV files
-out_csv = bufr.combine_bufr(csv_in_list)
-bufr.df_to_csv(out_csv, output_fname)
+    # Combine BUFR CSV files
+    out_csv = combine_obs(csv_in_list)
+    ob_io.write_ob_file(out_csv, output_fname)
 
 
 """
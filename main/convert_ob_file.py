@@ -0,0 +1,36 @@
+"""
+Convert an Observation File Between CSV and Parquet Formats
+
+Used to convert intermediate Parquet files to prepBUFR CSV files, which are needed by 
+prepbufr_encode_csv.x. The format of each file is determined by the file extension.
+
+Command-line arguments:
+    argv[1] = Input observation file
+    argv[2] = Output observation file
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import sys
+
+import ob_io
+
+
+#---------------------------------------------------------------------------------------------------
+# Convert File
+#---------------------------------------------------------------------------------------------------
+
+in_fname = sys.argv[1]
+out_fname = sys.argv[2]
+
+print('Converting %s to %s' % (in_fname, out_fname))
+ob_io.write_ob_file(ob_io.read_ob_file(in_fname).df, out_fname)
+
+
+"""
+End convert_ob_file.py
+"""
@@ -19,11 +19,106 @@ import yaml
 import datetime as dt
 import pandas as pd
 import sys
+import os
 
 from pyDA_utils import bufr
 import pyDA_utils.superob_prepbufr as sp
 import pyDA_utils.map_proj as mp
 
+import ob_io
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def superob_from_csv(csv_fname, map_proj, map_proj_kw, grouping, grouping_kw, reduction_kw):
+    """
+    Create superobs from a prepBUFR CSV file
+
+    Parameters
+    ----------
+    csv_fname : string
+        Input prepBUFR CSV file name
+    map_proj : function
+        Map projection function
+    map_proj_kw : dictionary
+        Keyword arguments passed to map_proj
+    grouping : string
+        Method used to group obs into superobs
+    grouping_kw : dictionary
+        Keyword arguments for the grouping method
+    reduction_kw : dictionary
+        Reduction parameters for each observation type (keys)
+
+    Returns
+    -------
+    out_df : pd.DataFrame
+        Observations with superobs
+
+    """
+
+    # Create superob object
+    print('Creating superob object...')
+    sp_obj = sp.superobPB(csv_fname, 
+                          map_proj=map_proj, 
+                          map_proj_kw=map_proj_kw)
+
+    # Create superobs
+    out_df_list = [sp_obj.full_df.copy()]
+    for o in reduction_kw.keys():
+        start = dt.datetime.now()
+        print()
+        print(f'Creating superobs for type = {o}')
+        print('Start time = ', start)
+        out_df_list.append(sp_obj.create_superobs(obtypes=[o],
+                                                  grouping=grouping,
+                                                  grouping_kw=grouping_kw,
+                                                  reduction_kw=reduction_kw[o]))
+        sp_obj.df = sp_obj.full_df.copy()
+        print('Finished. Elapsed time = {t} s'.format(t=(dt.datetime.now() - start).total_seconds()))
+
+        # Remove superob from master DataFrame
+        out_df_list[0] = out_df_list[0].loc[out_df_list[0]['TYP'] != o, :].copy()
+
+    out_df = pd.concat(out_df_list)
+    out_df.drop(labels=['XMP', 'YMP', 'SFC', 'superob_groups'], axis=1, inplace=True)
+
+    return out_df
+
+
+def create_superobs(df, tmp_fname, map_proj, map_proj_kw, grouping, grouping_kw, reduction_kw):
+    """
+    Create superobs from a prepBUFR DataFrame
+
+    superobPB can only read CSV files, so the observations are written to a temporary CSV file 
+    first
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Input observations
+    tmp_fname : string
+        Temporary CSV file name. Removed after the superob object is created
+    map_proj, map_proj_kw, grouping, grouping_kw, reduction_kw : 
+        See superob_from_csv()
+
+    Returns
+    -------
+    out_df : pd.DataFrame
+        Observations with superobs
+
+    """
+
+    ob_io.write_ob_file(df, tmp_fname)
+    try:
+        out_df = superob_from_csv(tmp_fname, map_proj, map_proj_kw, grouping, grouping_kw, 
+                                  reduction_kw)
+    finally:
+        os.remove(tmp_fname)
+
+    return out_df
+
 
 #---------------------------------------------------------------------------------------------------
 # Input Parameters
@@ -85,15 +180,16 @@ reduction_kw = {136:{'var_dict':{'TOB':{'method':'vert_cressman',
                                         'reduction_kw':{}}}}}
 
 # Option to use input from YAML file 
-if len(sys.argv) > 1:
+if (__name__ == '__main__') and (len(sys.argv) > 1):
     bufr_t = sys.argv[1]
     tag = sys.argv[2]
     with open(sys.argv[3], 'r') as fptr:
         param = yaml.safe_load(fptr)
-    in_csv_fname = '{parent}/{t}.{tag}.input.csv'.format(parent=param['paths']['syn_superob_csv'],
-                                                                  t=bufr_t, tag=tag)
-    out_csv_fname = '{parent}/{t}.{tag}.output.csv'.format(parent=param['paths']['syn_superob_csv'],
-                                                                    t=bufr_t, tag=tag)
+    ob_fmt = param['shared']['ob_file_format']
+    in_csv_fname = '{parent}/{t}.{tag}.input.{fmt}'.format(parent=param['paths']['syn_superob_csv'],
+                                                           t=bufr_t, tag=tag, fmt=ob_fmt)
+    out_csv_fname = '{parent}/{t}.{tag}.output.{fmt}'.format(parent=param['paths']['syn_superob_csv'],
+                                                             t=bufr_t, tag=tag, fmt=ob_fmt)
     if param['superobs']['map_proj'] == 'll_to_xy_lc':
         map_proj = mp.ll_to_xy_lc
     map_proj_kw = param['superobs']['map_proj_kw']
@@ -106,35 +202,21 @@ if len(sys.argv) > 1:
 # Create Superobs
 #---------------------------------------------------------------------------------------------------
 
-# Create superob object
-print('Creating superob object...')
-sp_obj = sp.superobPB(in_csv_fname, 
-                      map_proj=map_proj, 
-                      map_proj_kw=map_proj_kw)
+if __name__ == '__main__':
+
+    # superobPB can only read CSV files, so Parquet input is converted to a temporary CSV file first
+    if in_csv_fname.endswith('.parquet'):
+        out_df = create_superobs(ob_io.read_ob_file(in_csv_fname).df, 
+                                 in_csv_fname[:-len('.parquet')] + '.tmp.csv',
+                                 map_proj, map_proj_kw, grouping, grouping_kw, reduction_kw)
+    else:
+        out_df = superob_from_csv(in_csv_fname, map_proj, map_proj_kw, grouping, grouping_kw, 
+                                  reduction_kw)
 
-# Create superobs
-out_df_list = [sp_obj.full_df.copy()]
-for o in reduction_kw.keys():
-    start = dt.datetime.now()
+    # Save results
     print()
-    print(f'Creating superobs for type = {o}')
-    print('Start time = ', start)
-    out_df_list.append(sp_obj.create_superobs(obtypes=[o],
-                                              grouping=grouping,
-                                              grouping_kw=grouping_kw,
-                                              reduction_kw=reduction_kw[o]))
-    sp_obj.df = sp_obj.full_df.copy()
-    print('Finished. Elapsed time = {t} s'.format(t=(dt.datetime.now() - start).total_seconds()))
-
-    # Remove superob from master DataFrame
-    out_df_list[0] = out_df_list[0].loc[out_df_list[0]['TYP'] != o, :].copy()
-
-# Save results
-print()
-print('saving superobbed CSV')
-out_df = pd.concat(out_df_list)
-out_df.drop(labels=['XMP', 'YMP', 'SFC', 'superob_groups'], axis=1, inplace=True)
-bufr.df_to_csv(out_df, out_csv_fname)
+    print('saving superobbed CSV')
+    ob_io.write_ob_file(out_df, out_csv_fname)
 
 
 """
@@ -20,7 +20,8 @@ Optional command-line arguments:
     argv[1] = Directory containing WRF UPP output
     argv[2] = Directory containing real prepBUFR CSV files
     argv[3] = Output directory for simulated prepBUFR CSV files
-    argv[4] = Time of prepbufr file (YYYYMMDDHH)
+    argv[4] = Time of prepbufr file (YYYYMMDDHH). Can also be a comma-separated list of times, in 
+              which case all times are processed together so each UPP file is only read once
     argv[5] = Time for first UPP file (YYYYMMDDHH)
     argv[6] = Time for last UPP file (YYYYMMDDHH)
     argv[7] = Prepbufr file tag
@@ -36,22 +37,30 @@ RAM Required: 25 GB
 # Import Modules
 #---------------------------------------------------------------------------------------------------
 
-import xarray as xr
 import numpy as np
+import pandas as pd
 import datetime as dt
 import math
-import os
 import sys
 import metpy.constants as const
 import metpy.calc as mc
 from metpy.units import units
 import yaml
 import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import pyDA_utils.create_ob_utils as cou 
 import pyDA_utils.bufr as bufr
 import pyDA_utils.map_proj as mp
 
+import interp_utils as iu
+import upp_cache
+import ob_io
+import ob_table
+import perf_log
+import weight_cache as wc
+
 
 #---------------------------------------------------------------------------------------------------
 # Input Parameters
@@ -80,8 +89,9 @@ vinterp = [{'subset':['ADPUPA', 'AIRCAR', 'AIRCFT'], 'var':'POB', 'type':'log',
 # Output directory for synthetic prepbufr CSV output
 fake_bufr_dir = './'
 
-# PrepBUFR time
-bufr_time = dt.datetime(2022, 2, 1, 12)
+# PrepBUFR time(s). If multiple times are given, obs for all times are created in a single pass
+# through the UPP output
+bufr_times = [dt.datetime(2022, 2, 1, 12)]
 
 # Prepbufr tag ('rap', 'rap_e', or 'rap_p')
 bufr_tag = 'rap'
@@ -89,6 +99,9 @@ bufr_tag = 'rap'
 # Prepbufr suffix
 bufr_suffix = ''
 
+# Output file format ('csv' or 'parquet')
+ob_fmt = 'csv'
+
 # Start and end times for wrfnat UPP output. Step is in min
 wrf_start = dt.datetime(2022, 2, 1, 12, 0)
 wrf_end = dt.datetime(2022, 2, 1, 12, 15)
@@ -127,12 +140,56 @@ add_ceiling = False
 #ceil_field = 'HGT_P0_L215_GLC0'  # Legacy ceiling diagnostic
 ceil_field = 'CEIL_P0_L2_GLC0'  # Experimental ceiling diagnostic #2
 
+# Additional 2D fields added to 2D obs. Keys are the names of the new DataFrame columns and values 
+# are dictionaries with the following entries:
+#     field = UPP field name
+#     method = 'nearest' (nearest gridpoint and nearest UPP time) or 'linear' (bilinear in the 
+#              horizontal and linear in time)
+#     subsets = Platforms to add this field to (optional, default is ADPSFC, SFCSHP, MSONET)
+#     max_val = Values greater than max_val are set to NaN (optional)
+# Setting add_ceiling = True is the same as adding the ceiling field using the nearest method
+extra_2d = {}
+
 # Option to add total liquid water mixing ratio 3D field
 add_liq_mix = False
 
 # Option for debugging output (0 = none, 1 = some, 2 = a lot)
 debug = 2
 
+# How 3D UPP fields are read ('full', 'window', or 'tiles'). 'window' and 'tiles' only read the
+# horizontal window(s) containing the obs, which uses much less memory. tile_size is in gridpoints
+read_mode = 'full'
+tile_size = 100
+
+# Directory for cached projected ob locations (set to None to not use a cache) and maximum number of
+# stations to keep in the cache
+weight_cache_dir = None
+weight_cache_max_entries = 500000
+
+# Directory used to cache decoded UPP fields (set to None to decode fields from the UPP files every 
+# time). See upp_cache.py
+upp_cache_dir = None
+
+# Number of processes used for 3D interpolation and maximum number of 3D fields that can be in 
+# memory at once (each process holds one 3D field)
+workers = 1
+max_resident_fields = 1
+
+# Maximum number of obs processed at once (set to None or 0 to process all obs at once). 3D obs are 
+# interpolated in blocks of chunk_size obs, which limits the size of the arrays passed to each 3D 
+# interpolation task, and the output is written in blocks. 
+# Best used with read_mode = 'window' or 'tiles', b/c 3D fields are read separately for each block
+chunk_size = None
+
+# Option to read the next 3D field (or window) in a background thread while the current one is 
+# being interpolated. Only used when 3D interpolation is performed serially. Two 3D fields are held 
+# in memory at once (three for the vertical coordinate)
+prefetch = False
+
+# Option to write a JSON report with the time spent in each stage, the number of obs processed, and
+# the peak memory usage (see perf_log.py). The report is saved with the output files
+timing_report = True
+
 # Option to interpolate (lat, lon) coordinates for surface obs (ADPSFC, SFCSHP, MSONET)
 # Helpful for debugging, but should usually be set to False b/c it increases runtime
 interp_latlon = False
@@ -149,7 +206,7 @@ if len(sys.argv) > 1:
     wrf_dir = sys.argv[1]
     bufr_dir = sys.argv[2]
     fake_bufr_dir = sys.argv[3]
-    bufr_time = dt.datetime.strptime(sys.argv[4], '%Y%m%d%H')
+    bufr_times = [dt.datetime.strptime(t, '%Y%m%d%H') for t in sys.argv[4].split(',')]
     wrf_start = dt.datetime.strptime(sys.argv[5], '%Y%m%d%H%M')
     wrf_end = dt.datetime.strptime(sys.argv[6], '%Y%m%d%H%M')
     bufr_tag = sys.argv[7]
@@ -171,10 +228,22 @@ if len(sys.argv) > 1:
     coastline_correct = param['interpolator']['coastline_correct']
     use_Tv = param['interpolator']['use_Tv']
     add_ceiling = param['interpolator']['add_ceiling']
+    extra_2d = param['interpolator']['extra_2d']
     add_liq_mix = param['interpolator']['add_liq_mix']
     if add_liq_mix:
         vars_3d['liqmix'] = 'LIQMR'
     debug = param['interpolator']['debug']
+    ob_fmt = param['shared']['ob_file_format']
+    read_mode = param['interpolator']['read_mode']
+    tile_size = param['interpolator']['tile_size']
+    weight_cache_dir = param['interpolator']['weight_cache_dir']
+    weight_cache_max_entries = param['interpolator']['weight_cache_max_entries']
+    workers = param['interpolator']['workers']
+    max_resident_fields = param['interpolator']['max_resident_fields']
+    prefetch = param['interpolator']['prefetch']
+    chunk_size = param['interpolator']['chunk_size']
+    timing_report = param['interpolator']['timing_report']
+    upp_cache_dir = param['shared']['upp_cache_dir']
 
     # Use vertical interpolation in Z for UAS obs
     if param['create_csv']['use']:
@@ -195,34 +264,61 @@ if len(sys.argv) > 1:
         else:
             height_opt = 'msl'
 
+# Ceilings are added as an extra 2D field. Ceilings >= 20000 m are set to NaN
+if extra_2d is None:
+    extra_2d = {}
+if add_ceiling:
+    extra_2d['ceil'] = {'field':ceil_field, 'method':'nearest', 'max_val':19999.9}
+for c in extra_2d:
+    if extra_2d[c]['method'] not in ['nearest', 'linear']:
+        raise ValueError('Unknown extra_2d method for %s: %s' % (c, extra_2d[c]['method']))
+
+# chunk_size = 0 is the same as chunk_size = None
+if not chunk_size:
+    chunk_size = None
+
 
 #---------------------------------------------------------------------------------------------------
 # Preprocessing
 #---------------------------------------------------------------------------------------------------
 
-# Timing
+# Timing. Timers and counters for each stage are saved in perf
 begin = dt.datetime.now()
+perf = perf_log.perfLog('create_synthetic_obs.py')
 print()
 print('BEGINNING SYNTHETIC OB CREATION PROGRAM')
 print('start time = %s' % begin.strftime('%Y-%m-%d %H:%M:%S'))
 print()
 
-# List to save time spent on each BUFR entry
-if debug > 1:
-    entry_times2d = []
-    entry_timesv1 = []
-    entry_timesv2 = []
-    entry_times3d = []
-
 # Convert wrf_step to decimal hours for ease of use
 wrf_step_dec = wrf_step / 60.
 
 ob_platforms = obs_2d + obs_3d
 
-# Open BUFR file
-bufr_fname = '%s/%s.%s.prepbufr.csv' % (bufr_dir, bufr_time.strftime('%Y%m%d%H%M'), bufr_tag)
-print('Opening BUFR file: %s' % bufr_fname)
-bufr_csv = bufr.bufrCSV(bufr_fname)
+# Open BUFR files
+# If there are multiple prepBUFR times, obs from all times are combined into a single DataFrame with
+# DHR and HRDR relative to the first prepBUFR time. The 'cycle' column is used to split the obs 
+# back up when writing the output. The original DHR and HRDR are kept so they can be restored exactly
+# (subtracting the offset again introduces round-off error)
+perf.start_timer('read_bufr')
+bufr_time = bufr_times[0]
+cycle_offset = []
+bufr_dfs = []
+for n, t in enumerate(bufr_times):
+    bufr_fname = '%s/%s.%s.prepbufr.csv' % (bufr_dir, t.strftime('%Y%m%d%H%M'), bufr_tag)
+    print('Opening BUFR file: %s' % bufr_fname)
+    bufr_csv = bufr.bufrCSV(bufr_fname)
+    cycle_offset.append((t - bufr_time).total_seconds() / 3600.)
+    bufr_csv.df['cycle'] = n
+    bufr_csv.df['DHR_orig'] = bufr_csv.df['DHR']
+    bufr_csv.df['HRDR_orig'] = bufr_csv.df['HRDR']
+    bufr_csv.df['DHR'] = bufr_csv.df['DHR'] + cycle_offset[-1]
+    bufr_csv.df['HRDR'] = bufr_csv.df['HRDR'] + cycle_offset[-1]
+    bufr_dfs.append(bufr_csv.df)
+bufr_csv.df = pd.concat(bufr_dfs, ignore_index=True)
+bufr_dfs = 0.
+perf.stop_timer('read_bufr')
+perf.count('obs_input', len(bufr_csv.df))
 
 # Only keep platforms if we are creating synthetic obs for them
 obs = bufr_csv.df['subset'].unique()
@@ -251,12 +347,15 @@ if use_raob_drift:
 # Open wrfnat files
 # Factor of 1.001 is needed b/c np.arange is used to construct wrf_hr
 start_grib = dt.datetime.now()
+perf.start_timer('open_upp')
 hr_start = math.floor(bufr_csv.df['DHR'].min()*4) / 4
 hr_end = bufr_csv.df['DHR'].max() + (1.001 * wrf_step_dec)
 if use_raob_drift:
-    if not np.all(np.isnan(bufr_csv.df['HRDR'])):
-        hr_start = min([hr_start, math.floor(bufr_csv.df['HRDR'].min()*4) / 4])
-        hr_end = max([hr_end, bufr_csv.df['HRDR'].max() + (1.001 * wrf_step_dec)])
+    # Only ADPUPA obs use HRDR
+    hrdr = bufr_csv.df.loc[bufr_csv.df['subset'] == 'ADPUPA', 'HRDR']
+    if not np.all(np.isnan(hrdr)):
+        hr_start = min([hr_start, math.floor(hrdr.min()*4) / 4])
+        hr_end = max([hr_end, hrdr.max() + (1.001 * wrf_step_dec)])
 print('min/max WRF hours = %.2f, %.2f' % (hr_min, hr_max))
 print('min/max BUFR DHR = %.2f, %.2f' % (bufr_csv.df['DHR'].min(), bufr_csv.df['DHR'].max()))
 print('min/max BUFR HRDR = %.2f, %.2f' % (bufr_csv.df['HRDR'].min(), bufr_csv.df['HRDR'].max()))
@@ -268,17 +367,16 @@ for hr in wrf_hr:
     suffix = glob.glob(wrf_dir + wrf_t.strftime('/%Y%m%d/wrfnat_%Y%m%d%H%M_er*'))[0].split('.')[-1]
     f = wrf_dir + wrf_t.strftime('/%Y%m%d/wrfnat_%Y%m%d%H%M_er.') + suffix
     print(f)
-    if suffix == 'grib2':
 
-        # Abort if winds are not earth-relative
-        if cou.check_wind_ref_frame(f):
-            wrf_ds[hr] = xr.open_dataset(f, engine='pynio')
-        else:
-            raise IOError('GRIB2 files contain grid-relative winds. Use wgrib2 to convert to earth-relative winds.')
+    # Abort if winds are not earth-relative
+    if (suffix == 'grib2') and (not cou.check_wind_ref_frame(f)):
+        raise IOError('GRIB2 files contain grid-relative winds. Use wgrib2 to convert to earth-relative winds.')
 
-    elif suffix == 'nc':
-        wrf_ds[hr] = xr.open_dataset(f)
+    # Fields are decoded when first accessed (and saved to upp_cache_dir, if not None)
+    wrf_ds[hr] = upp_cache.UPPFile(f, cache_dir=upp_cache_dir, tile_size=tile_size)
 
+perf.stop_timer('open_upp')
+perf.count('upp_files', len(wrf_hr))
 print('time to open GRIB files = %.2f s' % (dt.datetime.now() - start_grib).total_seconds())
     
 # Extract size of latitude and longitude grids
@@ -288,102 +386,161 @@ jmax = shape[1] - 2
     
 # Compute (x, y) coordinates of obs using a Lambert Conformal projection (assume model dx = model dy)
 # Remove obs outside of the wrfnat domain
+perf.start_timer('map_proj')
 if debug > 0:
     start_map_proj = dt.datetime.now()
     print('Performing map projection with obs...')
 
-model_nz = len(wrf_ds[wrf_hr[0]]['lv_HYBL0'])
-bufr_csv.df['xlc'], bufr_csv.df['ylc'] = mp.ll_to_xy_lc(bufr_csv.df['YOB'], bufr_csv.df['XOB'] - 360.)
+# Drifted ADPUPA locations (XDR, YDR) are projected in the same pass as the launch locations 
+# (XOB, YOB). Drifted locations are not saved in the weight cache b/c they change every cycle
+if use_raob_drift:
+    drift = np.logical_and(bufr_csv.df['subset'] == 'ADPUPA', ~np.isnan(bufr_csv.df['XDR'])).values
+else:
+    drift = np.zeros(len(bufr_csv.df), dtype=bool)
+ndrift = drift.sum()
+drift_lat = bufr_csv.df.loc[drift, 'YDR'].values
+drift_lon = bufr_csv.df.loc[drift, 'XDR'].values
+if weight_cache_dir is None:
+    xlc, ylc = mp.ll_to_xy_lc(np.concatenate([bufr_csv.df['YOB'].values, drift_lat]), 
+                              np.concatenate([bufr_csv.df['XOB'].values, drift_lon]) - 360.)
+    xlc = np.asarray(xlc, dtype=float)
+    ylc = np.asarray(ylc, dtype=float)
+    xlc_dr = xlc[len(bufr_csv.df):]
+    ylc_dr = ylc[len(bufr_csv.df):]
+    xlc = xlc[:len(bufr_csv.df)]
+    ylc = ylc[:len(bufr_csv.df)]
+else:
+    # Only perform the map projection for obs that are not in the cache
+    wc_fname = wc.cache_fname(weight_cache_dir, mp.ll_to_xy_lc, shape)
+    wc_cache = wc.load_cache(wc_fname)
+    wc_args = [bufr_csv.df[c].values for c in ['SID', 'XOB', 'YOB']]
+    found, xlc, ylc = wc.lookup(wc_cache, *wc_args)
+    missing = np.logical_not(found)
+    x, y = mp.ll_to_xy_lc(np.concatenate([wc_args[2][missing], drift_lat]), 
+                          np.concatenate([wc_args[1][missing], drift_lon]) - 360.)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    nmissing = missing.sum()
+    xlc[missing] = x[:nmissing]
+    ylc[missing] = y[:nmissing]
+    xlc_dr = x[nmissing:]
+    ylc_dr = y[nmissing:]
+    wc_fixed = wc.fixed_stations(bufr_csv.df['subset'].values, drift)
+    wc.save_cache(wc_fname, wc.update(wc_cache, *wc_args, xlc, ylc, fixed=wc_fixed,
+                                      max_entries=weight_cache_max_entries))
+    print('# obs found in weight cache = %d (out of %d)' % (found.sum(), found.size))
+bufr_csv.df['xlc'] = xlc
+bufr_csv.df['ylc'] = ylc
 bufr_csv.df['i0'] = np.int32(np.floor(bufr_csv.df['ylc']))
 bufr_csv.df['j0'] = np.int32(np.floor(bufr_csv.df['xlc']))
-
-bufr_csv.df.drop(index=np.where(np.logical_or(bufr_csv.df['i0'] < 0, 
-                                              bufr_csv.df['i0'] > imax))[0], inplace=True)
-bufr_csv.df.reset_index(drop=True, inplace=True)
-bufr_csv.df.drop(index=np.where(np.logical_or(bufr_csv.df['j0'] < 0, 
-                                              bufr_csv.df['j0'] > jmax))[0], inplace=True)
+bufr_csv.df['xlc_dr'] = np.nan
+bufr_csv.df['ylc_dr'] = np.nan
+bufr_csv.df.loc[drift, 'xlc_dr'] = xlc_dr
+bufr_csv.df.loc[drift, 'ylc_dr'] = ylc_dr
+if use_raob_drift:
+    print('# drifted ADPUPA obs = %d' % ndrift)
+
+# Columns saved to the drop diagnostics file
+diag_cols = ['cycle', 'subset', 'TYP', 'SID', 'XOB', 'YOB', 'DHR', 'DHR_orig', 'POB', 'ZOB']
+
+# Obs are outside the domain if either the launch location or drifted location is outside
+outside = np.logical_or(np.logical_or(bufr_csv.df['i0'] < 0, bufr_csv.df['i0'] > imax),
+                        np.logical_or(bufr_csv.df['j0'] < 0, bufr_csv.df['j0'] > jmax)).values.copy()
+i0_dr = np.floor(bufr_csv.df.loc[drift, 'ylc_dr'].values)
+j0_dr = np.floor(bufr_csv.df.loc[drift, 'xlc_dr'].values)
+outside[drift] = np.logical_or(outside[drift], 
+                               np.logical_or(np.logical_or(i0_dr < 0, i0_dr > imax),
+                                             np.logical_or(j0_dr < 0, j0_dr > jmax)))
+outside_df = bufr_csv.df.loc[outside, diag_cols].copy()
+outside_df['drop_reason'] = iu.DROP_OUTSIDE_DOMAIN
+bufr_csv.df.drop(index=np.where(outside)[0], inplace=True)
 bufr_csv.df.reset_index(drop=True, inplace=True)
 
-# Create output DataFrame
-out_df = bufr_csv.df.copy()
-bufr_csv.df.drop(labels=['xlc', 'ylc', 'i0', 'j0'], axis=1, inplace=True)
-drop_idx = []
+# Create output observation table. Each column is stored as a NumPy array (see ob_table.py) to
+# avoid the overhead of accessing individual DataFrame cells. The table is converted back to a 
+# DataFrame prior to writing the output
+out_tbl = ob_table.obTable(bufr_csv.df.copy(), 
+                           int_cols=['i0', 'j0', 'ki0', 'ihr', 'vgroup', 'inear', 'jnear'])
+bufr_csv.df.drop(labels=['xlc', 'ylc', 'i0', 'j0', 'xlc_dr', 'ylc_dr'], axis=1, inplace=True)
+
+# Reason each row is dropped (see iu.DROP_REASONS). Rows with a nonzero code are dropped at the end
+drop_reason = np.zeros(len(out_tbl), dtype=np.int8)
 
 # Compute interpolation weights
-out_df['iwgt'] = 1. - (out_df['ylc'] - out_df['i0'])
-out_df['jwgt'] = 1. - (out_df['xlc'] - out_df['j0'])
+out_tbl['iwgt'] = 1. - (out_tbl['ylc'] - out_tbl['i0'])
+out_tbl['jwgt'] = 1. - (out_tbl['xlc'] - out_tbl['j0'])
 
-# Determine nearest neighbor for cloud ceiling
-if add_ceiling:
-    out_df['inear'] = np.int32(np.around(out_df['ylc']))
-    out_df['jnear'] = np.int32(np.around(out_df['xlc']))
+# Determine nearest neighbor for extra 2D fields
+use_nearest = np.any([extra_2d[c]['method'] == 'nearest' for c in extra_2d])
+if use_nearest:
+    out_tbl['inear'] = np.int32(np.around(out_tbl['ylc']))
+    out_tbl['jnear'] = np.int32(np.around(out_tbl['xlc']))
 
+perf.stop_timer('map_proj')
+perf.count('obs_outside_domain', outside.sum())
 if debug > 0:
     print('Finished with map projection and computing horiz interp weights (time = %.3f s)' % 
           (dt.datetime.now() - start_map_proj).total_seconds())
-    print('# BUFR entries remaining = %d' % len(out_df))
+    print('# BUFR entries remaining = %d' % len(out_tbl))
 
 # Round time offsets to 6 decimal places to eliminate machine error
 # (this helps avoid some rare bugs in upper-air obs that leads to all obs being 0)
-out_df['DHR'] = np.around(out_df['DHR'], 6)
+out_tbl['DHR'] = np.around(out_tbl['DHR'], 6)
+out_tbl['DHR_orig'] = np.around(out_tbl['DHR_orig'], 6)
 
 # Determine row indices for each ob type
 ob_idx = {}
 ob_idx['2d'] = []
 ob_idx['3d'] = []
 for o in ob_platforms:
-    ob_idx[o] = list(np.where(out_df['subset'] == o)[0]) 
+    ob_idx[o] = list(np.where(out_tbl['subset'] == o)[0]) 
 for o in obs_2d:
     ob_idx['2d'] = ob_idx['2d'] + ob_idx[o]
 for o in obs_3d:
     ob_idx['3d'] = ob_idx['3d'] + ob_idx[o]
 
 # Label each 3D ob with the appropriate group number for vertical interpolation
-out_df['vgroup'] = -1 * np.ones(len(out_df), dtype=int)
+out_tbl['vgroup'] = -1 * np.ones(len(out_tbl), dtype=int)
 for j, vinterp_d in enumerate(vinterp):
     for o in vinterp_d['subset']:
         if o in ob_idx.keys():
-            out_df.loc[ob_idx[o], 'vgroup'] = j
+            out_tbl['vgroup'][ob_idx[o]] = j
 
-# Add liquid mixing ratio column to DataFrame
+# Add liquid mixing ratio column to the output table
 if add_liq_mix:
-    out_df['liqmix'] = np.zeros(len(out_df))
-
-# Initialize variables (other than vertical coordinate) for 3D obs as 1e9 (note that this is 
-# different from NaN, which is used for missing values)
-for i, vinterp_d in enumerate(vinterp):
-    tmp_obs = list(vars_3d.keys())
-    tmp_obs.remove(vinterp_d['var'])
-    for v in tmp_obs:
-        rows = np.intersect1d(np.where(out_df['vgroup'] == i), np.where(np.logical_not(np.isnan(out_df[v]))))
-        out_df.loc[rows, v] = 1e9
+    out_tbl['liqmix'] = np.zeros(len(out_tbl))
 
 # Set all ZOB values to NaN if we don't wish to interpolate ZOBs for AIRCAR and AIRCFT
 if not interp_z_aircft:
     if 'AIRCAR' in ob_idx.keys():
-        out_df.loc[ob_idx['AIRCAR'], 'ZOB'] = np.nan
+        out_tbl['ZOB'][ob_idx['AIRCAR']] = np.nan
     if 'AIRCFT' in ob_idx.keys():
-        out_df.loc[ob_idx['AIRCFT'], 'ZOB'] = np.nan
+        out_tbl['ZOB'][ob_idx['AIRCFT']] = np.nan
 
-# Add some DataFrame columns
-nrow = len(out_df)
+# Add some columns to the output table
+nrow = len(out_tbl)
 extra_col_int = ['ki0']
 extra_col_float = ['twgt', 'kwgt']
 for c in extra_col_int:
-    out_df[c] = np.zeros(nrow, dtype=int)
+    out_tbl[c] = np.zeros(nrow, dtype=int)
 for c in extra_col_float:
-    out_df[c] = np.zeros(nrow, dtype=float)
+    out_tbl[c] = np.zeros(nrow, dtype=float)
 extra_col_int = extra_col_int + ['i0', 'j0', 'vgroup']
-extra_col_float = extra_col_float + ['xlc', 'ylc', 'iwgt', 'jwgt']
 
-if add_ceiling:
+# Determine WRF hour right before each observation and weight for temporal interpolation. The 
+# original DHR is used so the weights do not depend on the other prepBUFR times in this job
+ihr, twgt = iu.cycle_time_bracket(wrf_hr, out_tbl['DHR_orig'], out_tbl['cycle'], cycle_offset)
+out_tbl['ihr'] = ihr
+out_tbl['twgt'] = twgt
+extra_col_int = extra_col_int + ['ihr']
+extra_col_float = extra_col_float + ['xlc', 'ylc', 'xlc_dr', 'ylc_dr', 'iwgt', 'jwgt']
+
+if use_nearest:
     extra_col_int = extra_col_int + ['inear', 'jnear']
-    out_df['ceil'] = np.zeros(nrow) * np.nan
+for c in extra_2d:
+    out_tbl[c] = np.zeros(nrow) * np.nan
 
-# Compute derived fields
-if add_liq_mix:
-    for key in wrf_ds.keys():
-        wrf_ds[key]['LIQMR'] = wrf_ds[key]['CLWMR_P0_L105_GLC0'] + wrf_ds[key]['RWMR_P0_L105_GLC0']
+# Derived fields (e.g., LIQMR) are computed by upp_cache.UPPFile
 
 
 #---------------------------------------------------------------------------------------------------
@@ -406,101 +563,130 @@ if coastline_correct:
     wrf_fields_2d = wrf_fields_2d + ['LAND_P0_L1_GLC0']
 if interp_latlon:
     wrf_fields_2d = wrf_fields_2d + ['gridlat_0', 'gridlon_0']
-if add_ceiling:
-    wrf_fields_2d = wrf_fields_2d + [ceil_field]
+for c in extra_2d:
+    if extra_2d[c]['field'] not in wrf_fields_2d:
+        wrf_fields_2d = wrf_fields_2d + [extra_2d[c]['field']]
+# Only read 2D fields for the WRF times used by the 2D obs. 3D obs only need the surface height at 
+# the first WRF time (used to adjust ELV and heights AGL)
+perf.start_timer('read_2d')
+idx2d = np.array(ob_idx['2d'], dtype=int)
+groups2d = iu.time_groups(out_tbl['ihr'][idx2d], out_tbl['twgt'][idx2d], len(wrf_hr))
 wrf_data = {}
-for hr in wrf_hr:
+for k, hr in enumerate(wrf_hr):
     wrf_data[hr] = {}
-    for f in wrf_fields_2d:
-        wrf_data[hr][f] = wrf_ds[hr][f][:, :].values
-    for f in wrf_fields_2d_3d:
-        wrf_data[hr][f] = wrf_ds[hr][f][0, :, :].values
-
-# Loop over each 2D observation
-for j in ob_idx['2d']:
-        
+    if groups2d[k][0].size > 0:
+        for f in wrf_fields_2d:
+            wrf_data[hr][f] = wrf_ds[hr][f][:, :].values
+        for f in wrf_fields_2d_3d:
+            wrf_data[hr][f] = wrf_ds[hr][f][0, :, :].values
+    if (k == 0) and (len(ob_idx['3d']) > 0) and (vars_2d['ZOB'] not in wrf_data[hr]):
+        wrf_data[hr][vars_2d['ZOB']] = wrf_ds[hr][vars_2d['ZOB']][:, :].values
+perf.stop_timer('read_2d')
+perf.count('fields_2d_read', np.sum([len(wrf_data[hr]) for hr in wrf_hr]))
+perf.start_timer('interp_2d')
+if debug > 0:
+    print('2D fields read for %d of %d WRF times' % 
+          (np.sum([len(wrf_data[hr]) > 0 for hr in wrf_hr]), len(wrf_hr)))
+
+# Extract interpolation columns for all 2D obs
+ihr2d = out_tbl['ihr'][idx2d]
+twgt2d = out_tbl['twgt'][idx2d]
+i02d = out_tbl['i0'][idx2d]
+j02d = out_tbl['j0'][idx2d]
+iwgt2d = out_tbl['iwgt'][idx2d]
+jwgt2d = out_tbl['jwgt'][idx2d]
+subset2d = out_tbl['subset'][idx2d]
+
+# Option to use only land gridpoints for land stations and only water gridpoints for 
+# marine stations
+if coastline_correct:
+    landmask = iu.coastline_mask(wrf_data, wrf_hr, 'LAND_P0_L1_GLC0', i02d, j02d, ihr2d, subset2d)
     if debug > 1:
-        time_jstart = dt.datetime.now()
-        print()
+        print('number of obs with all nearby gridpoints masked = %d' % 
+              np.count_nonzero(landmask.sum(axis=1) == 0))
+else:
+    landmask = None
 
-    # Determine WRF hour right before observation and weight for temporal interpolation
-    ihr, twgt = cou.determine_twgt(wrf_hr, out_df.loc[j, 'DHR'])
-    out_df.loc[j, 'twgt'] = twgt
-
-    # Option to use only land gridpoints for land stations and only water gridpoints for 
-    # marine stations
-    if coastline_correct:
-        i0 = out_df.loc[j, 'i0']
-        j0 = out_df.loc[j, 'j0']
-        hr = wrf_hr[ihr]
-        f = 'LAND_P0_L1_GLC0'
-        tmp_mask = np.array([wrf_data[hr][f][i0, j0], wrf_data[hr][f][i0, j0+1],
-                             wrf_data[hr][f][i0+1, j0], wrf_data[hr][f][i0+1, j0+1]])
-        print('number of nearby land gridpoints = %d' % tmp_mask.sum())
-        if out_df.loc[j, 'subset'] in ['ADPSFC', 'MSONET']:
-            landmask = tmp_mask
-        elif out_df.loc[j, 'subset'] in ['SFCSHP']:
-            landmask = np.float64(np.logical_not(tmp_mask))
-        else:
-            landmask = np.ones(4)
+interp_args = [i02d, j02d, iwgt2d, jwgt2d, ihr2d, twgt2d]
+
+# Determine surface height above sea level and surface pressure
+sfch = iu.interp_x_y_t(wrf_data, wrf_hr, vars_2d['ZOB'], *interp_args, mask=landmask)
+sfcp = iu.interp_x_y_t(wrf_data, wrf_hr, vars_2d['POB'], *interp_args, mask=landmask) * 1e-2
+
+if debug > 1:
+    print('done determining twgt, sfch, and sfcp (%.6f s)' % 
+          (dt.datetime.now() - start2d).total_seconds())
+
+# Surface obs only: Reset surface values to match NR and assign surface pressure values
+sfc_rows = np.isin(subset2d, ['ADPSFC', 'SFCSHP', 'MSONET'])
+for o, v in zip(['ZOB', 'ELV', 'POB', 'PRSS'], [sfch, sfch, sfcp, sfcp]):
+    rows = np.logical_and(sfc_rows, np.logical_not(np.isnan(out_tbl[o][idx2d])))
+    out_tbl[o][idx2d[rows]] = v[rows]
+
+# Interpolate temporally
+obs_name = []
+wrf_name = []
+for d in [vars_2d, vars_2d_3d]:
+    for o in d.keys():
+        if o not in ['ZOB', 'ELV', 'POB', 'PRSS']:
+            obs_name.append(o)
+            wrf_name.append(d[o])
+if interp_latlon:
+    obs_name = obs_name + ['XOB', 'YOB']
+    wrf_name = wrf_name + ['gridlon_0', 'gridlat_0']
+for o, m in zip(obs_name, wrf_name):
+    if debug > 1:
+        time_before_interp = dt.datetime.now()
+
+    # Only interpolate fields that are not missing
+    rows = np.where(np.logical_not(np.isnan(out_tbl[o][idx2d])))[0]
+    if rows.size == 0:
+        continue
+    if landmask is None:
+        rmask = None
     else:
-        landmask = np.ones(4)
+        rmask = landmask[rows]
+    out_tbl[o][idx2d[rows]] = iu.interp_x_y_t(wrf_data, wrf_hr, m, 
+                                              *[a[rows] for a in interp_args], mask=rmask)
 
-    # Determine surface height above sea level and surface pressure
-    sfch = cou.interp_x_y_t(wrf_data, wrf_hr, vars_2d['ZOB'], out_df.loc[j], ihr, twgt,
-                            mask=landmask)
-    sfcp = cou.interp_x_y_t(wrf_data, wrf_hr, vars_2d['POB'], out_df.loc[j], ihr, twgt,
-                            mask=landmask) * 1e-2
+    if debug > 1:
+        time_after_interp = dt.datetime.now()
+        print('finished interp for %s (%d obs, %.6f s)' % 
+              (o, rows.size, (time_after_interp - time_before_interp).total_seconds()))
 
+# Extra 2D fields (e.g., cloud ceiling)
+for c in extra_2d:
     if debug > 1:
-        time_sfc = dt.datetime.now()
-        print('2D field: SID = %s, subset = %s, TYP = %d' % 
-              (out_df.loc[j, 'SID'], out_df.loc[j, 'subset'], out_df.loc[j, 'TYP']))
-        print('done determining twgt, sfch, and sfcp (%.6f s)' % 
-              (time_sfc - time_jstart).total_seconds())
-        print('twgt = %.3f, i0 = %d, j0 = %d' % 
-              (twgt, out_df.loc[j, 'i0'], out_df.loc[j, 'j0']))
-        print('DHR = %.3f, XOB = %.6f, YOB = %.6f' % 
-              (out_df.loc[j, 'DHR'], out_df.loc[j, 'XOB'], out_df.loc[j, 'YOB']))
-        print('sfch = %.6f, sfcp = %.6f' % (sfch, sfcp))
-             
-    # Surface obs only: Reset surface values to match NR and assign surface pressure values
-    if out_df.loc[j, 'subset'] in ['ADPSFC', 'SFCSHP', 'MSONET']:
-        for o, v in zip(['ZOB', 'ELV', 'POB', 'PRSS'], [sfch, sfch, sfcp, sfcp]):
-            if not np.isnan(out_df.loc[j, o]):
-                out_df.loc[j, o] = v
-
-    # Interpolate temporally
-    obs_name = []
-    wrf_name = []
-    for d in [vars_2d, vars_2d_3d]:
-        for o in d.keys():
-            if o not in ['ZOB', 'ELV', 'POB', 'PRSS']:
-                obs_name.append(o)
-                wrf_name.append(d[o])
-    if interp_latlon:
-        obs_name = obs_name + ['XOB', 'YOB']
-        wrf_name = wrf_name + ['gridlon_0', 'gridlat_0']
-    for o, m in zip(obs_name, wrf_name):
-        if not np.isnan(out_df.loc[j, o]):
-            if debug > 1:
-                time_before_interp = dt.datetime.now()
-            out_df.loc[j, o] = cou.interp_x_y_t(wrf_data, wrf_hr, m, out_df.loc[j], ihr, twgt,
-                                                mask=landmask)
-            if debug > 1:
-                time_after_interp = dt.datetime.now()
-                print('finished interp for %s (%.6f s)' % 
-                      (o, (time_after_interp - time_before_interp).total_seconds()))
-                entry_times2d.append((dt.datetime.now() - time_jstart).total_seconds())
-
-    # Option to include cloud ceiling (interpolation is nearest neighbor)
-    if add_ceiling and (out_df.loc[j, 'subset'] in ['ADPSFC', 'MSONET', 'SFCSHP']):
-         inear = out_df.loc[j, 'inear']
-         jnear = out_df.loc[j, 'jnear']
-         HRnear = wrf_hr[np.argmin(np.abs(wrf_hr - out_df.loc[j, 'DHR']))]
-         out_df.loc[j, 'ceil'] = wrf_data[HRnear][ceil_field][inear, jnear]
-
-ndrop2d = len(drop_idx)
+        time_before_interp = dt.datetime.now()
+
+    subsets = extra_2d[c].get('subsets', ['ADPSFC', 'MSONET', 'SFCSHP'])
+    rows = np.where(np.isin(subset2d, subsets))[0]
+    if rows.size == 0:
+        continue
+    if extra_2d[c]['method'] == 'nearest':
+        val = iu.nearest_x_y_t(wrf_data, wrf_hr, extra_2d[c]['field'],
+                               out_tbl['inear'][idx2d[rows]],
+                               out_tbl['jnear'][idx2d[rows]],
+                               out_tbl['DHR'][idx2d[rows]])
+    else:
+        if landmask is None:
+            rmask = None
+        else:
+            rmask = landmask[rows]
+        val = iu.interp_x_y_t(wrf_data, wrf_hr, extra_2d[c]['field'], 
+                              *[a[rows] for a in interp_args], mask=rmask)
+    if 'max_val' in extra_2d[c]:
+        val[val > extra_2d[c]['max_val']] = np.nan
+    out_tbl[c][idx2d[rows]] = val
+
+    if debug > 1:
+        time_after_interp = dt.datetime.now()
+        print('finished interp for %s (%d obs, %.6f s)' % 
+              (c, rows.size, (time_after_interp - time_before_interp).total_seconds()))
+
+ndrop2d = np.count_nonzero(drop_reason)
+perf.stop_timer('interp_2d')
+perf.count('obs_2d', len(ob_idx['2d']))
 print()
 print('Done with 2D Obs')
 print('number of dropped obs = %d' % ndrop2d)
@@ -520,36 +706,52 @@ print('---------------')
 print()
 
 start3d = dt.datetime.now()
+perf.start_timer('interp_3d')
 
-# Start by adjusting elevation to match Nature Run elevation for non-aircraft 3D obs
+# Start by adjusting elevation to match Nature Run elevation for non-aircraft 3D obs (uses the 
+# first WRF time)
 for s in obs_3d:
     if s in ['AIRCAR', 'AIRCFT']:
         continue
-    for j in ob_idx[s]:
-        out_df.loc[j, 'ELV'] = cou.interp_x_y_t(wrf_data, wrf_hr, vars_2d['ZOB'], out_df.loc[j], 0, 
-                                                1)
+    rows = np.array(ob_idx[s], dtype=int)
+    out_tbl['ELV'][rows] = iu.interp_x_y_t(wrf_data, wrf_hr, vars_2d['ZOB'], 
+                                           *[out_tbl[c][rows] for c in ['i0', 'j0', 'iwgt', 'jwgt']],
+                                           np.zeros(rows.size), np.ones(rows.size))
 
 # Use (XDR, YDR) for ADPUPA obs rather than (XOB, YOB). Can't make this swap until after ELV 
-# adjustment
+# adjustment. Horizontal interpolation indices and weights are recomputed for the drifted locations.
+# DHR_orig keeps the launch time (used for the drop diagnostics)
 if use_raob_drift:
-    if 'ADPUPA' in ob_idx.keys():
-        drift_idx = np.logical_and(out_df['subset'] == 'ADPUPA', ~np.isnan(out_df['XDR']))
-        out_df.loc[drift_idx, 'XOB'] = out_df.loc[drift_idx, 'XDR']
-        out_df.loc[drift_idx, 'YOB'] = out_df.loc[drift_idx, 'YDR']
-        out_df.loc[drift_idx, 'DHR'] = out_df.loc[drift_idx, 'HRDR']
-
-# Create array to save v1d arrays (vertical coordinate) and surface height (sfch)
-v1d = np.ones([model_nz, len(out_df)]) * 1e9
-vdone = np.zeros(len(out_df), dtype=int)
-
-# We will extract 3D fields one at a time b/c these 3D arrays are massive (~6.5 GB each), so it 
+    drift_idx = np.where(np.logical_not(np.isnan(out_tbl['xlc_dr'])))[0]
+    out_tbl['XOB'][drift_idx] = out_tbl['XDR'][drift_idx]
+    out_tbl['YOB'][drift_idx] = out_tbl['YDR'][drift_idx]
+    out_tbl['DHR'][drift_idx] = out_tbl['HRDR'][drift_idx]
+    out_tbl['xlc'][drift_idx] = out_tbl['xlc_dr'][drift_idx]
+    out_tbl['ylc'][drift_idx] = out_tbl['ylc_dr'][drift_idx]
+    out_tbl['i0'][drift_idx] = np.floor(out_tbl['ylc'][drift_idx])
+    out_tbl['j0'][drift_idx] = np.floor(out_tbl['xlc'][drift_idx])
+    out_tbl['iwgt'][drift_idx] = 1. - (out_tbl['ylc'][drift_idx] - out_tbl['i0'][drift_idx])
+    out_tbl['jwgt'][drift_idx] = 1. - (out_tbl['xlc'][drift_idx] - out_tbl['j0'][drift_idx])
+    if use_nearest:
+        out_tbl['inear'][drift_idx] = np.around(out_tbl['ylc'][drift_idx])
+        out_tbl['jnear'][drift_idx] = np.around(out_tbl['xlc'][drift_idx])
+    ihr, twgt = iu.cycle_time_bracket(wrf_hr, out_tbl['HRDR_orig'][drift_idx],
+                                      out_tbl['cycle'][drift_idx], cycle_offset)
+    out_tbl['ihr'][drift_idx] = ihr
+    out_tbl['twgt'][drift_idx] = twgt
+
+# Group obs by the WRF times needed for temporal interpolation
+ihr = out_tbl['ihr']
+twgt = out_tbl['twgt']
+
+# We will extract 3D fields one at a time b/c these 3D arrays are massive (~6.5 GB each), so it
 # is not feasible to load all of them at once. Ideally, only 1 should be loaded at any given
 # time. Therefore, unlike the 2D obs, we will loop over each obs time interval and each WRF
 # field.
 
 # Another approach that could have been taken here is to lazily load each 3D field using Xarray
 # datasets. While this would address the memory issues, it would create computational issues b/c
-# the dataset will have to be queried for each BUFR entry and each variable, which is time 
+# the dataset will have to be queried for each BUFR entry and each variable, which is time
 # consuming. Tests comparing the use of Xarray datasets to regular Numpy arrays show that the
 # Numpy array approach is ~23x faster.
 
@@ -558,180 +760,225 @@ for vg, vinterp_d in enumerate(vinterp):
 
     # If ZOB is used as the vertical coordinate, change heights AGL to heights MSL
     if (height_opt == 'agl') and (vinterp_d['var'] == 'ZOB'):
-        for j in np.where(out_df['vgroup'] == vg)[0]:
-            out_df.loc[j, 'ZOB'] = out_df.loc[j, 'ZOB'] + cou.interp_x_y_t(wrf_data, wrf_hr, 
-                                                                           vars_2d['ZOB'], 
-                                                                           out_df.loc[j], 0, 1)
-
-    for hr in wrf_hr: 
+        rows = np.where(out_tbl['vgroup'] == vg)[0]
+        zsfc = iu.interp_x_y_t(wrf_data, wrf_hr, vars_2d['ZOB'],
+                               *[out_tbl[c][rows] for c in ['i0', 'j0', 'iwgt', 'jwgt']],
+                               np.zeros(rows.size), np.ones(rows.size))
+        out_tbl['ZOB'][rows] = out_tbl['ZOB'][rows] + zsfc
+
+# Vertical coordinate used by each vertical interpolation group
+vgroup_var = np.array([vinterp_d['var'] for vinterp_d in vinterp])
+
+# Split 3D obs into blocks of (at most) chunk_size obs. Interpolation tasks are only created for one
+# block at a time. Obs are sorted by horizontal tile so that each block covers a small part of the 
+# domain, which keeps the 3D windows read for each block small
+idx3d = np.sort(np.array(ob_idx['3d'], dtype=int))
+if chunk_size is None:
+    blocks3d = [idx3d]
+else:
+    ntile_j = (jmax // tile_size) + 1
+    tile3d = ((out_tbl['i0'][idx3d] // tile_size) * ntile_j) + (out_tbl['j0'][idx3d] // tile_size)
+    blocks3d = np.array_split(idx3d[np.argsort(tile3d, kind='stable')],
+                              max(1, math.ceil(idx3d.size / chunk_size)))
+
+# Interpolated values are accumulated here (rather than in out_tbl)
+val3d = {}
+val3d_done = {}
+for o in vars_3d:
+    val3d[o] = np.zeros(nrow)
+    val3d_done[o] = np.zeros(nrow, dtype=bool)
 
-        # Determine indices of obs within wrf_step of this output time
-        ind = np.where((out_df['DHR'] > (hr - wrf_step_dec)) & 
-                       (out_df['DHR'] < (hr + wrf_step_dec)) &
-                       (out_df['vgroup'] == vg))[0]
+for b, blk in enumerate(blocks3d):
 
-        # If no indices, move to next time
-        if ind.size == 0:
+    if len(blocks3d) > 1:
+        print()
+        print('3D block %d of %d (%d obs)' % (b + 1, len(blocks3d), blk.size))
+
+    # Compute the vertical coordinate at each ob location (interpolated in time) and use it to
+    # determine the vertical interpolation weights. The vertical coordinate columns are discarded
+    # once the weights are known, so only the columns for a small batch of obs are in memory at once
+    for vg, vinterp_d in enumerate(vinterp):
+        vrows = blk[out_tbl['vgroup'][blk] == vg]
+        vrows = vrows[drop_reason[vrows] == iu.DROP_NONE]
+
+        # Drop rows if ob used for vertical interpolation is missing
+        miss = np.isnan(out_tbl[vinterp_d['var']][vrows])
+        drop_reason[vrows[miss]] = iu.DROP_MISSING_VCOORD
+        vrows = vrows[np.logical_not(miss)]
+        if debug > 2:
+            print('Dropping %d idx: Missing ob for vertical interp' % miss.sum())
+        if vrows.size == 0:
             continue
 
         print()
         print('3D Vertical Coordinate: %s' % vinterp_d['model_field'])
         print()
 
-        # Extract field from UPP
-        # It seems rather silly to include [:, :, :] before calling .values, but this really
-        # helps with memory management. Including these indices allows the program to deallocate
-        # wrf3d when setting wrf3d = 0.
-        if debug > 0:
-            time_3d = dt.datetime.now()
-        wrf3d = wrf_ds[hr][vinterp_d['model_field']][:, :, :].values
-        if debug > 0:
-            print('time to extract %s = %.6f s' % (vinterp_d['model_field'], 
-                                                   (dt.datetime.now() - time_3d).total_seconds()))
-            for l in os.popen('free -t -m -h').readlines():
-                print(l)
-            print()
-
-        # Loop over each 3D observation within this time interval
-        for j in ind:
-
-            # Check to make sure that we didn't already drop this row
-            if j in drop_idx:
-                continue
-
-            # Drop row if ob used for vertical interpolation is missing
-            if np.isnan(out_df.loc[j, vinterp_d['var']]):
-                drop_idx.append(j)
-                if debug > 2:
-                    print('Dropping idx: Missing ob for vertical interp')
-                continue
-
-            if debug > 1:
-                time_jstart = dt.datetime.now()
+        if debug > 1:
+            time_jstart = dt.datetime.now()
+
+        # Each ob uses the WRF time before the ob and, if twgt < 1, the WRF time after the ob. WRF
+        # fields are read one window at a time (see iu.iter_bracket_windows)
+        second = twgt[vrows] < 1
+        hcols = [out_tbl[c][vrows] for c in ['i0', 'j0', 'iwgt', 'jwgt']]
+        perf.start_timer('vcoord_read:%s' % vinterp_d['model_field'])
+        for n, wrf3d0, wrf3d1, ioff, joff in iu.iter_bracket_windows([(wrf_ds[hr],
+                                                                       vinterp_d['model_field'])
+                                                                      for hr in wrf_hr],
+                                                                     hcols[0], hcols[1],
+                                                                     ihr[vrows], second,
+                                                                     read_mode=read_mode,
+                                                                     tile_size=tile_size,
+                                                                     prefetch=prefetch):
+            perf.stop_timer('vcoord_read:%s' % vinterp_d['model_field'])
+            perf.count('windows_vcoord')
+
+            if debug > 0:
+                print('window shape for %s = %s' % (vinterp_d['model_field'], str(wrf3d0.shape)))
+                print('peak RSS = %.1f MB' % perf.peak_rss_mb())
                 print()
 
-            # First half of vertical coordinate calculation
-            if np.isclose(v1d[0, j], 1e9):         
-
-                # Determine weight for temporal interpolation
-                ihr, twgt = cou.determine_twgt(wrf_hr, out_df.loc[j, 'DHR'])
-                out_df.loc[j, 'twgt']  = twgt 
-
-                v1d[:, j] = twgt * vinterp_d['conversion'] * cou.interp_x_y(wrf3d, out_df.loc[j], threeD=True)
-
-                if debug > 1:
-                    print('total time for v1 = %.6f s' % 
-                          (dt.datetime.now() - time_jstart).total_seconds())
-                    entry_timesv1.append((dt.datetime.now() - time_jstart).total_seconds())
-
-                # Special case: twgt = 1. In this case, we don't need to interpolate in time, so 
-                # we can skip the second part of the vertical coordinate calculation
-                if np.isclose(twgt, 1):
-                    vdone[j] = 1
-
-            # Second half of vertical coordinate calculation
-            else:
-                v1d[:, j] = v1d[:, j] + ((1.-out_df.loc[j, 'twgt']) * vinterp_d['conversion'] * 
-                                         cou.interp_x_y(wrf3d, out_df.loc[j], threeD=True))
-                vdone[j] = 1
-                        
-                if debug > 1:
-                    print('total time for v2 = %.6f s' % 
-                          (dt.datetime.now() - time_jstart).total_seconds())
-                    entry_timesv2.append((dt.datetime.now() - time_jstart).total_seconds())
-
-            if vdone[j]: 
-                # Check for extrapolation
-                if ((v1d[:, j].min() < out_df.loc[j, vinterp_d['var']]) and 
-                    (v1d[:, j].max() > out_df.loc[j, vinterp_d['var']])):
-                    if vinterp_d['ascend']:
-                        out_df.loc[j, 'ki0'] = np.where(v1d[:, j] < out_df.loc[j, vinterp_d['var']])[0][-1]
-                    else:
-                        out_df.loc[j, 'ki0'] = np.where(v1d[:, j] > out_df.loc[j, vinterp_d['var']])[0][-1]
-                    if debug > 1:
-                        print('ki0 = %d' % out_df.loc[j, 'ki0'])
-                    out_df.loc[j, vinterp_d['var']], out_df.loc[j, 'kwgt'] = cou.interp_wrf_1d(v1d[:, j], out_df.loc[j],
-                                                                                               var=vinterp_d['var'],
-                                                                                               itype=vinterp_d['type'])
-                else:
-                    drop_idx.append(j)
-                    if debug > 2:
-                        print('Dropping idx: Extrapolation in vertical')
-                    continue
-
-                if debug > 1:
-                    print('interpolated V = %.2f' % out_df.loc[j, vinterp_d['var']])
-                    print('actual V = %.2f' % bufr_csv.df.loc[j, vinterp_d['var']])
-          
-        # Free up memory (shouldn't have to call garbage collector after this)
-        wrf3d = 0.
-
-# Loop over each variable
-for o in vars_3d:
-
-    # Loop over each WRF time
-    for hr in wrf_hr: 
-
-        # Determine indices of obs within wrf_step of this output time
-        ind = np.where(np.logical_and(out_df['DHR'] > (hr - wrf_step_dec), 
-                                      out_df['DHR'] < (hr + wrf_step_dec)))
-        ind = np.intersect1d(ind, np.array(ob_idx['3d']))
+            perf.start_timer('vcoord_interp:%s' % vinterp_d['model_field'])
+            rows = vrows[n]
+            inside, ki0, kwgt, vnew = iu.vert_wgts_t(wrf3d0, wrf3d1, hcols[0][n] - ioff,
+                                                     hcols[1][n] - joff, hcols[2][n], hcols[3][n],
+                                                     twgt[rows], second[n],
+                                                     out_tbl[vinterp_d['var']][rows],
+                                                     vinterp_d['ascend'],
+                                                     itype=vinterp_d['type'],
+                                                     conversion=vinterp_d['conversion'])
+
+            # Free up memory (shouldn't have to call garbage collector after this)
+            wrf3d0 = 0.
+            wrf3d1 = 0.
+
+            # Drop rows that require extrapolation in the vertical
+            drop_reason[rows[np.logical_not(inside)]] = iu.DROP_VERT_EXTRAP
+            if debug > 2:
+                print('Dropping %d idx: Extrapolation in vertical' % (rows.size - inside.sum()))
+            rows = rows[inside]
+            out_tbl['ki0'][rows] = ki0
+            out_tbl[vinterp_d['var']][rows] = vnew
+            out_tbl['kwgt'][rows] = kwgt
+            perf.stop_timer('vcoord_interp:%s' % vinterp_d['model_field'])
+            perf.start_timer('vcoord_read:%s' % vinterp_d['model_field'])
+        perf.stop_timer('vcoord_read:%s' % vinterp_d['model_field'])
+
+        if debug > 1:
+            print('total time for vertical coordinate (%d obs) = %.6f s' %
+                  (vrows.size, (dt.datetime.now() - time_jstart).total_seconds()))
+
+    # Determine the (variable, WRF time) pairs needed for interpolation. Once the vertical weights
+    # are known, each pair is independent, so pairs can be interpolated in any order (or in
+    # parallel). Each ob is the sum of two halves: one from the WRF time before the ob
+    # (weight = twgt) and one from the WRF time after the ob (weight = 1 - twgt). Groups are the
+    # same for all variables
+    groups3d = iu.time_groups(ihr[blk], twgt[blk], len(wrf_hr))
+
+    tasks = []
+    for o in vars_3d:
+
+        if o == 'POB': unit_correct = 1e-2
+        else: unit_correct = 1
+
+        # Loop over each WRF time
+        for k, hr in enumerate(wrf_hr):
+
+            # Indices of obs that use this output time
+            ind = blk[groups3d[k][0]]
+            wgt = groups3d[k][1]
+
+            # Skip rows that were already dropped, rows with missing obs, and rows where this
+            # variable is the vertical coordinate
+            keep = drop_reason[ind] == iu.DROP_NONE
+            keep[keep] = np.logical_and(np.logical_not(np.isnan(out_tbl[o][ind[keep]])),
+                                        vgroup_var[out_tbl['vgroup'][ind[keep]]] != o)
+            ind = ind[keep]
+
+            # If no indices, move to next time
+            if ind.size == 0:
+                continue
 
-        # If no indices, move to next time
-        if ind.size == 0:
-            continue
+            tasks.append({'var':o, 'hr':hr, 'ind':ind, 'unit_correct':unit_correct,
+                          'twgt':wgt[keep],
+                          'cols':[out_tbl[c][ind] for c in
+                                  ['i0', 'j0', 'ki0', 'iwgt', 'jwgt', 'kwgt']]})
 
+    # Perform interpolation. Each worker process only holds one 3D field at a time, so the number
+    # of processes is limited by max_resident_fields. The 'fork' context is used so that worker
+    # processes do not rerun this script
+    nproc = min(workers, max_resident_fields)
+    if nproc > 1:
         print()
-        print('3D Interp: %s' % vars_3d[o])
-        print()
-
-        # Extract field from UPP
+        print('Performing 3D interpolation using %d processes' % nproc)
+        perf.start_timer('interp_3d_parallel')
+        with ProcessPoolExecutor(max_workers=nproc,
+                                 mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = {}
+            for t in tasks:
+                fut = pool.submit(iu.interp_3d_field_from_file,
+                                  wrf_ds[t['hr']].field_file(vars_3d[t['var']]),
+                                  vars_3d[t['var']], t['cols'], unit_correct=t['unit_correct'],
+                                  read_mode=read_mode, tile_size=tile_size)
+                futures[fut] = t
+            for fut in as_completed(futures):
+                t = futures[fut]
+                val3d[t['var']][t['ind']] = t['twgt'] * fut.result() + val3d[t['var']][t['ind']]
+                val3d_done[t['var']][t['ind']] = True
+                if debug > 1:
+                    print('finished interp for %s at %.2f hr (%d obs)' % (t['var'], t['hr'],
+                                                                           t['ind'].size))
+        perf.stop_timer('interp_3d_parallel')
+        perf.count('tasks_3d', len(tasks))
+    else:
         if debug > 0:
             time_3d = dt.datetime.now()
-        wrf3d = wrf_ds[hr][vars_3d[o]][:, :, :].values
-        if debug > 0:
-            print('time to extract %s = %.6f s' % (vars_3d[o], (dt.datetime.now() - time_3d).total_seconds()))
-            for l in os.popen('free -t -m -h').readlines():
-                print(l)
-            print()
-
-        # Loop over each 3D observation within this time interval
-        for j in ind:
-
-            # Check to make sure that we didn't already drop this row
-            if j in drop_idx:
-                continue
-
-            if debug > 1:
-                time_jstart = dt.datetime.now()
+        t_read = perf.elapsed()
+        for k, n, wrf3d, ioff, joff, last in iu.iter_task_windows([(wrf_ds[t['hr']],
+                                                                    vars_3d[t['var']])
+                                                                   for t in tasks],
+                                                                  [t['cols'][0] for t in tasks],
+                                                                  [t['cols'][1] for t in tasks],
+                                                                  read_mode=read_mode,
+                                                                  tile_size=tile_size,
+                                                                  prefetch=prefetch):
+            t = tasks[k]
+            perf.add_time('read_3d:%s' % vars_3d[t['var']], perf.elapsed() - t_read)
+            perf.count('windows_3d')
+            perf.start_timer('interp_3d:%s' % vars_3d[t['var']])
+            c = [col[n] for col in t['cols']]
+            val = t['unit_correct'] * iu.interp_x_y_z(wrf3d, c[0] - ioff, c[1] - joff, c[2],
+                                                      c[3], c[4], c[5])
+            val3d[t['var']][t['ind'][n]] = t['twgt'][n] * val + val3d[t['var']][t['ind'][n]]
+            val3d_done[t['var']][t['ind'][n]] = True
+            perf.stop_timer('interp_3d:%s' % vars_3d[t['var']])
+
+            # Free up memory (shouldn't have to call garbage collector after this)
+            wrf3d = 0.
+
+            if last and (debug > 0):
                 print()
+                print('3D Interp: %s' % vars_3d[t['var']])
+                print()
+                print('finished interp for %s (%d obs, %.6f s)' %
+                      (t['var'], t['ind'].size, (dt.datetime.now() - time_3d).total_seconds()))
+                print('peak RSS = %.1f MB' % perf.peak_rss_mb())
+                print()
+                time_3d = dt.datetime.now()
+            t_read = perf.elapsed()
+        perf.count('tasks_3d', len(tasks))
 
-            if (not np.isnan(out_df.loc[j, o]) and vinterp[out_df.loc[j, 'vgroup']]['var'] != o):
-                if debug > 1:
-                    time_before_interp = dt.datetime.now()
-                twgt =  out_df.loc[j, 'twgt'] 
-                if o == 'POB': unit_correct = 1e-2
-                else: unit_correct = 1
-                if np.isclose(out_df.loc[j, o], 1e9):
-                    out_df.loc[j, o] = twgt * unit_correct * cou.interp_x_y_z(wrf3d, out_df.loc[j])
-                else:
-                    out_df.loc[j, o] = ((1.-twgt) * unit_correct * cou.interp_x_y_z(wrf3d, out_df.loc[j]) + 
-                                        out_df.loc[j, o])
-                if debug > 1:
-                    time_after_interp = dt.datetime.now()
-                    print('finished interp for %s (%.6f s)' % 
-                          (o, (time_after_interp - time_before_interp).total_seconds()))
-
-            if debug > 1:
-                print('total time = %.6f s' % (dt.datetime.now() - time_jstart).total_seconds())
-                entry_times3d.append((dt.datetime.now() - time_jstart).total_seconds())
-
-        # Free up memory (shouldn't have to call garbage collector after this)
-        wrf3d = 0.
+# Save interpolated values
+for o in vars_3d:
+    rows = np.where(val3d_done[o])[0]
+    out_tbl[o][rows] = val3d[o][rows]
 
+perf.stop_timer('interp_3d')
+perf.count('obs_3d', len(ob_idx['3d']))
+perf.count('blocks_3d', len(blocks3d))
 print()
 print('Done with 3D Obs')
-print('number of dropped obs = %d' % (len(drop_idx) - ndrop2d))
+print('number of dropped obs = %d' % (np.count_nonzero(drop_reason) - ndrop2d))
 print('time = %s s' % (dt.datetime.now() - start3d).total_seconds())
 print()
 
@@ -740,96 +987,172 @@ print()
 # Clean Up
 #---------------------------------------------------------------------------------------------------
 
-# Drop rows that we skipped as well as the extra columns we added
-debug_df = out_df.copy()
-out_df.drop(labels=extra_col_int, axis=1, inplace=True)
-out_df.drop(labels=extra_col_float, axis=1, inplace=True)
-out_df.drop(index=drop_idx, inplace=True)
-out_df.reset_index(drop=True, inplace=True)
-bufr_csv.df.drop(index=drop_idx, inplace=True)
-bufr_csv.df.reset_index(drop=True, inplace=True)
-debug_df.drop(index=drop_idx, inplace=True)
-debug_df.reset_index(drop=True, inplace=True)
-
-# Convert to proper units
-out_df['QOB'] = out_df['QOB'] * 1e6
-out_df['TOB'] = out_df['TOB'] - 273.15
-out_df['PMO'] = out_df['PMO'] * 1e-2
-
-# For PWAT, UPP is in kg/m^2, but we need mm
-# Assume density of water is 997 kg/m^3 (true for water temperature of ~25C)
-# https://www.usgs.gov/special-topics/water-science-school/science/water-density
-out_df['PWO'] = (out_df['PWO'] / 997.) * 1000.
-
-out_df['ELV'] = np.int64(np.around(out_df['ELV']))
-idx_3d = np.where((out_df['subset'] == 'AIRCAR') | (out_df['subset'] == 'AIRCFT') | 
-                  (out_df['subset'] == 'ADPUPA'))[0]
-out_df.loc[idx_3d, 'ZOB'] = mc.geopotential_to_height(out_df.loc[idx_3d, 'ZOB'].values * units.m * const.g).to('m').magnitude
-if interp_latlon:
-    idx = np.where((out_df['subset'] == 'ADPSFC') | (out_df['subset'] == 'SFCSHP') |
-                   (out_df['subset'] == 'MSONET'))[0] 
-    out_df.loc[idx, 'XOB'] = out_df.loc[idx, 'XOB'] + 360.
-
-# Compute derived quantities (TDO and Tv)
-tv_idx = np.where(np.isclose(out_df['tvflg'], 0))[0]
-print('number of Tv obs = %d' % len(tv_idx))
-if use_Tv:
-    mix_ratio = mc.mixing_ratio_from_specific_humidity(out_df.loc[tv_idx, 'QOB'].values * units.mg / units.kg)
-    out_df.loc[tv_idx, 'TOB'] = mc.virtual_temperature(out_df.loc[tv_idx, 'TOB'].values * units.degC,
-                                                       mix_ratio).to('degC').magnitude
-else:
-    out_df.loc[tv_idx, 'tvflg'] = 1
-out_df = bufr.compute_dewpt(out_df)
+perf.start_timer('clean_up')
 
-# If we didn't interpolate ZOB for AIRCAR and AIRCFT, copy values from original BUFR file
-# For aircraft, also copy ZOB to ELV
-air_idx = np.where((out_df['subset'] == 'AIRCAR') | (out_df['subset'] == 'AIRCFT'))[0]
-if not interp_z_aircft:
-    out_df.loc[air_idx, 'ZOB'] = bufr_csv.df.loc[air_idx, 'ZOB']
-out_df.loc[air_idx, 'ELV'] = np.int64(np.around(out_df.loc[air_idx, 'ZOB']))
-
-# Reset (XOB, YOB) for ADPUPA obs if (XDR, YDR) was used for ADPUPA locations
-if use_raob_drift:
-    if 'ADPUPA' in ob_idx.keys():
-        out_df.loc[ob_idx['ADPUPA'], 'XOB'] = bufr_csv.df.loc[ob_idx['ADPUPA'], 'XOB']
-        out_df.loc[ob_idx['ADPUPA'], 'YOB'] = bufr_csv.df.loc[ob_idx['ADPUPA'], 'YOB']
-        out_df.loc[ob_idx['ADPUPA'], 'DHR'] = bufr_csv.df.loc[ob_idx['ADPUPA'], 'DHR']
+# The output is processed and written in blocks of chunk_size rows so that only one block of the
+# output DataFrames is in memory at a time. If chunk_size is None, all rows are processed at once
+if chunk_size is None:
+    out_blocks = [np.arange(nrow)]
+else:
+    out_blocks = np.array_split(np.arange(nrow), max(1, math.ceil(nrow / chunk_size)))
 
-# Set ceilings >= 20000 to NaN
-if add_ceiling:
-    out_df.loc[out_df['ceil'] > 19999.9, 'ceil'] = np.nan
-
-# Set certain fields all to NaN if desired
-for field in nan_fields:
-    out_df.loc[:, field] = np.nan
-    bufr_csv.df.loc[:, field] = np.nan
-
-# Copy UOB and VOB to UFC and VFC
-if copy_winds:
-    out_df['UFC'] = out_df['UOB']
-    out_df['VFC'] = out_df['VOB']
-    bufr_csv.df['UFC'] = bufr_csv.df['UOB']
-    bufr_csv.df['VFC'] = bufr_csv.df['VOB']
-    debug_df['UFC'] = debug_df['UOB']
-    debug_df['VFC'] = debug_df['VOB']
-
-# Write output DataFrame to a CSV file
+# Output files (one pair of files per prepBUFR time)
 # real_red.prepbufr.csv file can be used for assessing interpolation accuracy
-bufr.df_to_csv(out_df, '%s/%s.%s.fake.prepbufr.csv%s' % (fake_bufr_dir, bufr_time.strftime('%Y%m%d%H%M'),  
-                                                         bufr_tag, bufr_suffix))
-bufr.df_to_csv(bufr_csv.df, '%s/%s.%s.real_red.prepbufr.csv%s' % (fake_bufr_dir, bufr_time.strftime('%Y%m%d%H%M'), 
-                                                                  bufr_tag, bufr_suffix))
+writers = {}
+for n, t in enumerate(bufr_times):
+    for kind in ['fake', 'real_red']:
+        writers[(n, kind)] = ob_io.obFileWriter('%s/%s.%s.%s.prepbufr.%s%s' %
+                                                (fake_bufr_dir, t.strftime('%Y%m%d%H%M'),
+                                                 bufr_tag, kind, ob_fmt, bufr_suffix))
+
+# Output DataFrames are also saved in cycle_out so they can be used by run_pipeline.py (only if
+# all rows are processed at once)
+cycle_out = {}
+diag_dfs = [outside_df]
+ntv = 0
+for blk in out_blocks:
+
+    # Convert output observation table back to a DataFrame
+    out_df = out_tbl.to_dataframe(rows=blk)
+    real_df = bufr_csv.df.iloc[blk].reset_index(drop=True)
+    blk_drop_reason = drop_reason[blk]
+
+    # Save drop diagnostics
+    drop_idx = np.where(blk_drop_reason != iu.DROP_NONE)[0]
+    diag_df = out_df.loc[drop_idx, diag_cols].copy()
+    diag_df['drop_reason'] = blk_drop_reason[drop_idx]
+
+    # Drifted ADPUPA obs have (XOB, YOB, DHR) replaced by (XDR, YDR, HRDR) during the 
+    # interpolation. Report the launch location and time (DHR_orig) in the diagnostics instead
+    if use_raob_drift:
+        drift_drop = drop_idx[np.logical_not(np.isnan(out_df['xlc_dr'].values[drop_idx]))]
+        for c in ['XOB', 'YOB']:
+            diag_df.loc[drift_drop, c] = real_df.loc[drift_drop, c].values
+    diag_dfs.append(diag_df)
+
+    # Drop rows that we skipped as well as the extra columns we added
+    debug_df = out_df.copy()
+    out_df.drop(labels=extra_col_int, axis=1, inplace=True)
+    out_df.drop(labels=extra_col_float, axis=1, inplace=True)
+    out_df.drop(index=drop_idx, inplace=True)
+    out_df.reset_index(drop=True, inplace=True)
+    real_df.drop(index=drop_idx, inplace=True)
+    real_df.reset_index(drop=True, inplace=True)
+    debug_df.drop(index=drop_idx, inplace=True)
+    debug_df.reset_index(drop=True, inplace=True)
+
+    # Convert to proper units
+    out_df['QOB'] = out_df['QOB'] * 1e6
+    out_df['TOB'] = out_df['TOB'] - 273.15
+    out_df['PMO'] = out_df['PMO'] * 1e-2
+
+    # For PWAT, UPP is in kg/m^2, but we need mm
+    # Assume density of water is 997 kg/m^3 (true for water temperature of ~25C)
+    # https://www.usgs.gov/special-topics/water-science-school/science/water-density
+    out_df['PWO'] = (out_df['PWO'] / 997.) * 1000.
+
+    out_df['ELV'] = np.int64(np.around(out_df['ELV']))
+    idx_3d = np.where((out_df['subset'] == 'AIRCAR') | (out_df['subset'] == 'AIRCFT') |
+                      (out_df['subset'] == 'ADPUPA'))[0]
+    out_df.loc[idx_3d, 'ZOB'] = mc.geopotential_to_height(out_df.loc[idx_3d, 'ZOB'].values * units.m * const.g).to('m').magnitude
+    if interp_latlon:
+        idx = np.where((out_df['subset'] == 'ADPSFC') | (out_df['subset'] == 'SFCSHP') |
+                       (out_df['subset'] == 'MSONET'))[0]
+        out_df.loc[idx, 'XOB'] = out_df.loc[idx, 'XOB'] + 360.
+
+    # Compute derived quantities (TDO and Tv)
+    tv_idx = np.where(np.isclose(out_df['tvflg'], 0))[0]
+    ntv = ntv + len(tv_idx)
+    if use_Tv:
+        mix_ratio = mc.mixing_ratio_from_specific_humidity(out_df.loc[tv_idx, 'QOB'].values * units.mg / units.kg)
+        out_df.loc[tv_idx, 'TOB'] = mc.virtual_temperature(out_df.loc[tv_idx, 'TOB'].values * units.degC,
+                                                           mix_ratio).to('degC').magnitude
+    else:
+        out_df.loc[tv_idx, 'tvflg'] = 1
+    out_df = bufr.compute_dewpt(out_df)
+
+    # If we didn't interpolate ZOB for AIRCAR and AIRCFT, copy values from original BUFR file
+    # For aircraft, also copy ZOB to ELV
+    air_idx = np.where((out_df['subset'] == 'AIRCAR') | (out_df['subset'] == 'AIRCFT'))[0]
+    if not interp_z_aircft:
+        out_df.loc[air_idx, 'ZOB'] = real_df.loc[air_idx, 'ZOB']
+    out_df.loc[air_idx, 'ELV'] = np.int64(np.around(out_df.loc[air_idx, 'ZOB']))
+
+    # Reset (XOB, YOB) for ADPUPA obs if (XDR, YDR) was used for ADPUPA locations
+    if use_raob_drift:
+        raob_idx = np.where(out_df['subset'] == 'ADPUPA')[0]
+        for c in ['XOB', 'YOB', 'DHR', 'DHR_orig']:
+            out_df.loc[raob_idx, c] = real_df.loc[raob_idx, c]
+
+    # Set certain fields all to NaN if desired
+    for field in nan_fields:
+        out_df.loc[:, field] = np.nan
+        real_df.loc[:, field] = np.nan
+
+    # Copy UOB and VOB to UFC and VFC
+    if copy_winds:
+        out_df['UFC'] = out_df['UOB']
+        out_df['VFC'] = out_df['VOB']
+        real_df['UFC'] = real_df['UOB']
+        real_df['VFC'] = real_df['VOB']
+        debug_df['UFC'] = debug_df['UOB']
+        debug_df['VFC'] = debug_df['VOB']
+
+    # Write output DataFrames to CSV (or Parquet) files
+    for n, t in enumerate(bufr_times):
+        cycle_dfs = []
+        for df, kind in zip([out_df, real_df], ['fake', 'real_red']):
+            cycle_df = df.loc[df['cycle'] == n].drop(labels='cycle', axis=1)
+            cycle_df.reset_index(drop=True, inplace=True)
+            cycle_df['DHR'] = cycle_df['DHR_orig']
+            cycle_df['HRDR'] = cycle_df['HRDR_orig']
+            cycle_df.drop(labels=['DHR_orig', 'HRDR_orig'], axis=1, inplace=True)
+            with perf.timer('write_output'):
+                writers[(n, kind)].write(cycle_df)
+            cycle_dfs.append(cycle_df)
+        if chunk_size is None:
+            cycle_out[t.strftime('%Y%m%d%H%M')] = {'fake':cycle_dfs[0], 'real_red':cycle_dfs[1]}
+
+    if len(out_blocks) > 1:
+        print('finished writing output for %d of %d rows' % (blk[-1] + 1, nrow))
+
+with perf.timer('write_output'):
+    for w in writers.values():
+        w.close()
+out_tbl = None
+print('number of Tv obs = %d' % ntv)
+
+# Write drop diagnostics to a sidecar file
+diag_df = pd.concat(diag_dfs, ignore_index=True)
+diag_df['drop_name'] = [iu.DROP_REASONS[c] for c in diag_df['drop_reason'].values]
+for n, t in enumerate(bufr_times):
+    cycle_df = diag_df.loc[diag_df['cycle'] == n].drop(labels='cycle', axis=1)
+    cycle_df['DHR'] = cycle_df['DHR_orig']
+    cycle_df.drop(labels='DHR_orig', axis=1, inplace=True)
+    cycle_df.to_csv('%s/%s.%s.drop_diag.csv%s' % (fake_bufr_dir, t.strftime('%Y%m%d%H%M'),
+                                                  bufr_tag, bufr_suffix), index=False)
+print()
+print('Dropped obs by reason:')
+for name, count in iu.drop_counts(diag_df['drop_reason'].values).items():
+    print('  %s = %d' % (name, count))
+    perf.count('dropped:%s' % name, count)
+perf.count('obs_output', nrow - np.count_nonzero(drop_reason))
+perf.stop_timer('clean_up')
 
 # Timing
 print()
 print('END OF PROGRAM')
-if debug > 1:
-    print()
-    for a, s in zip([entry_times2d, entry_timesv1, entry_timesv2, entry_times3d],
-                    ['2D', 'P1', 'P2', '3D']):
-        if len(a) > 0:
-            print('avg time per %s entries = %.6f s' % (s, np.mean(np.array(a))))
 print('total time = %s s' % (dt.datetime.now() - begin).total_seconds())
+print('peak RSS = %.1f MB' % perf.peak_rss_mb())
+# A single report is written for all prepBUFR times in this job (named after the first time)
+if timing_report:
+    perf.meta = {'cycles':[t.strftime('%Y%m%d%H%M') for t in bufr_times], 'tag':bufr_tag,
+                 'upp_times':len(wrf_hr), 'read_mode':read_mode, 'workers':workers, 
+                 'prefetch':prefetch, 'chunk_size':chunk_size}
+    timing_fname = '%s/%s.%s.timing.json%s' % (fake_bufr_dir, bufr_times[0].strftime('%Y%m%d%H%M'),
+                                               bufr_tag, bufr_suffix)
+    perf.write_json(timing_fname)
+    print('timing report written to %s' % timing_fname)
 
 
 """
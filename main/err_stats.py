@@ -0,0 +1,217 @@
+"""
+Streaming Statistics for Observation Errors
+
+errStats objects accumulate statistics of the random errors added to observations for each
+(observation type, variable, pressure bin) as the errors are added, so diagnostics do not require
+rereading the observation files. The following are saved:
+
+    - number of errors, mean, and sum of squared deviations from the mean (combined across batches
+      using the parallel algorithm of Chan et al. 1979)
+    - sum of the squared errtable standard deviations (to compare the actual and expected spread)
+    - histogram of the errors normalized by the errtable standard deviation
+
+Statistics are saved to a compressed NumPy .npz file and can be merged across many cycles (see
+plotting/plot_err_stats.py).
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import os
+
+
+#---------------------------------------------------------------------------------------------------
+# Parameters
+#---------------------------------------------------------------------------------------------------
+
+# Histogram bin edges for errors normalized by the errtable standard deviation. Two extra bins
+# hold values below the first edge and above the last edge
+HIST_EDGES = np.linspace(-5, 5, 41)
+
+
+#---------------------------------------------------------------------------------------------------
+# Classes
+#---------------------------------------------------------------------------------------------------
+
+class errStats():
+    """
+    Error statistics for each observation type, variable, and pressure bin
+
+    Pressure bin k contains pressures p with prs[k] >= p > prs[k+1] (see
+    errtable_index.errtableIndex.prs_bin). The last bin holds observations outside the range of
+    prs or with missing pressure.
+
+    Parameters
+    ----------
+    prs : array
+        Pressure levels (mb) defining the pressure bins (typically the errtable pressure levels)
+    names : list of strings
+        Variable names
+
+    """
+
+    def __init__(self, prs, names):
+        self.prs = np.asarray(prs, dtype=float)
+        self.names = list(names)
+        self.nbin = self.prs.size
+        self.nhist = HIST_EDGES.size + 1
+        self.data = {}
+
+    def _empty(self):
+        shape = [len(self.names), self.nbin]
+        return {'n':np.zeros(shape), 'mean':np.zeros(shape), 'M2':np.zeros(shape),
+                'sig2':np.zeros(shape), 'hist':np.zeros(shape + [self.nhist])}
+
+    def _combine(self, d, v, n, mean, M2):
+        """
+        Combine the counts, means, and M2 for variable index v with those from another batch
+        """
+        n_tot = d['n'][v] + n
+        delta = mean - d['mean'][v]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where(n_tot > 0, n / n_tot, 0.)
+        d['M2'][v] = d['M2'][v] + M2 + delta**2 * d['n'][v] * frac
+        d['mean'][v] = d['mean'][v] + delta * frac
+        d['n'][v] = n_tot
+
+    def update(self, typ, name, pbin, err, sigma):
+        """
+        Add a batch of errors
+
+        Parameters
+        ----------
+        typ : integer
+            Observation type
+        name : string
+            Variable name
+        pbin : array
+            Pressure bin for each error (-1 for observations outside the pressure bins)
+        err : array
+            Errors. NaNs are skipped
+        sigma : array
+            Errtable standard deviation for each error
+
+        Returns
+        -------
+        None
+
+        """
+
+        if typ not in self.data:
+            self.data[typ] = self._empty()
+        d = self.data[typ]
+        v = self.names.index(name)
+
+        keep = np.isfinite(err)
+        err = np.asarray(err, dtype=float)[keep]
+        sigma = np.asarray(sigma, dtype=float)[keep]
+        pbin = np.where(np.asarray(pbin)[keep] < 0, self.nbin - 1, np.asarray(pbin)[keep])
+        if err.size == 0:
+            return None
+
+        n = np.bincount(pbin, minlength=self.nbin).astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(n > 0, np.bincount(pbin, weights=err, minlength=self.nbin) / n, 0.)
+        M2 = np.bincount(pbin, weights=(err - mean[pbin])**2, minlength=self.nbin)
+        self._combine(d, v, n, mean, M2)
+        d['sig2'][v] = d['sig2'][v] + np.bincount(pbin, weights=sigma**2, minlength=self.nbin)
+
+        # Histogram of normalized errors (errors with sigma = 0 are not included)
+        pos = sigma > 0
+        hbin = np.searchsorted(HIST_EDGES, err[pos] / sigma[pos], side='right')
+        d['hist'][v] = d['hist'][v] + np.bincount(pbin[pos] * self.nhist + hbin,
+                                                  minlength=self.nbin * self.nhist).reshape(
+                                                      [self.nbin, self.nhist])
+
+        return None
+
+    def merge(self, other):
+        """
+        Add the statistics from another errStats object (with the same pressure bins and variables)
+        """
+        if (not np.array_equal(self.prs, other.prs)) or (self.names != other.names):
+            raise ValueError('Cannot merge errStats with different pressure bins or variables')
+        for typ, od in other.data.items():
+            if typ not in self.data:
+                self.data[typ] = self._empty()
+            d = self.data[typ]
+            for v in range(len(self.names)):
+                self._combine(d, v, od['n'][v], od['mean'][v], od['M2'][v])
+            d['sig2'] = d['sig2'] + od['sig2']
+            d['hist'] = d['hist'] + od['hist']
+
+    def summary(self):
+        """
+        Create a DataFrame with the count, mean, standard deviation, and errtable standard deviation
+        for each observation type, variable, and pressure bin with at least one error
+        """
+        rows = []
+        for typ in sorted(self.data.keys()):
+            d = self.data[typ]
+            for v, name in enumerate(self.names):
+                for k in np.where(d['n'][v] > 0)[0]:
+                    n = d['n'][v, k]
+                    if k < self.nbin - 1:
+                        pmax, pmin = self.prs[k], self.prs[k+1]
+                    else:
+                        pmax, pmin = np.nan, np.nan
+                    rows.append({'TYP':typ, 'var':name, 'bin':k, 'prs_max':pmax, 'prs_min':pmin,
+                                 'n':int(n), 'mean':d['mean'][v, k],
+                                 'std':np.sqrt(d['M2'][v, k] / n),
+                                 'errtable_std':np.sqrt(d['sig2'][v, k] / n)})
+        return pd.DataFrame(rows)
+
+    def save(self, fname):
+        """
+        Save to a compressed NumPy .npz file
+        """
+        typs = np.array(sorted(self.data.keys()), dtype=int)
+        out = {'prs':self.prs, 'names':np.array(self.names), 'typs':typs}
+        for key in ['n', 'mean', 'M2', 'sig2', 'hist']:
+            out[key] = np.array([self.data[t][key] for t in typs]).reshape(
+                [typs.size, len(self.names), self.nbin] + ([self.nhist] if key == 'hist' else []))
+        np.savez_compressed(fname, **out)
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def stats_fname(stats_dir, ob_fname):
+    """
+    Name of the error statistics file for an observation file named YYYYMMDDHHMM.<tag>.*
+    """
+    base = os.path.basename(ob_fname).split('.')
+    return '%s/%s.err_stats.npz' % (stats_dir, '.'.join(base[:2]))
+
+
+def read_err_stats(fname):
+    """
+    Read an errStats object from a .npz file (see errStats.save)
+    """
+    with np.load(fname) as f:
+        stats = errStats(f['prs'], [str(s) for s in f['names']])
+        arrays = {key:f[key] for key in ['n', 'mean', 'M2', 'sig2', 'hist']}
+        for n, typ in enumerate(f['typs']):
+            stats.data[int(typ)] = {key:arrays[key][n].copy() for key in arrays.keys()}
+    return stats
+
+
+def merge_err_stats(fnames):
+    """
+    Read and merge errStats objects from several .npz files (e.g., one per cycle)
+    """
+    stats = read_err_stats(fnames[0])
+    for f in fnames[1:]:
+        stats.merge(read_err_stats(f))
+    return stats
+
+
+"""
+End err_stats.py
+"""
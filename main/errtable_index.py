@@ -0,0 +1,211 @@
+"""
+Array-Backed Index for GSI Error Tables
+
+A GSI errtable is parsed once (using pyDA_utils.gsi_fcts.read_errtable) into a single array with
+dimensions (ob type, errtable column, pressure level). The array is cached on disk in a NumPy .npz
+file, with the SHA-256 hash of the errtable file in the cache file name, so the errtable only needs
+to be parsed again if it changes.
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import hashlib
+import os
+
+import pyDA_utils.gsi_fcts as gf
+
+
+#---------------------------------------------------------------------------------------------------
+# Classes
+#---------------------------------------------------------------------------------------------------
+
+class errtableIndex():
+    """
+    Error standard deviations for each ob type, errtable column, and pressure level
+
+    Parameters
+    ----------
+    typs : array
+        Observation types (length ntyp)
+    cols : array
+        Errtable column names, including 'prs' (length ncol)
+    vals : array
+        Errtable values with shape (ntyp, ncol, nprs)
+    fname : string, optional
+        Errtable file name
+
+    """
+
+    def __init__(self, typs, cols, vals, fname=None):
+        self.typs = np.asarray(typs, dtype=int)
+        self.cols = [str(c) for c in cols]
+        self.vals = np.asarray(vals, dtype=float)
+        self.fname = fname
+        self.typ_idx = {t:n for n, t in enumerate(self.typs)}
+        self.col_idx = {c:n for n, c in enumerate(self.cols)}
+
+    def __contains__(self, typ):
+        return typ in self.typ_idx
+
+    def keys(self):
+        """
+        Observation types in the errtable
+        """
+        return list(self.typ_idx.keys())
+
+    def prs(self, typ=None):
+        """
+        Errtable pressure levels (mb). Uses the first ob type if typ is None
+        """
+        n = 0 if typ is None else self.typ_idx[typ]
+        return self.vals[n, self.col_idx['prs'], :]
+
+    def get(self, typ, col):
+        """
+        Errtable values for a single ob type and column (one value per pressure level)
+        """
+        return self.vals[self.typ_idx[typ], self.col_idx[col], :]
+
+    def stdev(self, typ, col, pob):
+        """
+        Linearly interpolate errtable values to observation pressures
+
+        Parameters
+        ----------
+        typ : integer
+            Observation type
+        col : string
+            Errtable column (e.g., 'Terr')
+        pob : array
+            Observation pressures (mb). Observations with missing pressure use the value from the
+            first (highest pressure) errtable level
+
+        Returns
+        -------
+        stdev : array
+            Error standard deviations. Missing values are set to 0
+
+        """
+
+        pob = np.asarray(pob, dtype=float)
+        prs = self.prs(typ)
+        vals = self.get(typ, col)
+        stdev = np.interp(pob, prs[::-1], vals[::-1])
+        stdev[np.isnan(pob)] = vals[0]
+        stdev[np.isnan(stdev)] = 0.
+
+        return stdev
+
+    def prs_bin(self, pob, typ=None):
+        """
+        Pressure bin for each observation
+
+        Bin k contains pressures p with prs[k] >= p > prs[k+1]. Observations outside the errtable
+        pressure range (or with missing pressure) are assigned to bin -1
+
+        """
+
+        prs = self.prs(typ)
+        pob = np.asarray(pob, dtype=float)
+        k = prs.size - 1 - np.searchsorted(prs[::-1], pob, side='left')
+        k[np.logical_or(k < 0, k > prs.size - 2)] = -1
+        k[np.isnan(pob)] = -1
+
+        return k
+
+    def to_dict(self):
+        """
+        Convert to the same format as pyDA_utils.gsi_fcts.read_errtable (a dictionary of
+        DataFrames, with one DataFrame per ob type)
+        """
+        out = {}
+        for t, n in self.typ_idx.items():
+            out[t] = pd.DataFrame(self.vals[n].T, columns=self.cols)
+        return out
+
+    def save(self, fname):
+        """
+        Save to a NumPy .npz file
+        """
+        np.savez(fname, typs=self.typs, cols=np.array(self.cols), vals=self.vals)
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def file_hash(fname):
+    """
+    SHA-256 hash of a file
+    """
+    h = hashlib.sha256()
+    with open(fname, 'rb') as fptr:
+        for chunk in iter(lambda: fptr.read(1024**2), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def from_dict(etable, fname=None):
+    """
+    Create an errtableIndex from a dictionary of DataFrames (from pyDA_utils.gsi_fcts.read_errtable)
+    """
+    typs = sorted(etable.keys())
+    cols = list(etable[typs[0]].columns)
+    vals = np.array([etable[t][cols].values.T for t in typs], dtype=float)
+    return errtableIndex(typs, cols, vals, fname=fname)
+
+
+def read_errtable(fname, cache_dir=None, verbose=False):
+    """
+    Read a GSI errtable, using the cached index if the errtable has not changed
+
+    Parameters
+    ----------
+    fname : string
+        GSI errtable file
+    cache_dir : string, optional
+        Directory for the cached index. Defaults to the directory containing the errtable. The
+        index is still returned if the cache cannot be written
+    verbose : boolean, optional
+        Option for verbose output
+
+    Returns
+    -------
+    index : errtableIndex
+        Errtable index
+
+    """
+
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(fname))
+    cache_fname = '%s/%s.%s.npz' % (cache_dir, os.path.basename(fname), file_hash(fname)[:16])
+
+    if os.path.isfile(cache_fname):
+        if verbose:
+            print('reading cached errtable index %s' % cache_fname)
+        with np.load(cache_fname) as data:
+            return errtableIndex(data['typs'], data['cols'], data['vals'], fname=fname)
+
+    # Write to a temporary file first so other jobs never read a partially written cache
+    index = from_dict(gf.read_errtable(fname), fname=fname)
+    try:
+        tmp_fname = '%s.%d.tmp.npz' % (cache_fname[:-4], os.getpid())
+        index.save(tmp_fname)
+        os.replace(tmp_fname, cache_fname)
+        if verbose:
+            print('saved errtable index to %s' % cache_fname)
+    except OSError:
+        print('could not save errtable index to %s' % cache_fname)
+
+    return index
+
+
+"""
+End errtable_index.py
+"""
@@ -0,0 +1,1004 @@
+"""
+Batched Interpolation Utilities for the Synthetic Observation Creator
+
+These functions are vectorized counterparts of the per-observation interpolation functions in
+pyDA_utils.create_ob_utils. Rather than interpolating a single observation (i.e., a single row of
+the prepBUFR DataFrame) at a time, all observations are interpolated at once using NumPy fancy
+indexing on the (i0, j0, iwgt, jwgt, twgt) interpolation columns.
+
+Horizontal corners are always ordered [i0, j0], [i0, j0+1], [i0+1, j0], [i0+1, j0+1], which is the
+same ordering used for the landmask in create_synthetic_obs.py.
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import upp_cache
+
+
+#---------------------------------------------------------------------------------------------------
+# Drop Reason Codes
+#---------------------------------------------------------------------------------------------------
+
+# Each row of the prepBUFR DataFrame is assigned one of these codes. Rows with a nonzero code are
+# not included in the synthetic obs
+DROP_NONE = 0
+DROP_MISSING_VCOORD = 1
+DROP_VERT_EXTRAP = 2
+DROP_OUTSIDE_DOMAIN = 3
+
+DROP_REASONS = {DROP_NONE:'none',
+                DROP_MISSING_VCOORD:'missing vertical coordinate',
+                DROP_VERT_EXTRAP:'vertical extrapolation',
+                DROP_OUTSIDE_DOMAIN:'outside domain'}
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def horiz_wgts(iwgt, jwgt, mask=None):
+    """
+    Compute bilinear interpolation weights for the four horizontal corners of each observation
+
+    Parameters
+    ----------
+    iwgt : array
+        Interpolation weight for the i0 index (1D array with length nobs)
+    jwgt : array
+        Interpolation weight for the j0 index (1D array with length nobs)
+    mask : array, optional
+        Mask with shape (nobs, 4). Set a value to 0 to exclude that corner from the interpolation.
+        The remaining weights are renormalized so they sum to 1. If the remaining weights are all 
+        0 (e.g., all four corners are masked), the mask is ignored for that observation and the 
+        unmasked weights are used
+
+    Returns
+    -------
+    wgts : array
+        Interpolation weights with shape (4, nobs)
+
+    """
+
+    iwgt = np.asarray(iwgt, dtype=float)
+    jwgt = np.asarray(jwgt, dtype=float)
+    wgts = np.array([iwgt * jwgt,
+                     iwgt * (1. - jwgt),
+                     (1. - iwgt) * jwgt,
+                     (1. - iwgt) * (1. - jwgt)])
+
+    if mask is not None:
+        mwgts = wgts * np.asarray(mask, dtype=float).T
+        total = np.sum(mwgts, axis=0)
+        valid = total > 0
+        wgts[:, valid] = mwgts[:, valid] / total[valid]
+
+    return wgts
+
+
+def corner_values(field, i0, j0):
+    """
+    Extract the values of a 2D field at the four horizontal corners of each observation
+
+    Parameters
+    ----------
+    field : array
+        2D model field (ny, nx)
+    i0 : array
+        Index of the gridpoint to the south of each observation
+    j0 : array
+        Index of the gridpoint to the west of each observation
+
+    Returns
+    -------
+    vals : array
+        Field values with shape (nobs, 4)
+
+    """
+
+    i0 = np.asarray(i0, dtype=int)
+    j0 = np.asarray(j0, dtype=int)
+
+    return np.array([field[i0, j0], field[i0, j0+1], field[i0+1, j0], field[i0+1, j0+1]]).T
+
+
+def coastline_mask(wrf_data, wrf_hr, var, i0, j0, ihr, subset, land_subsets=['ADPSFC', 'MSONET'],
+                   water_subsets=['SFCSHP']):
+    """
+    Create a mask so that only land gridpoints are used for land stations and only water 
+    gridpoints are used for marine stations (see horiz_wgts)
+
+    Parameters
+    ----------
+    wrf_data : dictionary
+        Model fields. See interp_x_y_t()
+    wrf_hr : array
+        Model output times (hours relative to the prepBUFR time)
+    var : string
+        Land mask field (1 = land, 0 = water)
+    i0, j0 : arrays
+        Horizontal interpolation indices
+    ihr : array
+        Index of the model output time immediately before each observation
+    subset : array
+        Observation subset (i.e., platform)
+    land_subsets : list, optional
+        Subsets that only use land gridpoints
+    water_subsets : list, optional
+        Subsets that only use water gridpoints
+
+    Returns
+    -------
+    mask : array
+        Mask with shape (nobs, 4). Observations not in land_subsets or water_subsets are not masked
+
+    """
+
+    ihr = np.asarray(ihr, dtype=int)
+    land = np.ones([ihr.size, 4])
+    for k in np.unique(ihr):
+        idx = np.where(ihr == k)[0]
+        land[idx] = corner_values(wrf_data[wrf_hr[k]][var], i0[idx], j0[idx])
+
+    mask = np.ones([ihr.size, 4])
+    rows = np.isin(subset, land_subsets)
+    mask[rows] = land[rows]
+    rows = np.isin(subset, water_subsets)
+    mask[rows] = np.float64(np.logical_not(land[rows]))
+
+    return mask
+
+
+def interp_x_y(field, i0, j0, iwgt, jwgt, mask=None):
+    """
+    Bilinear interpolation in the horizontal for many observations at once
+
+    Parameters
+    ----------
+    field : array
+        Model field. Either 2D (ny, nx) or 3D (nz, ny, nx)
+    i0 : array
+        Index of the gridpoint to the south of each observation
+    j0 : array
+        Index of the gridpoint to the west of each observation
+    iwgt : array
+        Interpolation weight for i0
+    jwgt : array
+        Interpolation weight for j0
+    mask : array, optional
+        Mask with shape (nobs, 4). See horiz_wgts()
+
+    Returns
+    -------
+    val : array
+        Interpolated values. Shape is (nobs) for a 2D field and (nz, nobs) for a 3D field
+
+    """
+
+    i0 = np.asarray(i0, dtype=int)
+    j0 = np.asarray(j0, dtype=int)
+    wgts = horiz_wgts(iwgt, jwgt, mask=mask)
+
+    val = (wgts[0] * field[..., i0, j0] +
+           wgts[1] * field[..., i0, j0+1] +
+           wgts[2] * field[..., i0+1, j0] +
+           wgts[3] * field[..., i0+1, j0+1])
+
+    return val
+
+
+def interp_x_y_t(wrf_data, wrf_hr, var, i0, j0, iwgt, jwgt, ihr, twgt, mask=None):
+    """
+    Bilinear interpolation in the horizontal and linear interpolation in time for many
+    observations at once
+
+    Parameters
+    ----------
+    wrf_data : dictionary
+        Model fields. Keys are the entries in wrf_hr, and each value is another dictionary that
+        contains the model fields (keys are field names)
+    wrf_hr : array
+        Model output times (hours relative to the prepBUFR time)
+    var : string
+        Model field to interpolate
+    i0, j0, iwgt, jwgt : arrays
+        Horizontal interpolation indices and weights
+    ihr : array
+        Index of the model output time immediately before each observation
+    twgt : array
+        Temporal interpolation weight for wrf_hr[ihr]
+    mask : array, optional
+        Mask with shape (nobs, 4). See horiz_wgts()
+
+    Returns
+    -------
+    val : array
+        Interpolated values
+
+    """
+
+    ihr = np.asarray(ihr, dtype=int)
+    twgt = np.asarray(twgt, dtype=float)
+    val = np.zeros(ihr.size)
+
+    # Process all observations that share the same pair of model times together
+    for k in np.unique(ihr):
+        idx = np.where(ihr == k)[0]
+        if mask is None:
+            kmask = None
+        else:
+            kmask = mask[idx]
+        args = [i0[idx], j0[idx], iwgt[idx], jwgt[idx]]
+        v1 = interp_x_y(wrf_data[wrf_hr[k]][var], *args, mask=kmask)
+        if np.all(twgt[idx] == 1):
+            val[idx] = twgt[idx] * v1
+        else:
+            v2 = interp_x_y(wrf_data[wrf_hr[k+1]][var], *args, mask=kmask)
+            val[idx] = twgt[idx] * v1 + (1. - twgt[idx]) * v2
+
+    return val
+
+
+def time_bracket(wrf_hr, dhr):
+    """
+    Determine the model output time immediately before each observation and the weight for 
+    temporal interpolation for many observations at once. Same as cou.determine_twgt
+
+    Parameters
+    ----------
+    wrf_hr : array
+        Model output times (hours relative to the prepBUFR time). Must be sorted
+    dhr : array
+        Observation times (hours relative to the prepBUFR time)
+
+    Returns
+    -------
+    ihr : array
+        Index of the last model output time <= each observation time
+    twgt : array
+        Temporal interpolation weight for wrf_hr[ihr]. Set to 1 if the observation time is
+        >= the last model output time
+
+    """
+
+    wrf_hr = np.asarray(wrf_hr, dtype=float)
+    dhr = np.asarray(dhr, dtype=float)
+    ihr = np.clip(np.searchsorted(wrf_hr, dhr, side='right') - 1, 0, wrf_hr.size - 1)
+
+    twgt = np.ones(dhr.size)
+    inside = ihr < (wrf_hr.size - 1)
+    i = ihr[inside]
+    twgt[inside] = (wrf_hr[i+1] - dhr[inside]) / (wrf_hr[i+1] - wrf_hr[i])
+
+    return ihr, twgt
+
+
+def cycle_time_bracket(wrf_hr, dhr, cycle, cycle_offset):
+    """
+    Same as time_bracket, but for observations from several prepBUFR times. The model output
+    times are shifted to each observation's own prepBUFR time, so the weights are identical to
+    those computed when each prepBUFR time is processed separately
+
+    Parameters
+    ----------
+    wrf_hr : array
+        Model output times (hours relative to the first prepBUFR time). Must be sorted
+    dhr : array
+        Observation times (hours relative to the prepBUFR time of each observation)
+    cycle : array
+        Index of the prepBUFR time of each observation
+    cycle_offset : list
+        Time of each prepBUFR time relative to the first prepBUFR time (hours)
+
+    Returns
+    -------
+    ihr : array
+        Index of the last model output time <= each observation time
+    twgt : array
+        Temporal interpolation weight for wrf_hr[ihr]
+
+    """
+
+    dhr = np.asarray(dhr, dtype=float)
+    cycle = np.asarray(cycle)
+    ihr = np.zeros(dhr.size, dtype=int)
+    twgt = np.ones(dhr.size)
+    for n, offset in enumerate(cycle_offset):
+        rows = np.where(cycle == n)[0]
+        if rows.size > 0:
+            ihr[rows], twgt[rows] = time_bracket(np.asarray(wrf_hr, dtype=float) - offset,
+                                                 dhr[rows])
+
+    return ihr, twgt
+
+
+def time_groups(ihr, twgt, nhr):
+    """
+    Group observations by the model output times needed for temporal interpolation. Each 
+    observation uses model output time ihr (weight = twgt) and, if twgt < 1, model output time 
+    ihr + 1 (weight = 1 - twgt)
+
+    Parameters
+    ----------
+    ihr : array
+        Index of the model output time immediately before each observation (see time_bracket)
+    twgt : array
+        Temporal interpolation weight for model output time ihr
+    nhr : integer
+        Number of model output times
+
+    Returns
+    -------
+    groups : list of tuples
+        (idx, wgt) for each model output time. idx contains the sorted indices of the observations 
+        that use this model output time and wgt contains the temporal interpolation weights
+
+    """
+
+    ihr = np.asarray(ihr, dtype=int)
+    twgt = np.asarray(twgt, dtype=float)
+
+    # Sorting by ihr allows the observations for each model output time to be found using slices
+    order = np.argsort(ihr, kind='stable')
+    bounds = np.searchsorted(ihr[order], np.arange(nhr + 1))
+
+    groups = []
+    for k in range(nhr):
+        before = order[bounds[k]:bounds[k+1]]
+        if k > 0:
+            after = order[bounds[k-1]:bounds[k]]
+            after = after[twgt[after] < 1]
+        else:
+            after = np.array([], dtype=int)
+        idx = np.concatenate([before, after])
+        wgt = np.concatenate([twgt[before], 1. - twgt[after]])
+        srt = np.argsort(idx)
+        groups.append((idx[srt], wgt[srt]))
+
+    return groups
+
+
+def nearest_x_y_t(wrf_data, wrf_hr, var, inear, jnear, dhr):
+    """
+    Nearest-neighbor interpolation in the horizontal and in time for many observations at once
+
+    Parameters
+    ----------
+    wrf_data : dictionary
+        Model fields. See interp_x_y_t()
+    wrf_hr : array
+        Model output times (hours relative to the prepBUFR time)
+    var : string
+        Model field to interpolate
+    inear : array
+        First index of the nearest gridpoint to each observation
+    jnear : array
+        Second index of the nearest gridpoint to each observation
+    dhr : array
+        Observation times (hours relative to the prepBUFR time)
+
+    Returns
+    -------
+    val : array
+        Model field at the nearest gridpoint and nearest model output time
+
+    """
+
+    inear = np.asarray(inear, dtype=int)
+    jnear = np.asarray(jnear, dtype=int)
+    wrf_hr = np.asarray(wrf_hr)
+    ihr = np.argmin(np.abs(wrf_hr[np.newaxis, :] - np.asarray(dhr)[:, np.newaxis]), axis=1)
+    val = np.zeros(inear.size)
+
+    for k in np.unique(ihr):
+        idx = np.where(ihr == k)[0]
+        val[idx] = wrf_data[wrf_hr[k]][var][inear[idx], jnear[idx]]
+
+    return val
+
+
+def find_ki0(v1d, val, ascend):
+    """
+    Find the index of the model level immediately below each observation for many observations
+    at once
+
+    This is equivalent to np.where(v1d[:, j] < val[j])[0][-1] (ascending vertical coordinate) or
+    np.where(v1d[:, j] > val[j])[0][-1] (descending vertical coordinate) for each column j, so it 
+    gives the same answer as np.searchsorted for monotonic columns without requiring the columns 
+    to be monotonic.
+
+    Parameters
+    ----------
+    v1d : array
+        Vertical coordinate columns with shape (nz, nobs)
+    val : array
+        Observed vertical coordinate with length nobs
+    ascend : boolean
+        True if the vertical coordinate increases with height
+
+    Returns
+    -------
+    ki0 : array
+        Index of the model level immediately below each observation
+
+    """
+
+    if ascend:
+        below = v1d < val[np.newaxis, :]
+    else:
+        below = v1d > val[np.newaxis, :]
+    nz = v1d.shape[0]
+    ki0 = nz - 1 - np.argmax(below[::-1, :], axis=0)
+
+    return ki0
+
+
+def interp_wrf_1d(v1d, val, ki0, itype='log'):
+    """
+    Compute vertical interpolation weights for many observations at once
+
+    Parameters
+    ----------
+    v1d : array
+        Vertical coordinate columns with shape (nz, nobs)
+    val : array
+        Observed vertical coordinate with length nobs
+    ki0 : array
+        Index of the model level immediately below each observation (see find_ki0)
+    itype : string, optional
+        Interpolation type ('log' or 'linear')
+
+    Returns
+    -------
+    vinterp : array
+        Vertical coordinate interpolated to the observation using the weights in kwgt
+    kwgt : array
+        Interpolation weight for model level ki0
+
+    """
+
+    cols = np.arange(v1d.shape[1])
+    a0 = v1d[ki0, cols]
+    a1 = v1d[ki0+1, cols]
+
+    if itype == 'log':
+        kwgt = (np.log(a1) - np.log(val)) / (np.log(a1) - np.log(a0))
+        vinterp = np.exp(kwgt * np.log(a0) + (1. - kwgt) * np.log(a1))
+    elif itype == 'linear':
+        kwgt = (a1 - val) / (a1 - a0)
+        vinterp = kwgt * a0 + (1. - kwgt) * a1
+    else:
+        raise ValueError('Unknown vertical interpolation type: %s' % itype)
+
+    return vinterp, kwgt
+
+
+def vert_wgts_t(field0, field1, i0, j0, iwgt, jwgt, twgt, second, val, ascend, itype='log', 
+                conversion=1, batch_size=10000):
+    """
+    Compute vertical interpolation weights for many observations at once using a vertical 
+    coordinate that is interpolated in time between two model fields. Vertical coordinate columns 
+    are computed for batch_size observations at a time and discarded once the weights are known, 
+    so memory usage does not depend on the number of observations
+
+    Parameters
+    ----------
+    field0 : array
+        3D vertical coordinate field (nz, ny, nx) at the model output time before the observations
+    field1 : array
+        3D vertical coordinate field at the model output time after the observations. Can be None
+        if second is False for all observations
+    i0, j0, iwgt, jwgt : arrays
+        Horizontal interpolation indices and weights
+    twgt : array
+        Temporal interpolation weight for field0
+    second : array
+        Boolean array. True if field1 is used for this observation (i.e., twgt < 1)
+    val : array
+        Observed vertical coordinate
+    ascend : boolean
+        True if the vertical coordinate increases with height
+    itype : string, optional
+        Interpolation type ('log' or 'linear')
+    conversion : float, optional
+        Factor applied to the model vertical coordinate
+    batch_size : integer, optional
+        Number of vertical coordinate columns in memory at once
+
+    Returns
+    -------
+    inside : array
+        Boolean array. False if the observation lies outside the model vertical coordinate column 
+        (i.e., vertical interpolation would require extrapolation)
+    ki0 : array
+        Index of the model level immediately below each observation (only for inside obs)
+    kwgt : array
+        Interpolation weight for model level ki0 (only for inside obs)
+    vinterp : array
+        Vertical coordinate interpolated to the observation (only for inside obs)
+
+    """
+
+    i0 = np.asarray(i0, dtype=int)
+    j0 = np.asarray(j0, dtype=int)
+    second = np.asarray(second, dtype=bool)
+    val = np.asarray(val, dtype=float)
+
+    inside = np.zeros(val.size, dtype=bool)
+    out = [[], [], []]
+    for b in range(0, val.size, batch_size):
+        sl = slice(b, b + batch_size)
+        args = [i0[sl], j0[sl], iwgt[sl], jwgt[sl]]
+        v1d = twgt[sl] * (conversion * interp_x_y(field0, *args))
+        s = np.where(second[sl])[0]
+        if s.size > 0:
+            v1d[:, s] = v1d[:, s] + ((1. - twgt[sl][s]) * 
+                                     (conversion * interp_x_y(field1, *[a[s] for a in args])))
+
+        # Check for extrapolation
+        vob = val[sl]
+        ins = np.logical_and(v1d.min(axis=0) < vob, v1d.max(axis=0) > vob)
+        inside[sl] = ins
+        v1d = v1d[:, ins]
+        vob = vob[ins]
+
+        ki0 = find_ki0(v1d, vob, ascend)
+        vinterp, kwgt = interp_wrf_1d(v1d, vob, ki0, itype=itype)
+        for l, a in zip(out, [ki0, kwgt, vinterp]):
+            l.append(a)
+
+    if val.size == 0:
+        ki0, kwgt, vinterp = np.zeros(0, dtype=int), np.zeros(0), np.zeros(0)
+    else:
+        ki0, kwgt, vinterp = [np.concatenate(l) for l in out]
+
+    return inside, ki0, kwgt, vinterp
+
+
+def interp_x_y_z(field, i0, j0, ki0, iwgt, jwgt, kwgt):
+    """
+    Trilinear interpolation (bilinear in the horizontal, linear in the vertical using the 
+    precomputed vertical weights) for many observations at once
+
+    Parameters
+    ----------
+    field : array
+        3D model field (nz, ny, nx)
+    i0, j0, iwgt, jwgt : arrays
+        Horizontal interpolation indices and weights
+    ki0 : array
+        Index of the model level immediately below each observation
+    kwgt : array
+        Interpolation weight for model level ki0
+
+    Returns
+    -------
+    val : array
+        Interpolated values
+
+    """
+
+    i0 = np.asarray(i0, dtype=int)
+    j0 = np.asarray(j0, dtype=int)
+    ki0 = np.asarray(ki0, dtype=int)
+    wgts = horiz_wgts(iwgt, jwgt)
+
+    val = []
+    for k in [ki0, ki0+1]:
+        val.append(wgts[0] * field[k, i0, j0] +
+                   wgts[1] * field[k, i0, j0+1] +
+                   wgts[2] * field[k, i0+1, j0] +
+                   wgts[3] * field[k, i0+1, j0+1])
+    val = kwgt * val[0] + (1. - kwgt) * val[1]
+
+    return val
+
+
+def drop_counts(drop_reason):
+    """
+    Count the number of dropped observations for each drop reason
+
+    Parameters
+    ----------
+    drop_reason : array
+        Drop reason code for each observation (see DROP_REASONS)
+
+    Returns
+    -------
+    counts : dictionary
+        Number of observations for each nonzero drop reason. Keys are the names in DROP_REASONS
+
+    """
+
+    counts = {}
+    for code, name in DROP_REASONS.items():
+        if code != DROP_NONE:
+            counts[name] = int(np.count_nonzero(drop_reason == code))
+
+    return counts
+
+
+def field_windows(i0, j0, read_mode='full', tile_size=100):
+    """
+    Determine the portions of a 3D model field needed to interpolate to a set of observations
+
+    Only the horizontal window containing the observations (plus the 1-gridpoint halo needed for
+    bilinear interpolation) needs to be read from the dataset, which is far less memory intensive 
+    than reading the full 3D field
+
+    Parameters
+    ----------
+    i0 : array
+        Index of the gridpoint to the south of each observation
+    j0 : array
+        Index of the gridpoint to the west of each observation
+    read_mode : string, optional
+        'full' = read the entire field, 'window' = read one window containing all observations, 
+        'tiles' = read one window for the observations in each tile_size x tile_size tile
+    tile_size : integer, optional
+        Tile size (in gridpoints) for read_mode = 'tiles'
+
+    Returns
+    -------
+    windows : list of tuples
+        (idx, bounds) for each window. idx contains the indices of the observations (i.e., 
+        indices of i0 and j0) covered by the window and bounds is [ioff, iend, joff, jend] (None 
+        if the entire field is read). See read_window()
+
+    """
+
+    i0 = np.asarray(i0, dtype=int)
+    j0 = np.asarray(j0, dtype=int)
+
+    if read_mode in ['full', 'window']:
+        groups = [np.arange(i0.size)]
+    elif read_mode == 'tiles':
+        tile = (i0 // tile_size) * (j0.max() // tile_size + 1) + (j0 // tile_size)
+        groups = [np.where(tile == t)[0] for t in np.unique(tile)]
+    else:
+        raise ValueError('Unknown read_mode: %s' % read_mode)
+
+    windows = []
+    for idx in groups:
+        if idx.size == 0:
+            continue
+        if read_mode == 'full':
+            bounds = None
+        else:
+            bounds = [i0[idx].min(), i0[idx].max() + 2, j0[idx].min(), j0[idx].max() + 2]
+        windows.append((idx, bounds))
+
+    return windows
+
+
+def read_window(da, bounds):
+    """
+    Read a window of a 3D model field
+
+    Parameters
+    ----------
+    da : xr.DataArray
+        3D model field (nz, ny, nx)
+    bounds : list
+        [ioff, iend, joff, jend], or None to read the entire field (see field_windows())
+
+    Returns
+    -------
+    field : array
+        Model field within this window
+    ioff : integer
+        Offset that must be subtracted from i0 to index field
+    joff : integer
+        Offset that must be subtracted from j0 to index field
+
+    """
+
+    # It seems rather silly to include [:, :, :] before calling .values, but this really
+    # helps with memory management. Including these indices allows the program to deallocate
+    # the field after it is no longer referenced.
+    if bounds is None:
+        return da[:, :, :].values, 0, 0
+    else:
+        ioff, iend, joff, jend = bounds
+        return da[:, ioff:iend, joff:jend].values, ioff, joff
+
+
+def iter_field_windows(da, i0, j0, read_mode='full', tile_size=100):
+    """
+    Read the portions of a 3D model field needed to interpolate to a set of observations
+
+    Parameters
+    ----------
+    da : xr.DataArray
+        3D model field (nz, ny, nx)
+    i0, j0, read_mode, tile_size :
+        See field_windows()
+
+    Yields
+    ------
+    idx : array
+        Indices of the observations (i.e., indices of i0 and j0) covered by this window
+    field : array
+        Model field within this window
+    ioff : integer
+        Offset that must be subtracted from i0 to index field
+    joff : integer
+        Offset that must be subtracted from j0 to index field
+
+    """
+
+    for idx, bounds in field_windows(i0, j0, read_mode=read_mode, tile_size=tile_size):
+        field, ioff, joff = read_window(da, bounds)
+        yield idx, field, ioff, joff
+
+
+def prefetch_reads(reads):
+    """
+    Call a series of functions that read data and yield the results in order. While the caller 
+    works with one result, the next function is called in a background thread, so reading overlaps 
+    with computation (double buffering).
+
+    At most two results are held in memory at once (the one being used by the caller and the one 
+    being read), provided that the caller releases each result before requesting the next one.
+
+    Parameters
+    ----------
+    reads : list of functions
+        Functions that take no arguments
+
+    Yields
+    ------
+    result : 
+        Output from each function in reads
+
+    """
+
+    if len(reads) == 0:
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        fut = pool.submit(reads[0])
+        for k in range(len(reads)):
+            result = fut.result()
+            fut = None
+            if (k + 1) < len(reads):
+                fut = pool.submit(reads[k+1])
+            yield result
+            result = None
+
+
+def iter_task_windows(fields, i0, j0, read_mode='full', tile_size=100, prefetch=False):
+    """
+    Read the portions of several 3D model fields needed to interpolate to several sets of 
+    observations (one set per field). Fields are read one window at a time in the order given
+
+    Parameters
+    ----------
+    fields : list of tuples
+        (upp, name) for each task, where upp is a upp_cache.UPPFile and name is the field name
+    i0 : list of arrays
+        Index of the gridpoint to the south of each observation (one array per task)
+    j0 : list of arrays
+        Index of the gridpoint to the west of each observation (one array per task)
+    read_mode, tile_size : 
+        See field_windows()
+    prefetch : boolean, optional
+        Option to read the next window in a background thread while the current window is being
+        used (see prefetch_reads()). Set the field to 0 once it is no longer needed so that no
+        more than two windows are held in memory at once
+
+    Yields
+    ------
+    k : integer
+        Task index
+    idx : array
+        Indices of the observations (i.e., indices of i0[k] and j0[k]) covered by this window
+    field : array
+        Model field within this window
+    ioff : integer
+        Offset that must be subtracted from i0[k] to index field
+    joff : integer
+        Offset that must be subtracted from j0[k] to index field
+    last : boolean
+        True if this is the last window for task k
+
+    """
+
+    windows = []
+    reads = []
+    for k, (upp, name) in enumerate(fields):
+        w = field_windows(i0[k], j0[k], read_mode=read_mode, tile_size=tile_size)
+        for m, (idx, bounds) in enumerate(w):
+            windows.append((k, idx, m == (len(w) - 1)))
+            reads.append(partial(read_upp_window, upp, name, bounds))
+
+    if prefetch:
+        results = prefetch_reads(reads)
+    else:
+        results = (r() for r in reads)
+
+    for (k, idx, last), (field, ioff, joff) in zip(windows, results):
+        yield k, idx, field, ioff, joff, last
+
+
+def iter_bracket_windows(fields, i0, j0, ihr, second, read_mode='full', tile_size=100, 
+                         prefetch=False):
+    """
+    Read the portions of a 3D model field needed to interpolate the field in time to a set of 
+    observations. Each observation uses the field at model output time ihr and, if second is True,
+    the field at model output time ihr + 1. Observations are split into windows (see 
+    field_windows()) and the observations in each window are processed in time order, so the field
+    at ihr + 1 is reused for the next group of observations. Each window is only read once for 
+    each model output time, and no more than two windows (three if prefetch = True) are held in 
+    memory at once
+
+    Parameters
+    ----------
+    fields : list of tuples
+        (upp, name) for each model output time, where upp is a upp_cache.UPPFile and name is the 
+        field name
+    i0, j0 : arrays
+        Indices of the gridpoints to the south and west of each observation
+    ihr : array
+        Index of the model output time immediately before each observation
+    second : array
+        Boolean array. True if the observation also uses model output time ihr + 1
+    read_mode, tile_size : 
+        See field_windows()
+    prefetch : boolean, optional
+        See iter_task_windows()
+
+    Yields
+    ------
+    idx : array
+        Indices of the observations in this group (all observations in a group share the same ihr)
+    field0 : array
+        Model field at model output time ihr within this window
+    field1 : array
+        Model field at model output time ihr + 1 within this window. None if second is False for
+        all observations in this group
+    ioff : integer
+        Offset that must be subtracted from i0 to index the fields
+    joff : integer
+        Offset that must be subtracted from j0 to index the fields
+
+    """
+
+    ihr = np.asarray(ihr, dtype=int)
+    second = np.asarray(second, dtype=bool)
+
+    # Model output times needed for each window
+    windows = []
+    reads = []
+    for idx, bounds in field_windows(i0, j0, read_mode=read_mode, tile_size=tile_size):
+        times = np.union1d(ihr[idx], ihr[idx[second[idx]]] + 1)
+        windows.append((idx, times))
+        for t in times:
+            reads.append(partial(read_upp_window, fields[t][0], fields[t][1], bounds))
+
+    if prefetch:
+        results = prefetch_reads(reads)
+    else:
+        results = (r() for r in reads)
+
+    for idx, times in windows:
+        prev = None
+        for t in times:
+            field, ioff, joff = next(results)
+
+            # Observations between the previous time and this time
+            if (prev is not None) and (prev[0] == (t - 1)):
+                grp = idx[ihr[idx] == (t - 1)]
+                if np.any(second[grp]):
+                    yield grp, prev[1], field, ioff, joff
+
+            # Observations that only need this time
+            grp = idx[ihr[idx] == t]
+            if (grp.size > 0) and (not np.any(second[grp])):
+                yield grp, field, None, ioff, joff
+
+            prev = (t, field)
+            field = None
+        prev = None
+
+
+def read_upp_window(upp, name, bounds):
+    """
+    Read a window of a 3D model field from a UPP file. The field is retrieved from the UPP file 
+    here (rather than in iter_task_windows) so that decoding the field (which happens when the 
+    field is not in the UPP cache) also occurs in the background thread when prefetching
+
+    Parameters
+    ----------
+    upp : upp_cache.UPPFile
+        UPP file
+    name : string
+        Field name
+    bounds : list
+        See read_window()
+
+    Returns
+    -------
+    field, ioff, joff : 
+        See read_window()
+
+    """
+
+    return read_window(upp[name], bounds)
+
+
+def interp_3d_field(da, cols, unit_correct=1, read_mode='full', tile_size=100):
+    """
+    Interpolate a 3D model field to a set of observations (no temporal interpolation)
+
+    Parameters
+    ----------
+    da : xr.DataArray
+        3D model field (nz, ny, nx)
+    cols : list of arrays
+        Interpolation indices and weights: [i0, j0, ki0, iwgt, jwgt, kwgt]
+    unit_correct : float, optional
+        Factor applied to the interpolated values
+    read_mode : string, optional
+        How the model field is read. See iter_field_windows()
+    tile_size : integer, optional
+        Tile size (in gridpoints) for read_mode = 'tiles'
+
+    Returns
+    -------
+    val : array
+        Interpolated values
+
+    """
+
+    val = np.zeros(cols[0].size)
+    for n, field, ioff, joff in iter_field_windows(da, cols[0], cols[1], read_mode=read_mode,
+                                                   tile_size=tile_size):
+        val[n] = unit_correct * interp_x_y_z(field, cols[0][n] - ioff, cols[1][n] - joff, 
+                                             cols[2][n], cols[3][n], cols[4][n], cols[5][n])
+
+        # Free up memory (shouldn't have to call garbage collector after this)
+        field = 0.
+
+    return val
+
+
+def interp_3d_field_from_file(fname, field, cols, unit_correct=1, read_mode='full', tile_size=100):
+    """
+    Open a UPP file and interpolate a 3D model field to a set of observations. Used when the 3D 
+    interpolation is performed in a separate process
+
+    Parameters
+    ----------
+    fname : string
+        UPP file name (or UPP cache file name, see upp_cache.py)
+    field : string
+        Name of the 3D model field
+    cols, unit_correct, read_mode, tile_size : 
+        See interp_3d_field()
+
+    Returns
+    -------
+    val : array
+        Interpolated values
+
+    """
+
+    upp = upp_cache.UPPFile(fname)
+    val = interp_3d_field(upp[field], cols, unit_correct=unit_correct, read_mode=read_mode,
+                          tile_size=tile_size)
+    upp.close()
+
+    return val
+
+
+"""
+End interp_utils.py
+"""
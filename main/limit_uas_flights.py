@@ -21,24 +21,124 @@ import datetime as dt
 from pyDA_utils import bufr
 import pyDA_utils.limit_prepbufr as lp
 
+import ob_io
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def limit_uas_flights(df, ref_df, limits_param, drop_col=[], verbose=0):
+    """
+    Remove UAS obs that exceed various meteorological limits (e.g., wind speed or icing)
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Observations to remove UAS obs from
+    ref_df : pd.DataFrame
+        Reference observations used to determine whether limits are exceeded. Must contain the same
+        observations as df (e.g., perfect obs)
+    limits_param : dictionary
+        Limits applied to each observation type (see limit_uas in synthetic_ob_creator_param.yml)
+    drop_col : list of strings, optional
+        Intermediate columns to remove from the output
+    verbose : integer, optional
+        Verbosity level (0 = none, 1 = some, 2 = a lot)
+
+    Returns
+    -------
+    out_df : pd.DataFrame
+        Observations with UAS obs that exceed the limits removed
+
+    """
+
+    # Copy input DataFrames so that they are not modified
+    bufr_obj = ob_io.bufrDataFrame(df.copy())
+    bufr_obj_ref = ob_io.bufrDataFrame(ref_df.copy())
+
+    # Check that bufr_obj and bufr_obj_ref have the same obs
+    check_col = ['SID', 'TYP', 'DHR', 'XOB', 'YOB']
+    for c in check_col:
+        if ~np.all(bufr_obj.df[c].values == bufr_obj_ref.df[c].values):
+            raise ValueError('bufr_obj and bufr_obj_ref contain different observations')
+
+    # Check how many obs we are starting with
+    if verbose > 0:
+        all_typ = np.unique(bufr_obj.df['TYP'])
+        nob_before = {}
+        print()
+        print("initial observation counts...")
+        for t in all_typ:
+            nob_before[t] = len(bufr_obj.df.loc[bufr_obj.df['TYP'] == t])
+            print(f"{t} = {nob_before[t]}")
+        print()
+
+    # Remove BUFR obs that exceed various limits
+    for typ in limits_param.keys():
+        for lim_type in limits_param[typ]:
+
+            if verbose > 0: print(f"Adding {lim_type} limits to {typ}")
+            if verbose > 1: print('  applying limits', dt.datetime.now())
+
+            # Wind speed limit
+            if lim_type == 'wind':
+                bufr_obj_ref = lp.wspd_limit(bufr_obj_ref, wind_type=typ,
+                                             **limits_param[typ][lim_type]['lim_kw'])
+
+            # Icing detection (using RH threshold)
+            if lim_type == 'icing_RH':
+                bufr_obj_ref = lp.detect_icing_RH(bufr_obj_ref, thermo_type=typ,
+                                                  **limits_param[typ][lim_type]['lim_kw'])
+
+            # Icing detection (using ql threshold)
+            if lim_type == 'icing_LIQMR':
+                bufr_obj_ref = lp.detect_icing_LIQMR(bufr_obj_ref, thermo_type=typ,
+                                                     **limits_param[typ][lim_type]['lim_kw'])
+
+            # Remove BUFR obs that exceed the limit
+            if verbose > 1: print('  removing obs   ', dt.datetime.now())
+            idx_drop = lp.remove_obs_after_lim(bufr_obj_ref.df, typ, 
+                                               **limits_param[typ][lim_type]['remove_kw'])
+            bufr_obj_ref.df.drop(idx_drop, inplace=True)
+            bufr_obj_ref.df.reset_index(inplace=True, drop=True)
+            bufr_obj.df.drop(idx_drop, inplace=True)
+            bufr_obj.df.reset_index(inplace=True, drop=True)
+
+    # Print how many obs were removed
+    if verbose > 0: 
+        print()
+        print("final observation counts...")
+        for t in all_typ:
+            nob = len(bufr_obj.df.loc[bufr_obj.df['TYP'] == t])
+            print(f"{t} = {nob} ({100*(nob_before[t] - nob) / nob_before[t]:.3f}% reduction)")
+        print()
+
+    # Remove intermediate fields
+    if verbose > 1: print('removing intermediate columns', dt.datetime.now())
+    out_df = bufr_obj.df.drop(drop_col, axis=1)
+
+    return out_df
+
 
 #---------------------------------------------------------------------------------------------------
 # Input Parameters
 #---------------------------------------------------------------------------------------------------
 
 # Option to use input from YAML file 
-if len(sys.argv) > 1:
+if (__name__ == '__main__') and (len(sys.argv) > 1):
     bufr_t = sys.argv[1]
     tag = sys.argv[2]
     with open(sys.argv[3], 'r') as fptr:
         param = yaml.safe_load(fptr)
-    in_csv_fname = f"{param['paths']['syn_limit_uas_csv']}/{bufr_t}.{tag}.input.csv"
-    out_csv_fname = f"{param['paths']['syn_limit_uas_csv']}/{bufr_t}.{tag}.output.csv"
-    csv_ref_fname = f"{param['paths'][param['limit_uas']['csv_ref_dir']]}/{bufr_t}.{tag}.fake.prepbufr.csv"
+    ob_fmt = param['shared']['ob_file_format']
+    in_csv_fname = f"{param['paths']['syn_limit_uas_csv']}/{bufr_t}.{tag}.input.{ob_fmt}"
+    out_csv_fname = f"{param['paths']['syn_limit_uas_csv']}/{bufr_t}.{tag}.output.{ob_fmt}"
+    csv_ref_fname = f"{param['paths'][param['limit_uas']['csv_ref_dir']]}/{bufr_t}.{tag}.fake.prepbufr.{ob_fmt}"
     drop_col = param['limit_uas']['drop_col']
     verbose = param['limit_uas']['verbose']
     limits_param = param['limit_uas']['limits']
-else:
+elif __name__ == '__main__':
     raise NameError('limit_uas_flights.py is NOT configured to run without command line arguments!!')
 
 
@@ -46,81 +146,26 @@ else:
 # Limit UAS Flights
 #---------------------------------------------------------------------------------------------------
 
-if verbose > 1:
-    start = dt.datetime.now()
-    print("start time =", start)
-
-# Read in input prepBUFR file
-bufr_obj = bufr.bufrCSV(in_csv_fname)
-bufr_obj_ref = bufr.bufrCSV(csv_ref_fname)
-
-# Check that bufr_obj and bufr_obj_ref have the same obs
-check_col = ['SID', 'TYP', 'DHR', 'XOB', 'YOB']
-for c in check_col:
-    if ~np.all(bufr_obj.df[c].values == bufr_obj_ref.df[c].values):
-        raise ValueError('bufr_obj and bufr_obj_ref contain different observations')
-
-# Check how many obs we are starting with
-if verbose > 0:
-    all_typ = np.unique(bufr_obj.df['TYP'])
-    nob_before = {}
-    print()
-    print("initial observation counts...")
-    for t in all_typ:
-        nob_before[t] = len(bufr_obj.df.loc[bufr_obj.df['TYP'] == t])
-        print(f"{t} = {nob_before[t]}")
-    print()
-
-# Remove BUFR obs that exceed various limits
-for typ in limits_param.keys():
-    for lim_type in limits_param[typ]:
-
-        if verbose > 0: print(f"Adding {lim_type} limits to {typ}")
-        if verbose > 1: print('  applying limits', dt.datetime.now())
-
-        # Wind speed limit
-        if lim_type == 'wind':
-            bufr_obj_ref = lp.wspd_limit(bufr_obj_ref, wind_type=typ,
-                                         **limits_param[typ][lim_type]['lim_kw'])
-
-        # Icing detection (using RH threshold)
-        if lim_type == 'icing_RH':
-            bufr_obj_ref = lp.detect_icing_RH(bufr_obj_ref, thermo_type=typ,
-                                              **limits_param[typ][lim_type]['lim_kw'])
-
-        # Icing detection (using ql threshold)
-        if lim_type == 'icing_LIQMR':
-            bufr_obj_ref = lp.detect_icing_LIQMR(bufr_obj_ref, thermo_type=typ,
-                                                 **limits_param[typ][lim_type]['lim_kw'])
-
-        # Remove BUFR obs that exceed the limit
-        if verbose > 1: print('  removing obs   ', dt.datetime.now())
-        idx_drop = lp.remove_obs_after_lim(bufr_obj_ref.df, typ, 
-                                           **limits_param[typ][lim_type]['remove_kw'])
-        bufr_obj_ref.df.drop(idx_drop, inplace=True)
-        bufr_obj_ref.df.reset_index(inplace=True, drop=True)
-        bufr_obj.df.drop(idx_drop, inplace=True)
-        bufr_obj.df.reset_index(inplace=True, drop=True)
-
-# Print how many obs were removed
-if verbose > 0: 
-    print()
-    print("final observation counts...")
-    for t in all_typ:
-        nob = len(bufr_obj.df.loc[bufr_obj.df['TYP'] == t])
-        print(f"{t} = {nob} ({100*(nob_before[t] - nob) / nob_before[t]:.3f}% reduction)")
-    print()
-
-# Remove intermediate fields and save results
-if verbose > 1: print('removing intermediate columns', dt.datetime.now())
-bufr_obj.df.drop(drop_col, axis=1, inplace=True)
-bufr.df_to_csv(bufr_obj.df, out_csv_fname)
-
-# Timing
-if verbose > 1:
-    print()
-    print(dt.datetime.now())
-    print(f"Total time for limit_uas_flights.py = {(dt.datetime.now() - start).total_seconds()} s")
+if __name__ == '__main__':
+
+    if verbose > 1:
+        start = dt.datetime.now()
+        print("start time =", start)
+
+    # Read in input prepBUFR file
+    bufr_obj = ob_io.read_ob_file(in_csv_fname)
+    bufr_obj_ref = ob_io.read_ob_file(csv_ref_fname)
+
+    # Remove BUFR obs that exceed various limits and save results
+    out_df = limit_uas_flights(bufr_obj.df, bufr_obj_ref.df, limits_param, drop_col=drop_col, 
+                               verbose=verbose)
+    ob_io.write_ob_file(out_df, out_csv_fname)
+
+    # Timing
+    if verbose > 1:
+        print()
+        print(dt.datetime.now())
+        print(f"Total time for limit_uas_flights.py = {(dt.datetime.now() - start).total_seconds()} s")
 
 
 """
@@ -0,0 +1,270 @@
+"""
+Read and Write Observation Files in Either CSV or Parquet Format
+
+Intermediate observation files (i.e., those passed between the components of the synthetic ob
+creator) can be saved as Parquet files rather than prepBUFR CSV files. Parquet files are binary and
+columnar, so they are smaller and much faster to read and write than CSV files. Column types and
+units are stored in the Parquet file. prepBUFR CSV files are still needed by prepbufr_encode_csv.x,
+so Parquet files are converted back to CSV files prior to creating the final prepBUFR files (see
+convert_ob_file.py).
+
+The file format is determined by the file extension (.csv or .parquet).
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import json
+import os
+import shutil
+
+import pyDA_utils.bufr as bufr
+
+
+#---------------------------------------------------------------------------------------------------
+# Parameters
+#---------------------------------------------------------------------------------------------------
+
+# Supported file formats
+OB_FILE_FORMATS = ['csv', 'parquet']
+
+# Units for prepBUFR CSV columns. Saved as metadata in Parquet files
+OB_UNITS = {'XOB':'deg E', 'YOB':'deg N', 'DHR':'hr', 'HRDR':'hr', 'XDR':'deg E', 'YDR':'deg N',
+            'ELV':'m', 'POB':'mb', 'PRSS':'mb', 'PMO':'mb', 'ZOB':'m', 'TOB':'deg C',
+            'TDO':'deg C', 'QOB':'mg/kg', 'UOB':'m/s', 'VOB':'m/s', 'UFC':'m/s', 'VFC':'m/s',
+            'PWO':'mm', 'ceil':'m', 'liqmix':'kg/kg'}
+
+
+#---------------------------------------------------------------------------------------------------
+# Classes
+#---------------------------------------------------------------------------------------------------
+
+class bufrParquet(bufr.bufrCSV):
+    """
+    prepBUFR observations read from a Parquet file. Has the same methods as bufr.bufrCSV. Only
+    the units are included in the metadata (meta attribute)
+
+    Parameters
+    ----------
+    fname : string
+        Parquet file name
+
+    """
+
+    def __init__(self, fname):
+        self.df = pd.read_parquet(fname)
+        self.meta = {}
+        for c, u in read_units(fname).items():
+            self.meta[c] = {'units':u}
+
+
+class bufrDataFrame(bufr.bufrCSV):
+    """
+    prepBUFR observations held in memory. Has the same methods as bufr.bufrCSV. Used to pass
+    observations between components without writing intermediate files. Only the units are 
+    included in the metadata (meta attribute)
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Observations
+
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.meta = {}
+        for c in df.columns:
+            if c in OB_UNITS:
+                self.meta[c] = {'units':OB_UNITS[c]}
+
+
+class obFileWriter():
+    """
+    Write an observation file one block of rows at a time, so all observations do not need to be 
+    in memory at once. Parquet files are written with one row group per block. For CSV files, the 
+    first block is written using write_ob_file and later blocks are appended (without the header). 
+    close() must be called after the last block
+
+    Parameters
+    ----------
+    fname : string
+        Observation file name. Must end in .csv or .parquet (any suffix after .csv is allowed)
+
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.nblocks = 0
+        self.writer = None
+        self.empty_df = None
+
+    def write(self, df):
+        """
+        Write a block of observations (pd.DataFrame)
+        """
+        if self.fname.endswith('.parquet'):
+            if len(df) == 0:
+                if self.empty_df is None:
+                    self.empty_df = df
+                return
+            table = parquet_table(df)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.fname, table.schema)
+            else:
+                table = table.cast(self.writer.schema)
+            self.writer.write_table(table)
+        elif self.nblocks == 0:
+            write_ob_file(df, self.fname)
+        elif len(df) > 0:
+            tmp_fname = '%s.%d.tmp' % (self.fname, os.getpid())
+            write_ob_file(df, tmp_fname)
+            with open(tmp_fname, 'r') as fin, open(self.fname, 'a') as fout:
+                fin.readline()
+                shutil.copyfileobj(fin, fout)
+            os.remove(tmp_fname)
+        self.nblocks = self.nblocks + 1
+
+    def close(self):
+        """
+        Finish writing the observation file
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        elif self.empty_df is not None:
+            write_ob_file(self.empty_df, self.fname)
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def check_format(fmt):
+    """
+    Check that an observation file format is supported
+
+    Parameters
+    ----------
+    fmt : string
+        Observation file format
+
+    Returns
+    -------
+    None
+
+    """
+
+    if fmt not in OB_FILE_FORMATS:
+        raise ValueError('Unsupported ob_file_format: %s. Options: %s' % (fmt, OB_FILE_FORMATS))
+
+    return None
+
+
+def read_ob_file(fname):
+    """
+    Read an observation file
+
+    Parameters
+    ----------
+    fname : string
+        Observation file name. Must end in .csv or .parquet (any suffix after .csv is allowed)
+
+    Returns
+    -------
+    bufr_obj : bufr.bufrCSV or bufrParquet
+        Observations
+
+    """
+
+    if fname.endswith('.parquet'):
+        bufr_obj = bufrParquet(fname)
+    else:
+        bufr_obj = bufr.bufrCSV(fname)
+
+    return bufr_obj
+
+
+def write_ob_file(df, fname):
+    """
+    Write an observation file
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Observations
+    fname : string
+        Observation file name. Must end in .csv or .parquet (any suffix after .csv is allowed)
+
+    Returns
+    -------
+    None
+
+    """
+
+    if fname.endswith('.parquet'):
+        pq.write_table(parquet_table(df), fname)
+    else:
+        bufr.df_to_csv(df, fname)
+
+    return None
+
+
+def parquet_table(df):
+    """
+    Convert observations to a pa.Table with the units saved as metadata
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Observations
+
+    Returns
+    -------
+    table : pa.Table
+        Observations
+
+    """
+
+    units = {c:OB_UNITS[c] for c in df.columns if c in OB_UNITS}
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    meta = table.schema.metadata
+    meta[b'ob_units'] = json.dumps(units).encode('utf-8')
+
+    return table.replace_schema_metadata(meta)
+
+
+def read_units(fname):
+    """
+    Read the units saved in a Parquet observation file
+
+    Parameters
+    ----------
+    fname : string
+        Parquet file name
+
+    Returns
+    -------
+    units : dictionary
+        Units for each column (only includes columns with known units)
+
+    """
+
+    meta = pq.read_schema(fname).metadata
+    if (meta is not None) and (b'ob_units' in meta):
+        units = json.loads(meta[b'ob_units'].decode('utf-8'))
+    else:
+        units = {}
+
+    return units
+
+
+"""
+End ob_io.py
+"""
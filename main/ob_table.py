@@ -0,0 +1,115 @@
+"""
+Struct-of-Arrays Observation Table for the Synthetic Observation Creator
+
+Reading or writing a single cell of a pd.DataFrame (e.g., df.loc[j, 'TOB']) takes several
+microseconds of pandas overhead, which adds up when done for every observation. obTable objects
+store each column of a prepBUFR DataFrame as a contiguous NumPy array, so the interpolator can work
+with plain NumPy indexing. Columns are converted from the DataFrame the first time they are
+accessed and the table is only converted back to a DataFrame when the output is written.
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+
+#---------------------------------------------------------------------------------------------------
+# Parameters
+#---------------------------------------------------------------------------------------------------
+
+# Columns that are always stored as float64 (some of these can be read as integers from prepBUFR
+# CSV files, but interpolated values are floats)
+FLOAT_COLS = ['XOB', 'YOB', 'DHR', 'POB', 'ZOB', 'TOB', 'QOB', 'UOB', 'VOB', 'ELV', 'PRSS', 'PMO',
+              'PWO', 'XDR', 'YDR', 'HRDR', 'DHR_orig', 'HRDR_orig']
+
+
+#---------------------------------------------------------------------------------------------------
+# Classes
+#---------------------------------------------------------------------------------------------------
+
+class obTable():
+    """
+    Observations stored as one NumPy array per column. Columns are accessed using tbl[col]
+    (similar to a pd.DataFrame), which returns the underlying array (not a copy)
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        prepBUFR observations. Not modified
+    int_cols : list, optional
+        Columns that are stored as int32 (e.g., interpolation indices)
+
+    """
+
+    def __init__(self, df, int_cols=[]):
+        self.df = df
+        self.int_cols = int_cols
+        self.cols = {}
+
+    def __len__(self):
+        return len(self.df)
+
+    def __contains__(self, col):
+        return (col in self.cols) or (col in self.df.columns)
+
+    def __getitem__(self, col):
+        if col not in self.cols:
+            if col in FLOAT_COLS:
+                dtype = np.float64
+            elif col in self.int_cols:
+                dtype = np.int32
+            else:
+                dtype = None
+            self.cols[col] = np.array(self.df[col].values, dtype=dtype)
+        return self.cols[col]
+
+    def __setitem__(self, col, val):
+        if col in FLOAT_COLS:
+            dtype = np.float64
+        elif col in self.int_cols:
+            dtype = np.int32
+        else:
+            dtype = None
+        self.cols[col] = np.array(np.broadcast_to(val, len(self.df)), dtype=dtype)
+
+    def to_dataframe(self, drop=[], rows=None):
+        """
+        Convert to a pd.DataFrame
+
+        Parameters
+        ----------
+        drop : list, optional
+            Columns to not include in the DataFrame
+        rows : array, optional
+            Row indices to include in the DataFrame (set to None to include all rows). The index of
+            the returned DataFrame is reset if rows is not None
+
+        Returns
+        -------
+        df : pd.DataFrame
+            Observations
+
+        """
+
+        if rows is None:
+            df = self.df
+        else:
+            df = self.df.iloc[rows].reset_index(drop=True)
+        df = df.drop(labels=[c for c in drop if c in df.columns], axis=1)
+        for c, val in self.cols.items():
+            if c not in drop:
+                if rows is None:
+                    df[c] = val
+                else:
+                    df[c] = val[rows]
+
+        return df
+
+
+"""
+End ob_table.py
+"""
@@ -0,0 +1,614 @@
+"""
+Vectorized Observation Error Utilities for the Synthetic Observation Creator
+
+These functions are a vectorized alternative to pyDA_utils.bufr.add_obs_err. Rather than looping
+over each station (or profile) in Python, the observations are sorted once by (TYP, SID, partition,
+coordinate), group boundaries are found from the sorted keys, and the autocorrelated errors for all
+groups are generated at once.
+
+Autocorrelated errors follow a lag-1 autoregressive (AR1) process within each group:
+
+    error[n] = N(0, stdev[n]) + a[n] * error[n-1]
+    a[n] = auto_reg_parm * min(1, min_d / d[n])
+
+where d[n] is the distance between observation n and the previous observation in the same group
+(e.g., in DHR or POB units). Observations that are closer together than min_d use the full
+autoregression parameter. The AR1 coefficient is reset to 0 at the start of each group.
+
+Random numbers are drawn from a separate stream for each (cycle, TYP, error pass, SID), so the
+errors are reproducible for a given seed and do not change when ob types are split across processes.
+Ob types listed in more than one autocorrelated pass receive independent errors from each pass.
+
+For errors that are autocorrelated in time, the last error from each station can be saved to a
+Parquet file at the end of a cycle and used to continue the AR1 process in the next cycle.
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import hashlib
+import datetime as dt
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import metpy.calc as mc
+from metpy.units import units
+
+import pyDA_utils.bufr as bufr
+
+
+#---------------------------------------------------------------------------------------------------
+# Parameters
+#---------------------------------------------------------------------------------------------------
+
+# Observed variable and corresponding errtable column
+OB_ERR_NAMES = {'TOB':'Terr', 'RHOB':'RHerr', 'UOB':'UVerr', 'VOB':'UVerr', 'PRSS':'PSerr',
+                'PMO':'PSerr', 'PWO':'PWerr'}
+
+# Columns in the per-station error state file (see write_error_state)
+STATE_COLS = ['TYP', 'SID', 'cycle', 'DHR'] + ['err_%s' % ob for ob in OB_ERR_NAMES.keys()]
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def group_starts(keys):
+    """
+    Sort observations and determine where each group begins
+
+    Parameters
+    ----------
+    keys : list of arrays
+        Integer or float arrays (each with length nobs) used to sort the observations. The last
+        array is the coordinate the errors are correlated along. The remaining arrays identify the
+        group each observation belongs to (e.g., TYP and SID)
+
+    Returns
+    -------
+    order : array
+        Indices that sort the observations
+    start : array
+        Boolean array (in sorted order). True indicates the first observation in a group
+
+    """
+
+    order = np.lexsort(keys[::-1])
+    start = np.zeros(order.size, dtype=bool)
+    if order.size == 0:
+        return order, start
+    start[0] = True
+    for k in keys[:-1]:
+        ks = k[order]
+        start[1:] = start[1:] | (ks[1:] != ks[:-1])
+
+    return order, start
+
+
+def ar1_coef(coord, start, auto_reg_parm, min_d):
+    """
+    Compute the AR1 coefficient for each observation
+
+    Parameters
+    ----------
+    coord : array
+        Coordinate the errors are correlated along (in sorted order)
+    start : array
+        Boolean array. True indicates the first observation in a group
+    auto_reg_parm : float
+        Autoregression parameter
+    min_d : float
+        Observations closer together than min_d use the full autoregression parameter
+
+    Returns
+    -------
+    a : array
+        AR1 coefficient for each observation (0 at the start of each group)
+
+    """
+
+    a = np.zeros(coord.size)
+    if coord.size > 1:
+        d = np.abs(np.diff(coord))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a[1:] = auto_reg_parm * np.minimum(1., min_d / d)
+    a[start] = 0.
+    a[np.isnan(a)] = 0.
+
+    return a
+
+
+def ar1_filter(w, a, start):
+    """
+    Apply the recursion e[n] = w[n] + a[n] * e[n-1] to all groups at once
+
+    Observations are visited by their position within each group, so the number of Python loop
+    iterations is the length of the longest group rather than the number of observations (or
+    groups). When a is the same for every observation, scipy.signal.lfilter would be an option, but
+    here a depends on the distance between observations.
+
+    Parameters
+    ----------
+    w : array
+        Uncorrelated random errors (in sorted order)
+    a : array
+        AR1 coefficient for each observation (see ar1_coef)
+    start : array
+        Boolean array. True indicates the first observation in a group
+
+    Returns
+    -------
+    e : array
+        Autocorrelated errors
+
+    """
+
+    e = np.array(w, dtype=float)
+    n = e.size
+    if n == 0:
+        return e
+
+    # Position of each observation within its group
+    sidx = np.where(start)[0]
+    gid = np.cumsum(start) - 1
+    pos = np.arange(n) - sidx[gid]
+
+    # Observations at position k depend on observations at position k-1, which are always
+    # immediately before them in sorted order
+    by_pos = np.argsort(pos, kind='stable')
+    bounds = np.append(0, np.cumsum(np.bincount(pos)))
+    for k in range(1, bounds.size - 1):
+        i = by_pos[bounds[k]:bounds[k+1]]
+        e[i] = e[i] + a[i] * e[i-1]
+
+    return e
+
+
+def ob_stdev(etable, typ, err, pob):
+    """
+    Error standard deviations for an observed variable (errtable RHerr is converted to percent)
+    """
+    stdev = etable.stdev(typ, err, pob)
+    if err == 'RHerr':
+        stdev = stdev * 10
+    return stdev
+
+
+def sid_key(sid):
+    """
+    Convert a station ID to a non-negative integer that is the same in every Python process
+    """
+    return int.from_bytes(hashlib.sha256(str(sid).encode()).digest()[:8], 'little')
+
+
+def station_normals(station, sids, nvar, seed, cycle, typ, stream=0):
+    """
+    Draw standard normal random numbers using a separate random stream for each station
+
+    Each stream is a numpy Generator seeded with a SeedSequence keyed by (cycle, TYP, stream, SID),
+    so the random numbers for a station do not depend on any other station, ob type, error pass, or
+    process
+
+    Parameters
+    ----------
+    station : array
+        Boolean array. True indicates the first observation from a station. Observations from the
+        same station must be consecutive
+    sids : array
+        Station ID for each observation
+    nvar : integer
+        Number of random numbers drawn for each observation
+    seed : integer
+        Base seed (entropy) shared by all streams
+    cycle : integer
+        Cycle time (e.g., YYYYMMDDHHMM)
+    typ : integer
+        Observation type
+    stream : integer, optional
+        Error pass (e.g., the index of the autocorrelation option). Ob types that receive errors in
+        several passes use a different stream for each pass
+
+    Returns
+    -------
+    z : array
+        Standard normal random numbers with shape (nvar, nobs)
+
+    """
+
+    n = station.size
+    z = np.empty([nvar, n])
+    bounds = np.append(np.where(station)[0], n)
+    for b0, b1 in zip(bounds[:-1], bounds[1:]):
+        ss = np.random.SeedSequence(seed, spawn_key=(cycle, typ, stream, sid_key(sids[b0])))
+        z[:, b0:b1] = np.random.default_rng(ss).standard_normal([nvar, b1 - b0])
+
+    return z
+
+
+def typ_errors(etable, typ, sid, pob, coord=None, part=None, auto_reg_parm=0.5, min_d=1., seed=0,
+               cycle=0, stream=0, prev_sid=None, prev_coord=None, prev_err=None):
+    """
+    Compute random errors for a single observation type, optionally autocorrelated along a
+    coordinate
+
+    Parameters
+    ----------
+    etable : errtable_index.errtableIndex
+        Errtable index (RHerr is in percent / 10)
+    typ : integer
+        Observation type
+    sid : array
+        Station IDs
+    pob : array
+        Observation pressures (mb)
+    coord : array, optional
+        Coordinate the errors are correlated along (e.g., POB or DHR). Set to None for
+        uncorrelated errors
+    part : array, optional
+        Values used to split each station into separate groups (e.g., DHR to treat each time as
+        a separate profile)
+    auto_reg_parm : float, optional
+        Autoregression parameter
+    min_d : float, optional
+        Observations closer together than min_d use the full autoregression parameter (units of
+        coord)
+    seed : integer, optional
+        Base seed for the random streams (see station_normals)
+    cycle : integer, optional
+        Cycle time (e.g., YYYYMMDDHHMM)
+    stream : integer, optional
+        Error pass used to select the random streams (see station_normals)
+    prev_sid : array, optional
+        Station IDs with a previous error (e.g., from the previous cycle). The first error in each
+        group from these stations continues the AR1 process from the previous error
+    prev_coord : array, optional
+        Coordinate of each previous error (same units and reference as coord)
+    prev_err : dictionary, optional
+        Previous errors for each observed variable
+
+    Returns
+    -------
+    order : array
+        Indices that sort the observations by station, partition, and coordinate
+    errs : dictionary
+        Errors for each observed variable (in sorted order)
+
+    """
+
+    # Sort once by station, partition, and coordinate. Uncorrelated obs keep their original order
+    # within each station
+    sid_code = pd.factorize(sid)[0]
+    keys = [sid_code]
+    if part is not None:
+        keys.append(part)
+    keys.append(coord if coord is not None else np.arange(sid.size))
+    order, start = group_starts(keys)
+    station = np.ones(order.size, dtype=bool)
+    station[1:] = sid_code[order][1:] != sid_code[order][:-1]
+    if coord is None:
+        a = np.zeros(order.size)
+        start = np.ones(order.size, dtype=bool)
+    else:
+        a = ar1_coef(coord[order], start, auto_reg_parm, min_d)
+
+    # AR1 coefficient for the previous error of each group. Previous errors at or after the first
+    # ob in a group are not used
+    gidx = np.where(start)[0]
+    if (prev_sid is not None) and (coord is not None) and (len(prev_sid) > 0):
+        match = pd.Index(prev_sid).get_indexer(sid[order][gidx])
+        use = match >= 0
+        d = coord[order][gidx[use]] - prev_coord[match[use]]
+        a0 = np.zeros(d.size)
+        a0[d > 0] = auto_reg_parm * np.minimum(1., min_d / d[d > 0])
+        gidx = gidx[use]
+        match = match[use]
+    else:
+        gidx = gidx[:0]
+
+    z = station_normals(station, sid[order], len(OB_ERR_NAMES), seed, cycle, typ, stream=stream)
+    errs = {}
+    for n, (ob, err) in enumerate(OB_ERR_NAMES.items()):
+        w = z[n] * ob_stdev(etable, typ, err, pob[order])
+        if gidx.size > 0:
+            e0 = np.nan_to_num(prev_err[ob][match])
+            w[gidx] = w[gidx] + a0 * e0
+        errs[ob] = ar1_filter(w, a, start)
+
+    return order, errs
+
+
+def cycle_time(cycle):
+    """
+    Convert a cycle time (integer or string in YYYYMMDDHHMM format) to a datetime
+    """
+    return dt.datetime.strptime(str(cycle), '%Y%m%d%H%M')
+
+
+def read_error_state(fname, cycle):
+    """
+    Read the last error from each station saved by a previous cycle
+
+    Parameters
+    ----------
+    fname : string
+        Parquet file with the error state (see write_error_state)
+    cycle : integer or string
+        Current cycle time (YYYYMMDDHHMM)
+
+    Returns
+    -------
+    state : pd.DataFrame
+        Error state, with the time of each previous error relative to the current cycle (hr) in
+        the DHR_cycle column. Empty if fname does not exist
+
+    """
+
+    if not os.path.isfile(fname):
+        return pd.DataFrame(columns=STATE_COLS + ['DHR_cycle'])
+    state = pd.read_parquet(fname)
+    offset = [(cycle_time(c) - cycle_time(cycle)).total_seconds() / 3600.
+              for c in state['cycle'].values]
+    state['DHR_cycle'] = state['DHR'].values + np.array(offset, dtype=float)
+
+    return state
+
+
+def write_error_state(fname, state, new_state):
+    """
+    Replace the error state for the stations in new_state and write to a Parquet file
+
+    The file is written to a temporary file first so a failed job never leaves a partially
+    written state file
+
+    Parameters
+    ----------
+    fname : string
+        Output Parquet file
+    state : pd.DataFrame
+        Previous error state (from read_error_state)
+    new_state : pd.DataFrame
+        Error state from the current cycle
+
+    Returns
+    -------
+    None
+
+    """
+
+    old = state[STATE_COLS].set_index(['TYP', 'SID'])
+    new = new_state[STATE_COLS].set_index(['TYP', 'SID'])
+    old = old.loc[~old.index.isin(new.index)]
+    if len(old) > 0:
+        new = pd.concat([old, new])
+    out = new.reset_index()
+    out = out.sort_values(['TYP', 'SID'], ignore_index=True)
+    tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+    out.to_parquet(tmp_fname, index=False)
+    os.replace(tmp_fname, fname)
+
+    return None
+
+
+def update_stats_from_diff(stats, etable, in_df, out_df):
+    """
+    Accumulate statistics of the differences between observations with and without errors
+
+    Used when the errors are not added by add_obs_errors_vectorized (e.g., when using
+    pyDA_utils.bufr.add_obs_err)
+
+    Parameters
+    ----------
+    stats : err_stats.errStats
+        Error statistics
+    etable : errtable_index.errtableIndex
+        Errtable index
+    in_df : pd.DataFrame
+        Observations without errors
+    out_df : pd.DataFrame
+        Observations with errors (same rows as in_df)
+
+    Returns
+    -------
+    None
+
+    """
+
+    in_df = bufr.compute_RH(in_df.copy())
+    out_df = bufr.compute_RH(out_df.copy())
+    typ_all = out_df['TYP'].values
+    for t in np.unique(typ_all):
+        if t not in etable:
+            continue
+        idx = np.where(typ_all == t)[0]
+        pob = in_df['POB'].values[idx]
+        pbin = etable.prs_bin(pob, typ=t)
+        for ob, err in OB_ERR_NAMES.items():
+            diff = out_df[ob].values[idx] - in_df[ob].values[idx]
+            stats.update(int(t), ob, pbin, diff, ob_stdev(etable, t, err, pob))
+
+    return None
+
+
+def add_obs_errors_vectorized(df, errtable, autocor_POB_obs=[], autocor_DHR_obs=[],
+                              autocor_ZOB_partition_DHR_obs=[], auto_reg_parm=0.5, verbose=False,
+                              seed=None, cycle=0, workers=1, state_file=None, stats=None):
+    """
+    Add random observation errors to perfect synthetic observations using the vectorized engine
+
+    Humidity errors are added to RH, then converted back to QOB using the perturbed sensible
+    temperature. TDO is recomputed from the perturbed TOB and QOB.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Perfect synthetic observations
+    errtable : errtable_index.errtableIndex
+        Errtable index containing the observation error standard deviations
+    autocor_POB_obs : list of integers, optional
+        Observation types with errors that are autocorrelated in the vertical (using POB)
+    autocor_DHR_obs : list of integers, optional
+        Observation types with errors that are autocorrelated in time (using DHR)
+    autocor_ZOB_partition_DHR_obs : list of integers, optional
+        Observation types with errors that are autocorrelated in the vertical (using ZOB), with
+        separate profiles identified using DHR
+    auto_reg_parm : float, optional
+        Autoregression parameter for autocorrelated errors
+    verbose : boolean, optional
+        Option for verbose output
+    seed : integer, optional
+        Base seed for the random streams. A random seed is used if None
+    cycle : integer or string, optional
+        Cycle time (e.g., YYYYMMDDHHMM). Used with seed to create the random streams
+    workers : integer, optional
+        Number of processes. Each ob type is handled by a separate task. The output does not
+        depend on the number of processes
+    state_file : string, optional
+        Parquet file with the last error from each station in autocor_DHR_obs. If provided, the
+        AR1 process for these stations continues from the previous cycle, and the file is updated
+        with the last error from this cycle. Cycles must be run in chronological order
+    stats : err_stats.errStats, optional
+        Statistics of the errors added to each observed variable are accumulated in stats
+
+    Returns
+    -------
+    out_df : pd.DataFrame
+        Observations with random errors added
+
+    """
+
+    etable = errtable
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    print('obs error seed = %d' % seed)
+    cycle = int(cycle)
+    if state_file is not None:
+        state = read_error_state(state_file, cycle)
+        print('read error state for %d stations from %s' % (len(state), state_file))
+
+    out_df = df.copy()
+    out_df = bufr.compute_RH(out_df)
+    out_df = bufr.compute_Tsens(out_df)
+
+    remaining_obs = []
+    for o in np.int32(out_df['TYP'].unique()):
+        if ((o not in autocor_POB_obs) and (o not in autocor_DHR_obs) and
+            (o not in autocor_ZOB_partition_DHR_obs)):
+            remaining_obs.append(o)
+
+    # Create one task per ob type in each pass: (ob types, correlated column, partition column,
+    # min_d). The pass index selects the random streams (see station_normals)
+    passes = [(autocor_POB_obs, 'POB', None, 10.),
+              (autocor_DHR_obs, 'DHR', None, 1./60.),
+              (autocor_ZOB_partition_DHR_obs, 'ZOB', 'DHR', 50.),
+              (remaining_obs, None, None, 1.)]
+    typ_all = out_df['TYP'].values
+    tasks = []
+    for stream, (ob_typ, correlated, partition, min_d) in enumerate(passes):
+        for t in ob_typ:
+            if t not in etable:
+                if verbose:
+                    print('TYP = %d not in errtable, skipping' % t)
+                continue
+            idx = np.where(typ_all == t)[0]
+            if idx.size == 0:
+                continue
+            if verbose:
+                print('adding errors to TYP = %d (%d obs)' % (t, idx.size))
+            kw = {'typ':int(t), 'sid':out_df['SID'].values[idx], 'pob':out_df['POB'].values[idx],
+                  'auto_reg_parm':auto_reg_parm, 'min_d':min_d, 'seed':seed, 'cycle':cycle,
+                  'stream':stream}
+            if correlated is not None:
+                kw['coord'] = out_df[correlated].values[idx]
+            if partition is not None:
+                kw['part'] = out_df[partition].values[idx]
+
+            # Continue the AR1 process from the previous cycle for time-correlated obs
+            keep_state = (state_file is not None) and (correlated == 'DHR') and (partition is None)
+            if keep_state:
+                typ_state = state.loc[state['TYP'] == t]
+                kw['prev_sid'] = typ_state['SID'].values
+                kw['prev_coord'] = typ_state['DHR_cycle'].values
+                kw['prev_err'] = {ob:typ_state['err_%s' % ob].values for ob in OB_ERR_NAMES.keys()}
+            tasks.append((idx, kw, keep_state))
+
+    # Compute errors. The 'fork' context is used so that worker processes do not rerun the calling
+    # script
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = [pool.submit(typ_errors, etable, **kw) for _, kw, _ in tasks]
+            results = [fut.result() for fut in futures]
+    else:
+        results = [typ_errors(etable, **kw) for _, kw, _ in tasks]
+
+    # Add errors. The same TOB error is also added to the sensible temperature
+    vals = {c:out_df[c].values.copy() for c in list(OB_ERR_NAMES.keys()) + ['Tsens']}
+    if stats is not None:
+        tot_err = {ob:np.zeros(len(out_df)) for ob in OB_ERR_NAMES.keys()}
+    new_state = []
+    for (idx, kw, keep_state), (order, errs) in zip(tasks, results):
+        sidx = idx[order]
+        for ob in OB_ERR_NAMES.keys():
+            vals[ob][sidx] = vals[ob][sidx] + errs[ob]
+        vals['Tsens'][sidx] = vals['Tsens'][sidx] + errs['TOB']
+        if stats is not None:
+            for ob in OB_ERR_NAMES.keys():
+                tot_err[ob][sidx] = tot_err[ob][sidx] + errs[ob]
+
+        # Save the last error from each station (obs are sorted by SID, then DHR)
+        if keep_state:
+            sid = kw['sid'][order]
+            last = np.ones(sid.size, dtype=bool)
+            last[:-1] = sid[1:] != sid[:-1]
+            typ_state = pd.DataFrame({'TYP':kw['typ'], 'SID':sid[last], 'cycle':cycle,
+                                      'DHR':kw['coord'][order][last]})
+            for ob in OB_ERR_NAMES.keys():
+                typ_state['err_%s' % ob] = errs[ob][last]
+            new_state.append(typ_state)
+
+    # Update error statistics once per ob using the total error from all passes (only for obs that
+    # are not missing)
+    if stats is not None:
+        for t in np.unique([kw['typ'] for _, kw, _ in tasks]):
+            idx = np.where(typ_all == t)[0]
+            pob = out_df['POB'].values[idx]
+            pbin = etable.prs_bin(pob, typ=t)
+            for ob, err in OB_ERR_NAMES.items():
+                valid = np.logical_not(np.isnan(out_df[ob].values[idx]))
+                stats.update(int(t), ob, pbin[valid], tot_err[ob][idx][valid],
+                             ob_stdev(etable, t, err, pob[valid]))
+
+    for c in vals.keys():
+        out_df[c] = vals[c]
+
+    if state_file is not None:
+        if len(new_state) > 0:
+            new_state = pd.concat(new_state, ignore_index=True)
+        else:
+            new_state = pd.DataFrame(columns=STATE_COLS)
+        write_error_state(state_file, state, new_state)
+        print('saved error state for %d stations to %s' % (len(new_state), state_file))
+
+    # Convert RH back to specific humidity (mg/kg) and recompute dewpoint
+    rh = np.clip(out_df['RHOB'].values, 0, 100)
+    q = mc.specific_humidity_from_mixing_ratio(
+            mc.mixing_ratio_from_relative_humidity(out_df['POB'].values * units.hPa,
+                                                   out_df['Tsens'].values * units.degC,
+                                                   rh * units.percent))
+    q = q.to('mg/kg').magnitude
+    out_df['QOB'] = np.where(np.isnan(q), out_df['QOB'].values, q)
+    out_df.drop(labels=['RHOB', 'Tsens'], axis=1, inplace=True)
+    out_df = bufr.compute_dewpt(out_df)
+
+    return out_df
+
+
+"""
+End obs_err_utils.py
+"""
@@ -0,0 +1,140 @@
+"""
+Timing and Memory Instrumentation for the Synthetic Observation Creator
+
+perfLog objects keep named timers (total wall-clock time and number of calls) and counters for each
+stage of a program, along with the peak resident set size (RSS) of the process. The results can be
+saved to a JSON file, so the performance of each cycle can be tracked without parsing log files.
+
+Peak RSS is determined using the resource module. If the resource module is not available (e.g., on
+Windows), the peak memory allocated by Python (from tracemalloc) is used instead.
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import time
+import json
+import sys
+import datetime as dt
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    resource = None
+    import tracemalloc
+
+
+#---------------------------------------------------------------------------------------------------
+# Classes
+#---------------------------------------------------------------------------------------------------
+
+class perfLog():
+    """
+    Named timers and counters for a single program run
+
+    Parameters
+    ----------
+    name : string
+        Program name (saved in the JSON report)
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.start_date = dt.datetime.now()
+        self.timers = {}
+        self.calls = {}
+        self.counters = {}
+        self.meta = {}
+        self.running = {}
+        if (resource is None) and (not tracemalloc.is_tracing()):
+            tracemalloc.start()
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Context manager that adds the time spent in a with block to timer name
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - t0)
+
+    def start_timer(self, name):
+        """
+        Start timer name (use stop_timer to add the elapsed time to the timer)
+        """
+        self.running[name] = time.perf_counter()
+
+    def stop_timer(self, name):
+        """
+        Stop timer name and add the time since start_timer was called
+        """
+        self.add_time(name, time.perf_counter() - self.running.pop(name))
+
+    def add_time(self, name, seconds):
+        """
+        Add time (s) to timer name
+        """
+        self.timers[name] = self.timers.get(name, 0.) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, n=1):
+        """
+        Increment counter name by n
+        """
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def elapsed(self):
+        """
+        Time since this perfLog was created (s)
+        """
+        return time.perf_counter() - self.start
+
+    def peak_rss_mb(self):
+        """
+        Peak resident set size of this process and any child processes that have finished (MB)
+        """
+        if resource is None:
+            return tracemalloc.get_traced_memory()[1] / 1024.**2
+        rss = [resource.getrusage(who).ru_maxrss for who in [resource.RUSAGE_SELF,
+                                                             resource.RUSAGE_CHILDREN]]
+
+        # ru_maxrss is in bytes on macOS and kB elsewhere
+        if sys.platform == 'darwin':
+            return max(rss) / 1024.**2
+        else:
+            return max(rss) / 1024.
+
+    def report(self):
+        """
+        Create a dictionary with all timers, counters, and the peak RSS
+        """
+        timers = {}
+        for name, t in self.timers.items():
+            timers[name] = {'seconds':round(t, 6), 'calls':self.calls[name]}
+        return {'program':self.name,
+                'start':self.start_date.strftime('%Y-%m-%d %H:%M:%S'),
+                'total_seconds':round(self.elapsed(), 6),
+                'peak_rss_mb':round(self.peak_rss_mb(), 3),
+                'peak_rss_source':'resource' if resource is not None else 'tracemalloc',
+                'timers':timers,
+                'counters':self.counters,
+                'meta':self.meta}
+
+    def write_json(self, fname):
+        """
+        Write the report (see report()) to a JSON file
+        """
+        with open(fname, 'w') as fptr:
+            json.dump(self.report(), fptr, indent=2)
+
+
+"""
+End perf_log.py
+"""
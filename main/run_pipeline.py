@@ -0,0 +1,335 @@
+"""
+Run the Synthetic Ob Creator Components for a Single prepBUFR Time in One Process
+
+The interpolator and the components that follow it (obs_errors, limit_uas, combine_csv, select_obs,
+and superobs) are run in the same order as in the batch scripts created by create_syn_ob_jobs.py,
+but observations are passed between components as DataFrames rather than through intermediate
+files. This avoids the cost of starting a new Python interpreter, importing modules, and parsing the
+observation file for each component.
+
+Output from each component is saved to the same file name used by the batch scripts, but only if
+the component is listed in checkpoints in the jobs section of the YAML file. Output from the
+following components is always saved:
+    1. The interpolator (the real_red files are needed to create real_red prepBUFR files)
+    2. The last component (needed to create the synthetic ob prepBUFR file)
+    3. Any component whose output is needed by the plotting scripts
+
+Command-line arguments:
+    argv[1] = Time of prepbufr file (YYYYMMDDHHMM)
+    argv[2] = Prepbufr file tag
+    argv[3] = YAML file with program parameters
+    argv[4] = Time for first UPP file (YYYYMMDDHHMM). Optional, the interpolator is only run if
+              argv[4] and argv[5] are provided. If not provided, the interpolator output is read
+              from syn_perf_csv (e.g., if the interpolator was run for multiple prepBUFR times)
+    argv[5] = Time for last UPP file (YYYYMMDDHHMM). Optional
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import os
+import sys
+import runpy
+import datetime as dt
+import yaml
+
+import pyDA_utils.map_proj as mp
+
+import ob_io
+import add_obs_errors as aoe
+import errtable_index as eti
+import err_stats as es
+import obs_err_utils as oeu
+import limit_uas_flights as luf
+import combine_bufr_csv as cbc
+import select_obtypes as so
+import create_superobs as cs
+
+
+#---------------------------------------------------------------------------------------------------
+# Parameters
+#---------------------------------------------------------------------------------------------------
+
+# Components run by this script (in order)
+PIPELINE_COMP = ['obs_errors', 'limit_uas', 'combine_csv', 'select_obs', 'superobs']
+
+# Output directory for each component
+PIPELINE_DIR = {'obs_errors':'syn_err_csv',
+                'limit_uas':'syn_limit_uas_csv',
+                'combine_csv':'syn_combine_csv',
+                'select_obs':'syn_select_csv',
+                'superobs':'syn_superob_csv'}
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def ob_fname(d, t_str, tag, ob_fmt, kind='fake'):
+    """
+    Create the name of an observation file passed between components
+
+    Parameters
+    ----------
+    d : string
+        Directory
+    t_str : string
+        prepBUFR time (YYYYMMDDHHMM)
+    tag : string
+        prepBUFR tag
+    ob_fmt : string
+        Observation file format ('csv' or 'parquet')
+    kind : string, optional
+        'fake' or 'real_red'
+
+    Returns
+    -------
+    fname : string
+        Observation file name
+
+    """
+
+    return os.path.normpath('%s/%s.%s.%s.prepbufr.%s' % (d, t_str, tag, kind, ob_fmt))
+
+
+class obStore():
+    """
+    Observations passed between components. DataFrames are kept in memory and are only written to
+    a file if requested. Observations not in memory are read from a file
+
+    """
+
+    def __init__(self):
+        self.dfs = {}
+        self.written = set()
+
+    def get(self, fname):
+        """
+        Retrieve observations. Returns a pd.DataFrame
+        """
+        fname = os.path.normpath(fname)
+        if fname not in self.dfs:
+            print('Reading %s' % fname)
+            self.dfs[fname] = ob_io.read_ob_file(fname).df
+            self.written.add(fname)
+        return self.dfs[fname]
+
+    def put(self, df, fname, write=False):
+        """
+        Save observations in memory, and optionally write them to a file
+        """
+        fname = os.path.normpath(fname)
+        self.dfs[fname] = df
+        self.written.discard(fname)
+        if write:
+            self.write(fname)
+
+    def write(self, fname, out_fname=None):
+        """
+        Write observations to a file (if they have not been written already). out_fname can be
+        used to write the observations to a different file name
+        """
+        fname = os.path.normpath(fname)
+        if out_fname is None:
+            out_fname = fname
+        if (out_fname != fname) or (fname not in self.written):
+            print('Writing %s' % out_fname)
+            ob_io.write_ob_file(self.dfs[fname], out_fname)
+            if out_fname == fname:
+                self.written.add(fname)
+
+
+#---------------------------------------------------------------------------------------------------
+# Input Parameters
+#---------------------------------------------------------------------------------------------------
+
+t_str = sys.argv[1]
+tag = sys.argv[2]
+in_yaml = sys.argv[3]
+with open(in_yaml, 'r') as fptr:
+    param = yaml.safe_load(fptr)
+run_interp = param['interpolator']['use'] and (len(sys.argv) > 5)
+if run_interp:
+    wrf_start = sys.argv[4]
+    wrf_end = sys.argv[5]
+
+ob_fmt = param['shared']['ob_file_format']
+paths = param['paths']
+checkpoints = param['jobs']['checkpoints']
+used_comp = [c for c in PIPELINE_COMP if param[c]['use']]
+
+
+#---------------------------------------------------------------------------------------------------
+# Run Components
+#---------------------------------------------------------------------------------------------------
+
+begin = dt.datetime.now()
+print('start time = %s' % begin.strftime('%Y-%m-%d %H:%M:%S'))
+print('components = %s' % used_comp)
+print('checkpoints = %s' % checkpoints)
+
+obs = obStore()
+out_fname = {}
+write_out = {}
+for c in used_comp:
+    out_fname[c] = ob_fname(paths[PIPELINE_DIR[c]], t_str, tag, ob_fmt)
+    write_out[c] = (c in checkpoints) or (c == used_comp[-1])
+
+# Interpolator. Run using runpy so that create_synthetic_obs.py can still be run as a standalone 
+# script. The interpolator always writes its output
+if run_interp:
+    start = dt.datetime.now()
+    print()
+    print('Running interpolator...')
+    if param['create_csv']['use']:
+        bufr_dir = paths['syn_bogus_csv']
+    else:
+        bufr_dir = paths['real_csv']
+    interp_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                                 'create_synthetic_obs.py')
+    argv_save = sys.argv
+    sys.argv = ['create_synthetic_obs.py', paths['model'], bufr_dir, paths['syn_perf_csv'],
+                t_str[:10], wrf_start, wrf_end, tag, in_yaml]
+    try:
+        interp_out = runpy.run_path(interp_script, run_name='__main__')['cycle_out']
+    finally:
+        sys.argv = argv_save
+    # interp_out is empty if the interpolator output was written in blocks (see chunk_size), in
+    # which case the output is read from syn_perf_csv
+    for kind in ['fake', 'real_red']:
+        fname = ob_fname(paths['syn_perf_csv'], t_str, tag, ob_fmt, kind=kind)
+        if t_str in interp_out:
+            obs.put(interp_out[t_str][kind], fname)
+            obs.written.add(fname)
+    interp_out = None
+    print('interpolator time = %.2f s' % (dt.datetime.now() - start).total_seconds())
+
+# Add observation errors
+if param['obs_errors']['use']:
+    start = dt.datetime.now()
+    print()
+    print('Adding observation errors...')
+    in_df = obs.get(ob_fname(paths['syn_perf_csv'], t_str, tag, ob_fmt))
+    etable = eti.read_errtable(param['obs_errors']['errtable'])
+    stats_dir = param['obs_errors']['stats_dir']
+    if stats_dir is not None:
+        stats = es.errStats(etable.prs(), oeu.OB_ERR_NAMES.keys())
+    else:
+        stats = None
+    out_df = aoe.add_obs_errors(in_df, etable,
+                                autocor_POB_obs=param['obs_errors']['autocor_POB_obs'],
+                                autocor_DHR_obs=param['obs_errors']['autocor_DHR_obs'],
+                                autocor_ZOB_partition_DHR_obs=param['obs_errors']['autocor_ZOB_partition_DHR_obs'],
+                                auto_reg_parm=param['obs_errors']['auto_reg_parm'],
+                                verbose=param['obs_errors']['verbose'],
+                                engine=param['obs_errors']['engine'],
+                                seed=param['obs_errors']['seed'], cycle=t_str,
+                                workers=param['obs_errors']['workers'],
+                                state_file=param['obs_errors']['error_state'], stats=stats)
+    obs.put(out_df, out_fname['obs_errors'], write=write_out['obs_errors'])
+    if stats_dir is not None:
+        os.makedirs(stats_dir, exist_ok=True)
+        stats.save(es.stats_fname(stats_dir, out_fname['obs_errors']))
+    print()
+    print('Td RMSE (TDO vs. Td computed w/ RH) = %.3e degC' % aoe.dewpt_check_rmse(out_df))
+    print()
+    if param['obs_errors']['plot_diff_hist']:
+        plot_dir = '%s/err_diff_plots' % paths['plots']
+        os.makedirs(plot_dir, exist_ok=True)
+        aoe.plot_err_diff_hist(ob_io.bufrDataFrame(in_df.copy()), out_df,
+                               etable, plot_dir)
+    print('obs_errors time = %.2f s' % (dt.datetime.now() - start).total_seconds())
+
+# Limit UAS flights
+if param['limit_uas']['use']:
+    start = dt.datetime.now()
+    print()
+    print('Limiting UAS flights...')
+    ref_fname = ob_fname(paths[param['limit_uas']['csv_ref_dir']], t_str, tag, ob_fmt)
+    out_df = luf.limit_uas_flights(obs.get(ob_fname(paths[param['limit_uas']['in_csv_dir']],
+                                                    t_str, tag, ob_fmt)),
+                                   obs.get(ref_fname),
+                                   param['limit_uas']['limits'],
+                                   drop_col=param['limit_uas']['drop_col'],
+                                   verbose=param['limit_uas']['verbose'])
+    obs.put(out_df, out_fname['limit_uas'], write=write_out['limit_uas'])
+    if param['limit_uas']['plot_timeseries']['use']:
+        obs.write(out_fname['limit_uas'])
+        obs.write(ref_fname)
+    print('limit_uas time = %.2f s' % (dt.datetime.now() - start).total_seconds())
+
+# Combine observations
+if param['combine_csv']['use']:
+    start = dt.datetime.now()
+    print()
+    print('Combining observations...')
+    out_df = cbc.combine_obs([obs.get(ob_fname(d, t_str, tag, ob_fmt))
+                              for d in param['combine_csv']['csv_dirs']])
+    obs.put(out_df, out_fname['combine_csv'], write=write_out['combine_csv'])
+    print('combine_csv time = %.2f s' % (dt.datetime.now() - start).total_seconds())
+
+# Only select certain observation types
+if param['select_obs']['use']:
+    start = dt.datetime.now()
+    print()
+    print('Selecting certain observation types...')
+    kinds = ['fake']
+    if param['select_obs']['include_real_red']:
+        kinds.append('real_red')
+    for kind in kinds:
+        out_df = so.select_obtypes(obs.get(ob_fname(paths[param['select_obs']['in_csv_dir']],
+                                                    t_str, tag, ob_fmt, kind=kind)),
+                                   param['select_obs']['obtypes'],
+                                   missing_var=param['select_obs']['missing_var'],
+                                   qm_to_5=param['select_obs']['qm_to_5'])
+        if kind == 'fake':
+            obs.put(out_df, out_fname['select_obs'], write=write_out['select_obs'])
+        else:
+            # Needed to create real_red prepBUFR files
+            obs.put(out_df, ob_fname(paths['syn_select_csv'], t_str, tag, ob_fmt, kind=kind),
+                    write=True)
+    print('select_obs time = %.2f s' % (dt.datetime.now() - start).total_seconds())
+
+# Create superobs
+if param['superobs']['use']:
+    start = dt.datetime.now()
+    print()
+    print('Creating superobs...')
+    if param['superobs']['map_proj'] == 'll_to_xy_lc':
+        map_proj = mp.ll_to_xy_lc
+    in_fname = ob_fname(paths[param['superobs']['in_csv_dir']], t_str, tag, ob_fmt)
+    out_df = cs.create_superobs(obs.get(in_fname),
+                                '%s/%s.%s.tmp.csv' % (paths['syn_superob_csv'], t_str, tag),
+                                map_proj,
+                                param['superobs']['map_proj_kw'],
+                                param['superobs']['grouping'],
+                                param['superobs']['grouping_kw'],
+                                param['superobs']['reduction_kw'])
+    obs.put(out_df, out_fname['superobs'], write=write_out['superobs'])
+    if param['superobs']['plot_vprof']['use']:
+        # plot_raw_superob_uas_vprofs.py reads the superob input from syn_superob_csv
+        obs.write(in_fname, out_fname='%s/%s.%s.input.%s' % (paths['syn_superob_csv'], t_str, tag,
+                                                             ob_fmt))
+    print('superobs time = %.2f s' % (dt.datetime.now() - start).total_seconds())
+
+# Write output needed for plotting
+if param['plots']['use']:
+    for p in ['diff_2d', 'diff_3d', 'diff_uas']:
+        if param['plots'][p]['use']:
+            fname = ob_fname(paths[param['plots'][p]['bufr_dir']], t_str, tag, ob_fmt)
+            if fname in obs.dfs:
+                obs.write(fname)
+            fname = fname.replace('fake', 'real_red')
+            if fname in obs.dfs:
+                obs.write(fname)
+
+print()
+print('total time = %.2f s' % (dt.datetime.now() - begin).total_seconds())
+
+
+"""
+End run_pipeline.py
+"""
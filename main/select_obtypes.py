@@ -2,8 +2,8 @@
 Restrict BUFR CSV Files to Only Contain Certain Observation Types
 
 Optional command-line arguments:
-    argv[1] = Input bufr CSV file
-    argv[2] = Output bufr CSV file
+    argv[1] = Input bufr CSV (or Parquet) file
+    argv[2] = Output bufr CSV (or Parquet) file
     argv[3] = YAML file with program parameters
 
 shawn.s.murdzek@noaa.gov
@@ -20,6 +20,53 @@ import numpy as np
 
 import pyDA_utils.bufr as bufr
 
+import ob_io
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def select_obtypes(df, obtypes, missing_var={}, qm_to_5={}):
+    """
+    Only keep certain observation types, then set certain variables to missing and certain quality
+    marker flags to 5
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Observations
+    obtypes : list of integers
+        Observation types to keep
+    missing_var : dictionary, optional
+        Variables (keys) to set to missing for a list of observation types (values)
+    qm_to_5 : dictionary, optional
+        Quality marker flags (keys) to set to 5 for a list of observation types (values)
+
+    Returns
+    -------
+    out_df : pd.DataFrame
+        Selected observations
+
+    """
+
+    bufr_csv = ob_io.bufrDataFrame(df.copy())
+
+    # Only select certain observation types
+    bufr_csv.select_obtypes(obtypes)
+
+    # Set certain variables to missing
+    for v in missing_var:
+        for typ in missing_var[v]:
+            bufr_csv.df.loc[bufr_csv.df['TYP'] == typ, v] = np.nan
+
+    # Set certain QM flags to 5
+    for v in qm_to_5:
+        for typ in qm_to_5[v]:
+            bufr_csv.df.loc[bufr_csv.df['TYP'] == typ, v] = 5
+
+    return bufr_csv.df
+
 
 #---------------------------------------------------------------------------------------------------
 # Input Parameters
@@ -38,7 +85,7 @@ qm_to_5 = {'PQM':[180, 181, 182, 183, 187, 188, 280, 281, 282, 283, 287, 288],
            'PMQ':[120, 180, 181, 182, 183, 187, 188, 220, 280, 281, 282, 283, 287, 288]}
 
 # Option to use inputs from YAML file
-if len(sys.argv) > 1:
+if (__name__ == '__main__') and (len(sys.argv) > 1):
     in_fname = sys.argv[1]
     out_fname = sys.argv[2]
     with open(sys.argv[3], 'r') as fptr:
@@ -52,22 +99,10 @@ if len(sys.argv) > 1:
 # Only Keep Certain Observation Types
 #---------------------------------------------------------------------------------------------------
 
-bufr_csv = bufr.bufrCSV(in_fname)
-
-# Only select certain observation types
-bufr_csv.select_obtypes(obtypes)
-
-# Set certain variables to missing
-for v in missing_var:
-    for typ in missing_var[v]:
-        bufr_csv.df.loc[bufr_csv.df['TYP'] == typ, v] = np.nan
-
-# Set certain QM flags to 5
-for v in qm_to_5:
-    for typ in qm_to_5[v]:
-        bufr_csv.df.loc[bufr_csv.df['TYP'] == typ, v] = 5
-
-bufr.df_to_csv(bufr_csv.df, out_fname)
+if __name__ == '__main__':
+    bufr_csv = ob_io.read_ob_file(in_fname)
+    out_df = select_obtypes(bufr_csv.df, obtypes, missing_var=missing_var, qm_to_5=qm_to_5)
+    ob_io.write_ob_file(out_df, out_fname)
 
 
 """
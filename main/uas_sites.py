@@ -37,6 +37,8 @@ import scipy.ndimage as sn
 import sys
 import yaml
 
+import upp_cache
+
 
 #---------------------------------------------------------------------------------------------------
 # Input Parameters
@@ -80,6 +82,9 @@ npts_sn = 35
 # Nature run output (for landmask)
 upp_file = '/work/noaa/wrfruc/murdzek/nature_run_spring/UPP/20220429/wrfnat_202204291200_er.grib2'
 
+# Directory used to cache decoded UPP fields (set to None to not use a cache). See upp_cache.py
+upp_cache_dir = None
+
 # Apply binary closing after applying landmask?
 # Goal here is to include UAS sites over small inland bodies of water (i.e., not the Great Lakes).
 # Using binary closing is a bit aggressive, as it adds some UAS sites over the Great Lakes when
@@ -98,7 +103,7 @@ nshape = 16
 # https://proj.org/operations/projections/lcc.html
 proj_str = '+proj=lcc +lat_0=39 +lon_0=-96 +lat_1=33 +lat_2=45'
 
-# Maximum number of UAS sites per output file
+# Maximum number of UAS sites per output file (set to None or 0 to write all sites to a single file)
 max_sites = 2500
 
 # Output text file to dump UAS site (lat, lon) coordinates
@@ -126,6 +131,7 @@ if len(sys.argv) > 1:
     out_file = param['shared']['uas_grid_file']
     make_plot = param['create_uas_grid']['make_plot']
     plot_save_fname = '%s/uas_sites.pdf' % param['paths']['plots']
+    upp_cache_dir = param['shared']['upp_cache_dir']
 
 
 #---------------------------------------------------------------------------------------------------
@@ -145,7 +151,7 @@ proj = pyproj.Proj(proj_str)
 lon_uas, lat_uas = proj(x_uas, y_uas, inverse=True)
 
 # Extract and apply landmask
-upp_ds = xr.open_dataset(upp_file, engine='pynio')
+upp_ds = upp_cache.UPPFile(upp_file, cache_dir=upp_cache_dir)
 landmask = upp_ds['LAND_P0_L1_GLC0'].values.ravel()
 lat_upp = upp_ds['gridlat_0'].values.ravel()
 lon_upp = upp_ds['gridlon_0'].values.ravel()
@@ -184,7 +190,7 @@ lon_uas = lon_uas[uas_mask_us]
 lat_uas = lat_uas[uas_mask_us]
 
 # Save results
-if len(lat_uas) < max_sites:
+if (not max_sites) or (len(lat_uas) < max_sites):
     fptr = open(out_file, 'w')
     fptr.write('lon (deg E),lat (deg N)\n')
     for lon, lat in zip(lon_uas, lat_uas):
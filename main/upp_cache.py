@@ -0,0 +1,208 @@
+"""
+Cache of Decoded UPP Fields
+
+Decoding UPP GRIB2 files (using PyNIO) is slow, and the same UPP files are decoded by the
+interpolator (create_synthetic_obs.py), uas_sites.py, and plot_uas_NR_diffs.py. UPPFile objects
+decode each field the first time it is accessed and save it to a chunked NetCDF4 file in a cache
+directory. Chunks contain all vertical levels for a horizontal tile. Later accesses (including
+those from other programs or later runs over the same Nature Run period) open the NetCDF4 file
+lazily, so only the chunks that are sliced are read from disk and the GRIB2 file is never decoded.
+
+Cache layout: <cache_dir>/<UPP file name without extension>/<field>.nc
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import xarray as xr
+import os
+
+
+#---------------------------------------------------------------------------------------------------
+# Parameters
+#---------------------------------------------------------------------------------------------------
+
+# Fields that are not in the UPP output, but can be computed by summing other UPP fields
+DERIVED_FIELDS = {'LIQMR':['CLWMR_P0_L105_GLC0', 'RWMR_P0_L105_GLC0']}
+
+
+#---------------------------------------------------------------------------------------------------
+# Classes
+#---------------------------------------------------------------------------------------------------
+
+class UPPFile():
+    """
+    UPP output file. Fields are accessed using upp[field] (similar to an xr.Dataset)
+
+    Parameters
+    ----------
+    fname : string
+        UPP file name (GRIB2 or NetCDF)
+    cache_dir : string, optional
+        Cache directory. Set to None to read fields directly from the UPP file
+    tile_size : integer, optional
+        Size of horizontal chunks in cached files (gridpoints)
+
+    """
+
+    def __init__(self, fname, cache_dir=None, tile_size=100):
+        self.fname = fname
+        self.engine = upp_engine(fname)
+        self.cache_dir = cache_dir
+        self.tile_size = tile_size
+        self.fields = {}
+        self.cache_ds = []
+        self.ds = None
+
+    def upp_ds(self):
+        """
+        Open the UPP file (only done if a field is not in the cache)
+        """
+        if self.ds is None:
+            self.ds = xr.open_dataset(self.fname, engine=self.engine)
+        return self.ds
+
+    def cache_fname(self, field):
+        """
+        Name of the cache file for a field
+        """
+        base = os.path.splitext(os.path.basename(self.fname))[0]
+        return '%s/%s/%s.nc' % (self.cache_dir, base, field)
+
+    def decode(self, field):
+        """
+        Read a field from the UPP file (or compute a derived field)
+        """
+        if (field in DERIVED_FIELDS) and (field not in self.upp_ds()):
+            da = self[DERIVED_FIELDS[field][0]].copy()
+            for f in DERIVED_FIELDS[field][1:]:
+                da = da + self[f]
+            da.name = field
+        else:
+            da = self.upp_ds()[field]
+        return da
+
+    def __getitem__(self, field):
+        if field not in self.fields:
+            if self.cache_dir is None:
+                self.fields[field] = self.decode(field)
+            else:
+                fname = self.cache_fname(field)
+                if not os.path.isfile(fname):
+                    write_cache_field(self.decode(field), field, fname, tile_size=self.tile_size)
+                self.cache_ds.append(xr.open_dataset(fname))
+                self.fields[field] = self.cache_ds[-1][field]
+        return self.fields[field]
+
+    def __setitem__(self, field, da):
+        self.fields[field] = da
+
+    def field_file(self, field):
+        """
+        Name of a file containing field (which can be opened using UPPFile). Used when other 
+        processes need to read a field
+        """
+        if self.cache_dir is None:
+            return self.fname
+        self[field]
+        return self.cache_fname(field)
+
+    def to_dataset(self, fields):
+        """
+        Create an xr.Dataset containing certain fields. Fields from the cache are loaded lazily
+        """
+        return xr.merge([self[f].to_dataset(name=f) for f in fields], compat='override')
+
+    def close(self):
+        """
+        Close all open files
+        """
+        for ds in self.cache_ds:
+            ds.close()
+        if self.ds is not None:
+            self.ds.close()
+        self.fields = {}
+        self.cache_ds = []
+        self.ds = None
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def upp_engine(fname):
+    """
+    Determine the xr.open_dataset engine for a UPP file
+
+    Parameters
+    ----------
+    fname : string
+        UPP file name
+
+    Returns
+    -------
+    engine : string
+        'pynio' for GRIB2 files, None otherwise
+
+    """
+
+    if fname.endswith('.grib2'):
+        engine = 'pynio'
+    else:
+        engine = None
+
+    return engine
+
+
+def write_cache_field(da, field, fname, tile_size=100):
+    """
+    Write a single field to a chunked NetCDF4 cache file. The file is written to a temporary
+    location first, then moved, so that jobs running simultaneously never read a partially written
+    file
+
+    Parameters
+    ----------
+    da : xr.DataArray
+        Field
+    field : string
+        Field name
+    fname : string
+        Cache file name
+    tile_size : integer, optional
+        Size of horizontal chunks (gridpoints). All other dimensions are in a single chunk
+
+    Returns
+    -------
+    None
+
+    """
+
+    if field in da.dims:
+        ds = da.coords.to_dataset()
+        encoding = {}
+    else:
+        # Coordinates (e.g., gridlat_0) cannot be converted to a Dataset with the same name, so
+        # other coordinates are dropped
+        if field in da.coords:
+            da = da.reset_coords(drop=True)
+        ds = da.to_dataset(name=field)
+        chunks = list(da.shape)
+        if da.ndim >= 2:
+            chunks[-2] = min(chunks[-2], tile_size)
+            chunks[-1] = min(chunks[-1], tile_size)
+        encoding = {field:{'chunksizes':tuple(chunks)}}
+
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+    ds.to_netcdf(tmp_fname, format='NETCDF4', encoding=encoding)
+    os.replace(tmp_fname, fname)
+
+    return None
+
+
+"""
+End upp_cache.py
+"""
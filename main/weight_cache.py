@@ -0,0 +1,238 @@
+"""
+Persistent Cache of Projected Observation Locations for the Synthetic Observation Creator
+
+Many observing stations (METARs, mesonets, bogus surface and UAS sites) report from the same
+locations every cycle, so there is no need to redo the map projection for these stations each time
+create_synthetic_obs.py is run. This module saves the projected (x, y) coordinates of each
+(SID, XOB, YOB) triplet to an .npz file. The horizontal interpolation indices and weights (i0, j0,
+iwgt, jwgt) are simple functions of these coordinates.
+
+Each cache file is specific to a map projection and model grid. The file name contains a hash of
+the map projection parameters, the grid shape, and CACHE_VERSION, so changing any of these
+automatically invalidates the cache. Least-recently-used entries are evicted once the cache grows
+beyond a maximum number of entries. Only obs from fixed stations are added to the cache, as moving
+platforms (aircraft, ships, drifting radiosondes and UAS) rarely report from the same location
+twice.
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import hashlib
+import inspect
+import time
+import os
+
+
+#---------------------------------------------------------------------------------------------------
+# Cache Parameters
+#---------------------------------------------------------------------------------------------------
+
+# Increment this whenever the contents of the cache change
+CACHE_VERSION = 1
+
+# Columns saved in each cache file
+CACHE_COLS = ['SID', 'XOB', 'YOB', 'xlc', 'ylc', 'last_used']
+
+# BUFR subsets from fixed stations. ADPUPA obs are also from fixed stations if they do not drift
+FIXED_SUBSETS = ['ADPSFC', 'MSONET', 'GPSIPW']
+
+
+#---------------------------------------------------------------------------------------------------
+# Functions
+#---------------------------------------------------------------------------------------------------
+
+def cache_fname(cache_dir, proj_fct, shape):
+    """
+    Determine the cache file name for a given map projection and model grid
+
+    Parameters
+    ----------
+    cache_dir : string
+        Directory containing the cache files
+    proj_fct : function
+        Function used to perform the map projection. The default values of the keyword arguments
+        are assumed to define the projection
+    shape : tuple
+        Shape of the model grid
+
+    Returns
+    -------
+    fname : string
+        Cache file name
+
+    """
+
+    params = [(k, v.default) for k, v in inspect.signature(proj_fct).parameters.items()
+              if v.default is not inspect.Parameter.empty]
+    key = repr([proj_fct.__module__, proj_fct.__name__, params, tuple(shape), CACHE_VERSION])
+    key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    fname = '%s/interp_wgts_v%d_%s.npz' % (cache_dir, CACHE_VERSION, key_hash)
+
+    return fname
+
+
+def load_cache(fname):
+    """
+    Read a cache file
+
+    Parameters
+    ----------
+    fname : string
+        Cache file name
+
+    Returns
+    -------
+    cache : pd.DataFrame
+        Cached projected coordinates. Empty if the file does not exist or is from a different
+        CACHE_VERSION
+
+    """
+
+    cache = pd.DataFrame({c:[] for c in CACHE_COLS})
+    cache['SID'] = cache['SID'].astype(str)
+    if os.path.isfile(fname):
+        with np.load(fname) as data:
+            if int(data['version']) == CACHE_VERSION:
+                cache = pd.DataFrame({c:data[c] for c in CACHE_COLS})
+
+    return cache
+
+
+def save_cache(fname, cache):
+    """
+    Write a cache file. The file is written to a temporary location first, then moved, so that
+    jobs running simultaneously never read a partially written cache
+
+    Parameters
+    ----------
+    fname : string
+        Cache file name
+    cache : pd.DataFrame
+        Cached projected coordinates
+
+    Returns
+    -------
+    None
+
+    """
+
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    tmp_fname = '%s.%d.tmp.npz' % (fname[:-4], os.getpid())
+    np.savez(tmp_fname, version=CACHE_VERSION, SID=np.array(cache['SID'].tolist(), dtype=str),
+             **{c:cache[c].values.astype(float) for c in CACHE_COLS[1:]})
+    os.replace(tmp_fname, fname)
+
+
+def lookup(cache, sid, xob, yob):
+    """
+    Look up projected coordinates for a set of observations
+
+    Parameters
+    ----------
+    cache : pd.DataFrame
+        Cached projected coordinates
+    sid : array
+        Station IDs
+    xob : array
+        Observation longitudes (deg E)
+    yob : array
+        Observation latitudes (deg N)
+
+    Returns
+    -------
+    found : array
+        Boolean array. True if the observation was found in the cache
+    xlc : array
+        Projected x coordinates (NaN if not found)
+    ylc : array
+        Projected y coordinates (NaN if not found)
+
+    """
+
+    key_df = pd.DataFrame({'SID':np.asarray(sid).astype(str), 'XOB':np.asarray(xob, dtype=float),
+                           'YOB':np.asarray(yob, dtype=float)})
+    merged = key_df.merge(cache[['SID', 'XOB', 'YOB', 'xlc', 'ylc']], how='left',
+                          on=['SID', 'XOB', 'YOB'])
+    xlc = merged['xlc'].to_numpy(copy=True)
+    ylc = merged['ylc'].to_numpy(copy=True)
+    found = np.logical_not(np.isnan(xlc))
+
+    return found, xlc, ylc
+
+
+def fixed_stations(subset, drift):
+    """
+    Determine which observations come from fixed stations (and can therefore be cached)
+
+    Parameters
+    ----------
+    subset : array
+        BUFR subset for each observation
+    drift : array
+        Boolean array. True if the observation drifts (e.g., radiosondes with XDR and YDR)
+
+    Returns
+    -------
+    fixed : array
+        Boolean array. True if the observation is from a fixed station
+
+    """
+
+    subset = np.asarray(subset)
+    fixed = np.logical_or(np.isin(subset, FIXED_SUBSETS),
+                          np.logical_and(subset == 'ADPUPA', np.logical_not(drift)))
+
+    return fixed
+
+
+def update(cache, sid, xob, yob, xlc, ylc, fixed=None, max_entries=None):
+    """
+    Add observations from fixed stations to the cache and evict least-recently-used entries
+
+    Observations already in the cache have their last-used time updated
+
+    Parameters
+    ----------
+    cache : pd.DataFrame
+        Cached projected coordinates
+    sid, xob, yob : arrays
+        Station IDs, longitudes (deg E), and latitudes (deg N) used in the current cycle
+    xlc, ylc : arrays
+        Projected (x, y) coordinates for each observation
+    fixed : array, optional
+        Boolean array. Only observations where fixed is True are added (see fixed_stations). All
+        observations are added if None
+    max_entries : integer, optional
+        Maximum number of entries to retain. Set to None to keep all entries
+
+    Returns
+    -------
+    cache : pd.DataFrame
+        Updated cache
+
+    """
+
+    new = pd.DataFrame({'SID':np.asarray(sid).astype(str), 'XOB':np.asarray(xob, dtype=float),
+                        'YOB':np.asarray(yob, dtype=float), 'xlc':np.asarray(xlc, dtype=float),
+                        'ylc':np.asarray(ylc, dtype=float), 'last_used':time.time()})
+    if fixed is not None:
+        new = new.loc[np.asarray(fixed, dtype=bool)]
+    cache = pd.concat([cache, new], ignore_index=True)
+    cache.drop_duplicates(subset=['SID', 'XOB', 'YOB'], keep='last', inplace=True)
+
+    if (max_entries is not None) and (len(cache) > max_entries):
+        cache = cache.sort_values('last_used', kind='stable').iloc[-max_entries:]
+    cache.reset_index(drop=True, inplace=True)
+
+    return cache
+
+
+"""
+End weight_cache.py
+"""
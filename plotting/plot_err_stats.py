@@ -0,0 +1,124 @@
+"""
+Merge and Plot Observation Error Statistics From Many Cycles
+
+Combines the error statistics files saved by add_obs_errors.py (see the stats_dir option) and
+creates a summary CSV file along with one plot per observation type. Each plot includes histograms
+of the errors normalized by the errtable standard deviation and vertical profiles of the actual
+and errtable standard deviations. The observation files do not need to be read.
+
+Optional command-line arguments:
+    argv[1] = Error statistics files (glob pattern, e.g., '/path/*.err_stats.npz')
+    argv[2] = Output directory
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import matplotlib.pyplot as plt
+import numpy as np
+import glob
+import sys
+
+sys.path.append('../main')
+import err_stats as es
+
+
+#---------------------------------------------------------------------------------------------------
+# Input Parameters
+#---------------------------------------------------------------------------------------------------
+
+# Error statistics files
+stats_files = '/work2/noaa/wrfruc/murdzek/nature_run_spring/obs/err_stats/*.err_stats.npz'
+
+# Output directory
+out_dir = './'
+
+# Use passed arguments, if they exist
+if len(sys.argv) > 1:
+    stats_files = sys.argv[1]
+    out_dir = sys.argv[2]
+
+
+#---------------------------------------------------------------------------------------------------
+# Merge Statistics
+#---------------------------------------------------------------------------------------------------
+
+fnames = sorted(glob.glob(stats_files))
+print('merging %d error statistics files' % len(fnames))
+stats = es.merge_err_stats(fnames)
+
+summary = stats.summary()
+summary.to_csv('%s/err_stats_summary.csv' % out_dir, index=False)
+
+# Print totals for each ob type and variable
+print()
+print('%5s %6s %10s %12s %12s %12s' % ('TYP', 'var', 'n', 'mean', 'std', 'errtable std'))
+for (typ, var), df in summary.groupby(['TYP', 'var'], sort=True):
+    n = df['n'].sum()
+    mean = np.sum(df['n'] * df['mean']) / n
+    var_tot = np.sum(df['n'] * (df['std']**2 + (df['mean'] - mean)**2)) / n
+    estd = np.sqrt(np.sum(df['n'] * df['errtable_std']**2) / n)
+    print('%5d %6s %10d %12.4e %12.4e %12.4e' % (typ, var, n, mean, np.sqrt(var_tot), estd))
+
+
+#---------------------------------------------------------------------------------------------------
+# Plot Statistics
+#---------------------------------------------------------------------------------------------------
+
+# Normalized error bin centers (the two outermost bins hold values outside HIST_EDGES)
+edges = es.HIST_EDGES
+ctrs = 0.5 * (edges[1:] + edges[:-1])
+gauss = np.exp(-0.5 * ctrs**2) / np.sqrt(2 * np.pi) * (edges[1] - edges[0])
+prs_ctr = 0.5 * (stats.prs[1:] + stats.prs[:-1])
+
+for typ in sorted(stats.data.keys()):
+    d = stats.data[typ]
+    var_idx = [v for v in range(len(stats.names)) if d['n'][v].sum() > 0]
+    if len(var_idx) == 0:
+        continue
+
+    fig, axes = plt.subplots(nrows=2, ncols=len(var_idx), figsize=(2+(4*len(var_idx)), 8),
+                             squeeze=False)
+    plt.subplots_adjust(left=0.08, bottom=0.08, right=0.98, top=0.9, hspace=0.35)
+
+    for j, v in enumerate(var_idx):
+
+        # Top plot: Histogram of normalized errors (all pressure bins)
+        hist = d['hist'][v].sum(axis=0)
+        ntot = hist.sum()
+        ax1 = axes[0, j]
+        if ntot > 0:
+            ax1.plot(ctrs, hist[1:-1] / ntot, 'b-', label='actual')
+            ax1.plot(ctrs, gauss, 'r--', label='N(0, 1)')
+            ax1.set_title('%s (%.2f%% outside)' % (stats.names[v],
+                                                   100 * (hist[0] + hist[-1]) / ntot))
+        ax1.set_xlabel('error / errtable std', size=12)
+        ax1.legend()
+        ax1.grid()
+
+        # Bottom plot: Vertical profile of standard deviations
+        n = d['n'][v, :-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.where(n > 0, np.sqrt(d['M2'][v, :-1] / n), np.nan)
+            estd = np.where(n > 0, np.sqrt(d['sig2'][v, :-1] / n), np.nan)
+        ax2 = axes[1, j]
+        ax2.plot(std, prs_ctr, 'b-', label='actual')
+        ax2.plot(estd, prs_ctr, 'r-', label='errtable')
+        ax2.set_xlabel('std %s' % stats.names[v], size=12)
+        if j == 0:
+            ax2.set_ylabel('pressure (mb)', size=12)
+        ax2.set_ylim([stats.prs.max(), stats.prs.min()])
+        ax2.legend()
+        ax2.grid()
+
+    plt.suptitle('Type = %d Error Statistics (%d files)' % (typ, len(fnames)), size=16)
+    plt.savefig('%s/err_stats_%d.png' % (out_dir, typ))
+    plt.close()
+
+
+"""
+End plot_err_stats.py
+"""
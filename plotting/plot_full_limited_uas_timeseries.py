@@ -21,6 +21,9 @@ import datetime as dt
 
 import pyDA_utils.bufr as bufr
 
+sys.path.append('../main')
+import ob_io
+
 
 #---------------------------------------------------------------------------------------------------
 # Input Parameters
@@ -47,15 +50,19 @@ verbose = 1
 # Output file name (include %s placeholder for SID)
 out_fname = './uas_ref_limit_timeseries_%s.png'
 
+# Observation file format ('csv' or 'parquet')
+ob_fmt = 'csv'
+
 # Use passed arguments, if they exist
 if len(sys.argv) > 1:
     t_str = sys.argv[1]
     tag = sys.argv[2]
     with open(sys.argv[3], 'r') as fptr:
         param = yaml.safe_load(fptr)
-    bufr_file_limit = '%s/%s.%s.fake.prepbufr.csv' % (param['paths']['syn_limit_uas_csv'],
-                                                      t_str, tag)
-    bufr_file_ref = f"{param['paths'][param['limit_uas']['csv_ref_dir']]}/{t_str}.{tag}.fake.prepbufr.csv"
+    ob_fmt = param['shared']['ob_file_format']
+    bufr_file_limit = '%s/%s.%s.fake.prepbufr.%s' % (param['paths']['syn_limit_uas_csv'],
+                                                     t_str, tag, ob_fmt)
+    bufr_file_ref = f"{param['paths'][param['limit_uas']['csv_ref_dir']]}/{t_str}.{tag}.fake.prepbufr.{ob_fmt}"
     plot_vars = param['limit_uas']['plot_timeseries']['plot_vars']
     n_sid = param['limit_uas']['plot_timeseries']['n_sid']
     obtype = param['limit_uas']['plot_timeseries']['obtype']
@@ -70,7 +77,7 @@ if len(sys.argv) > 1:
 bufr_df = {}
 for fname, key in zip([bufr_file_limit, bufr_file_ref], ['limit', 'ref']):
     if verbose > 0: print(f"reading {fname}")
-    bufr_df[key] = bufr.bufrCSV(fname).df
+    bufr_df[key] = ob_io.read_ob_file(fname).df
 
     # Compute WSPD and RHOB if needed
     if 'WSPD' in plot_vars.keys():
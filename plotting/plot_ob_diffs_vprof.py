@@ -27,6 +27,9 @@ import yaml
 
 import pyDA_utils.bufr as bufr
 
+sys.path.append('../main')
+import ob_io
+
 
 #---------------------------------------------------------------------------------------------------
 # Input Parameters
@@ -75,12 +78,16 @@ exclude_sid = ['00000775']
 # Title
 title = 'synthetic obs $-$ real obs'
 
+# Observation file format ('csv' or 'parquet')
+ob_fmt = 'csv'
+
 # Option to used passed arguments
 if len(sys.argv) > 1:
     bufr_tag = str(sys.argv[1])
     date_range = [dt.datetime.strptime(sys.argv[2], '%Y%m%d%H%M')]
     with open(sys.argv[3], 'r') as fptr:
         param = yaml.safe_load(fptr)
+    ob_fmt = param['shared']['ob_file_format']
     bufr_dir = param['paths'][param['plots']['diff_3d']['bufr_dir']]
     exclude_sid = param['plots']['diff_3d']['exclude_sid']
     save_dir = '%s/%s' % (param['paths']['plots'], sys.argv[2])
@@ -108,12 +115,12 @@ sim_ob_dfs = []
 for d in date_range:
     date_str = d.strftime('%Y%m%d%H%M')
     try:
-        real_bufr_csv = bufr.bufrCSV('%s/%s.%s.real_red.prepbufr.csv' % (bufr_dir, date_str, bufr_tag))
+        real_bufr_csv = ob_io.read_ob_file('%s/%s.%s.real_red.prepbufr.%s' % (bufr_dir, date_str, bufr_tag, ob_fmt))
     except FileNotFoundError:
         # Skip to next file
         continue
     real_ob_dfs.append(real_bufr_csv.df)
-    sim_bufr_csv = bufr.bufrCSV('%s/%s.%s.fake.prepbufr.csv' % (bufr_dir, date_str, bufr_tag))
+    sim_bufr_csv = ob_io.read_ob_file('%s/%s.%s.fake.prepbufr.%s' % (bufr_dir, date_str, bufr_tag, ob_fmt))
     sim_ob_dfs.append(sim_bufr_csv.df)
     meta = sim_bufr_csv.meta
 bufr_df_real = pd.concat(real_ob_dfs, ignore_index=True)
@@ -23,6 +23,9 @@ import sys
 import yaml
 
 import pyDA_utils.bufr as bufr
+
+sys.path.append('../main')
+import ob_io
 import pyDA_utils.plot_model_data as pmd
 import pyDA_utils.map_proj as mp
 
@@ -47,16 +50,20 @@ all_sid = ["'UA000001'", "'UA000053'", "'UA000180'"]
 # Output file name (include %s placeholder for SID)
 out_fname = './uas_raw_superob_compare_%s.png'
 
+# Observation file format ('csv' or 'parquet')
+ob_fmt = 'csv'
+
 # Use passed arguments, if they exist
 if len(sys.argv) > 1:
     t_str = sys.argv[1]
     tag = sys.argv[2]
     with open(sys.argv[3], 'r') as fptr:
         param = yaml.safe_load(fptr)
-    bufr_file_raw = '%s/%s.%s.input.csv' % (param['paths']['syn_superob_csv'],
-                                            t_str, tag)
-    bufr_file_superob = '%s/%s.%s.fake.prepbufr.csv' % (param['paths']['syn_superob_csv'],
-                                                        t_str, tag)
+    ob_fmt = param['shared']['ob_file_format']
+    bufr_file_raw = '%s/%s.%s.input.%s' % (param['paths']['syn_superob_csv'],
+                                           t_str, tag, ob_fmt)
+    bufr_file_superob = '%s/%s.%s.fake.prepbufr.%s' % (param['paths']['syn_superob_csv'],
+                                                       t_str, tag, ob_fmt)
     ob_type_thermo = int(param['superobs']['plot_vprof']['ob_type_thermo'])
     ob_type_wind = int(param['superobs']['plot_vprof']['ob_type_wind'])
     all_sid = param['superobs']['plot_vprof']['all_sid']
@@ -68,8 +75,8 @@ if len(sys.argv) > 1:
 #---------------------------------------------------------------------------------------------------
 
 # Read in BUFR CSV files
-bufr_csv_raw = bufr.bufrCSV(bufr_file_raw)
-bufr_csv_superob = bufr.bufrCSV(bufr_file_superob)
+bufr_csv_raw = ob_io.read_ob_file(bufr_file_raw)
+bufr_csv_superob = ob_io.read_ob_file(bufr_file_superob)
 
 # Create plots
 for sid in all_sid:
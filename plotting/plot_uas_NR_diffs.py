@@ -23,6 +23,10 @@ import sys
 import yaml
 
 import pyDA_utils.bufr as bufr
+
+sys.path.append('../main')
+import ob_io
+import upp_cache
 import pyDA_utils.plot_model_data as pmd
 import pyDA_utils.map_proj as mp
 
@@ -43,23 +47,35 @@ bufr_file_superob = '/work2/noaa/wrfruc/murdzek/src/osse_ob_creator/main/tmp_sup
 # UPP file for comparison
 upp_file = '/work2/noaa/wrfruc/murdzek/nature_run_spring/UPP/20220429/wrfnat_202204291500_er.grib2'
 
+# Directory used to cache decoded UPP fields (set to None to not use a cache). See upp_cache.py
+upp_cache_dir = None
+
+# UPP fields needed to plot skew-Ts (only used if upp_cache_dir is not None)
+skewt_fields = ['gridlat_0', 'gridlon_0', 'PRES_P0_L105_GLC0', 'HGT_P0_L105_GLC0', 
+                'TMP_P0_L105_GLC0', 'SPFH_P0_L105_GLC0', 'UGRD_P0_L105_GLC0', 'VGRD_P0_L105_GLC0']
+
 # Make plots for the closest n UAS profiles
 nclose = 2
 
 # Output file name (include %d placeholder for nclose)
 out_fname = './uas_NR_compare_%d.png'
 
+# Observation file format ('csv' or 'parquet')
+ob_fmt = 'csv'
+
 # Use passed arguments, if they exist
 if len(sys.argv) > 1:
     tag = sys.argv[1]
     t_str = sys.argv[2]
     with open(sys.argv[3], 'r') as fptr:
         param = yaml.safe_load(fptr)
-    bufr_file = '%s/%s.%s.fake.prepbufr.csv' % (param['paths'][param['plots']['diff_uas']['bufr_dir']],
-                                                t_str, tag)
+    ob_fmt = param['shared']['ob_file_format']
+    bufr_file = '%s/%s.%s.fake.prepbufr.%s' % (param['paths'][param['plots']['diff_uas']['bufr_dir']],
+                                               t_str, tag, ob_fmt)
     upp_file = '%s/%s/wrfnat_%s_er.grib2' % (param['paths']['model'], t_str[:8], t_str)
     out_fname = '%s/%s' % (param['paths']['plots'], t_str) +'/uas_NR_compare_%d.png'
     nclose = param['plots']['diff_uas']['nclose']
+    upp_cache_dir = param['shared']['upp_cache_dir']
 
 
 #---------------------------------------------------------------------------------------------------
@@ -67,7 +83,7 @@ if len(sys.argv) > 1:
 #---------------------------------------------------------------------------------------------------
 
 # Determine UAS obs closest to NR gridpoints
-bufr_csv = bufr.bufrCSV(bufr_file)
+bufr_csv = ob_io.read_ob_file(bufr_file)
 bufr_csv.df = bufr.compute_wspd_wdir(bufr_csv.df)
 bufr_csv.df['xlc'], bufr_csv.df['ylc'] = mp.ll_to_xy_lc(bufr_csv.df['YOB'], bufr_csv.df['XOB'] - 360.)
 bufr_csv.df['xnear'] = np.int32(np.around(bufr_csv.df['xlc']))
@@ -81,11 +97,14 @@ plot_df = bufr_csv.df.loc[np.logical_and(np.logical_or(bufr_csv.df['TYP'] == ob_
 
 # Read in superobbed BUFR file
 if compare_superob:
-    bufr_csv_superob = bufr.bufrCSV(bufr_file_superob)
+    bufr_csv_superob = ob_io.read_ob_file(bufr_file_superob)
     bufr_csv_superob.df = bufr.compute_wspd_wdir(bufr_csv_superob.df)
 
-# Open UPP file
-upp_ds = xr.open_dataset(upp_file, engine='pynio')
+# Open UPP file. Only the fields needed for the skew-Ts are read from the cache
+if upp_cache_dir is None:
+    upp_ds = xr.open_dataset(upp_file, engine='pynio')
+else:
+    upp_ds = upp_cache.UPPFile(upp_file, cache_dir=upp_cache_dir).to_dataset(skewt_fields)
 
 # Create plot
 for i, nmsg in enumerate(np.unique(plot_df['nmsg'])):
@@ -0,0 +1,66 @@
+"""
+Check Output from Cache Test
+
+The synthetic obs from the cache test (run once with empty UPP and weight caches and once with full
+caches) must be identical to the synthetic obs from the linear interpolation test (no cache)
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import os
+import glob
+import numpy as np
+
+import pyDA_utils.bufr as bufr
+
+
+#---------------------------------------------------------------------------------------------------
+# Compare Cached and Uncached BUFR CSV Files
+#---------------------------------------------------------------------------------------------------
+
+ref_dir = './linear_interp_test/perfect_conv'
+test_dirs = {'empty cache':'./cache_test/perfect_conv_cold',
+             'full cache':'./cache_test/perfect_conv'}
+
+err = 0
+ref_fnames = sorted(glob.glob('%s/*.prepbufr.csv' % ref_dir))
+if len(ref_fnames) == 0:
+    print()
+    print('ERROR: no uncached output in %s (run the linear interpolation test first)' % ref_dir)
+    err = 10
+
+for ref_fname in ref_fnames:
+    ref_df = bufr.bufrCSV(ref_fname).df
+    for key in test_dirs.keys():
+        fname = '%s/%s' % (test_dirs[key], os.path.basename(ref_fname))
+        print()
+        print('comparing %s (%s)' % (os.path.basename(ref_fname), key))
+        if not os.path.isfile(fname):
+            print('ERROR: missing output file %s' % fname)
+            err = 10
+            continue
+        df = bufr.bufrCSV(fname).df
+        if (len(df) != len(ref_df)) or (list(df.columns) != list(ref_df.columns)):
+            print('ERROR: number of obs or columns differ from the uncached output')
+            err = 10
+            continue
+        for c in ref_df.columns:
+            if ref_df[c].dtype.kind == 'f':
+                same = np.array_equal(df[c].values, ref_df[c].values, equal_nan=True)
+            else:
+                same = np.all(df[c].values == ref_df[c].values)
+            if not same:
+                print('ERROR: %s differs from the uncached output' % c)
+                err = 10
+
+print()
+print(err)
+
+
+"""
+End check_cache_test.py
+"""
@@ -0,0 +1,124 @@
+"""
+Check Observation Error Statistics
+
+Adds observation errors to the synthetic obs from the linear interpolation test using both
+engines in add_obs_errors.py and checks that the accumulated error statistics match the
+differences between the obs with and without errors. Also checks that the vectorized engine gives
+identical errors when using several processes or when other stations are removed
+
+shawn.s.murdzek@noaa.gov
+"""
+
+#---------------------------------------------------------------------------------------------------
+# Import Modules
+#---------------------------------------------------------------------------------------------------
+
+import sys
+import glob
+import numpy as np
+import yaml
+
+import pyDA_utils.bufr as bufr
+
+sys.path.append('../main')
+import add_obs_errors as aoe
+import errtable_index as eti
+import obs_err_utils as oeu
+import err_stats as es
+
+
+#---------------------------------------------------------------------------------------------------
+# Compare Error Statistics With Differences
+#---------------------------------------------------------------------------------------------------
+
+with open('./linear_interp_test/linear_interp_test.yml', 'r') as fptr:
+    param = yaml.safe_load(fptr)['obs_errors']
+errtable = eti.read_errtable(param['errtable'])
+in_df = bufr.bufrCSV(glob.glob('./linear_interp_test/perfect_conv/*.fake.prepbufr.csv')[0]).df
+
+# RHOB is skipped because RH is clipped to [0, 100] after adding errors. Tolerances roughly come
+# from the BUFR precision
+tolerance = {'TOB':0.1, 'UOB':0.1, 'VOB':0.1, 'PRSS':10, 'PMO':0.1, 'PWO':0.1}
+
+# Seeds can only be set for the vectorized engine
+seeds = {'pyDA_utils':None, 'vectorized':1}
+err_kw = {'autocor_POB_obs':param['autocor_POB_obs'], 'autocor_DHR_obs':param['autocor_DHR_obs'],
+          'autocor_ZOB_partition_DHR_obs':param['autocor_ZOB_partition_DHR_obs'],
+          'auto_reg_parm':param['auto_reg_parm'], 'cycle':202202011200}
+
+err = 0
+out_dfs = {}
+for engine in ['pyDA_utils', 'vectorized']:
+    print()
+    print('checking error statistics for engine = %s' % engine)
+    stats = es.errStats(errtable.prs(), oeu.OB_ERR_NAMES.keys())
+    try:
+        out_df = aoe.add_obs_errors(in_df.copy(), errtable, engine=engine, seed=seeds[engine],
+                                    stats=stats, **err_kw)
+    except Exception as e:
+        print('ERROR: add_obs_errors failed: %s' % e)
+        err = 10
+        continue
+    out_dfs[engine] = out_df
+
+    for t in np.unique(out_df['TYP'].values):
+        if t not in errtable:
+            continue
+        idx = np.where(out_df['TYP'].values == t)[0]
+        for ob in tolerance.keys():
+            diff = out_df[ob].values[idx] - in_df[ob].values[idx]
+            diff = diff[np.logical_not(np.isnan(diff))]
+            v = stats.names.index(ob)
+            if int(t) in stats.data:
+                d = stats.data[int(t)]
+                n = d['n'][v].sum()
+            else:
+                n = 0
+            if n != diff.size:
+                print('ERROR: %d %s errors in stats for type %d (expected %d)' % (n, ob, t, diff.size))
+                err = 10
+                continue
+            if n == 0:
+                continue
+            mean = np.sum(d['n'][v] * d['mean'][v]) / n
+            std = np.sqrt(np.sum(d['M2'][v] + d['n'][v] * (d['mean'][v] - mean)**2) / n)
+            if ((np.abs(mean - np.mean(diff)) > tolerance[ob]) or
+                (np.abs(std - np.std(diff)) > tolerance[ob])):
+                print('ERROR: %s stats for type %d do not match differences' % (ob, t))
+                print('stats mean = %.4e, std = %.4e' % (mean, std))
+                print('diff mean = %.4e, std = %.4e' % (np.mean(diff), np.std(diff)))
+                err = 10
+
+
+#---------------------------------------------------------------------------------------------------
+# Check Reproducibility of the Vectorized Engine
+#---------------------------------------------------------------------------------------------------
+
+if 'vectorized' in out_dfs:
+
+    # Errors must not depend on the number of processes
+    print()
+    print('checking vectorized engine with workers = 2')
+    out_df = aoe.add_obs_errors(in_df.copy(), errtable, engine='vectorized', 
+                                seed=seeds['vectorized'], workers=2, **err_kw)
+    if not out_df.equals(out_dfs['vectorized']):
+        print('ERROR: errors with workers = 2 differ from errors with workers = 1')
+        err = 10
+
+    # Errors for a station must not depend on the other stations
+    print()
+    print('checking vectorized engine after removing one station')
+    keep = (in_df['SID'] != in_df['SID'].iloc[0]).values
+    out_df = aoe.add_obs_errors(in_df.loc[keep].reset_index(drop=True), errtable,
+                                engine='vectorized', seed=seeds['vectorized'], **err_kw)
+    if not out_df.equals(out_dfs['vectorized'].loc[keep].reset_index(drop=True)):
+        print('ERROR: errors change when another station is removed')
+        err = 10
+
+print()
+print(err)
+
+
+"""
+End check_err_stats_test.py
+"""
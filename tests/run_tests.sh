@@ -25,6 +25,12 @@ run_uas_test=true
 # Option to run sfc ob test
 run_sfc_obs_test=true
 
+# Option to run cache test (compares against the output from linear_interp_test)
+run_cache_test=true
+
+# Option to run obs error statistics test (uses the output from linear_interp_test)
+run_err_stats_test=true
+
 
 ################################################################################
 # General Setup
@@ -401,6 +407,113 @@ if ${run_sfc_obs_test}; then
 fi
 
 
+################################################################################
+# Run Cache Test
+################################################################################
+
+if ${run_cache_test}; then
+  
+  echo
+  echo '==============================='
+  echo "Running Cache Test"
+  echo
+
+  if [ -d ./cache_test ]; then
+    echo 'removing old cache_test directory'
+    rm -rf ./cache_test
+  fi
+  mkdir cache_test 
+ 
+  echo 
+  echo 'creating input YAML file'
+  cp cache_test.yml ./cache_test
+  sed -i "s={MACHINE}=${machine}=" ./cache_test/cache_test.yml
+  sed -i "s={PARTITION}=${partition}=" ./cache_test/cache_test.yml
+  sed -i "s={HOMEDIR}=${home}=" ./cache_test/cache_test.yml
+  sed -i "s={BUFRDIR}=${prepbufr_decoder_path}=" ./cache_test/cache_test.yml
+  sed -i "s={DATADIR}=${datadir}=" ./cache_test/cache_test.yml
+
+  # Run twice: first with an empty cache, then with the cache filled by the first run
+  cache_test_pass=true
+  for cache_run in cold warm; do
+
+    if [[ ${cache_run} == warm ]]; then
+      mv ./cache_test/perfect_conv ./cache_test/perfect_conv_cold
+      rm -rf ./cache_test/logs
+    fi
+
+    cd ../
+    source activate_python_env.sh
+    echo
+    echo "calling create_syn_ob_jobs.py (${cache_run} cache)"
+    python create_syn_ob_jobs.py ./tests/cache_test/cache_test.yml
+
+    echo
+    echo 'calling run_synthetic_ob_creator.py'
+    job_line=$(python run_synthetic_ob_creator.py ./tests/cache_test/cache_test.yml | grep "submitted job")
+    cd ./tests/
+    if [[ `echo ${job_line} | wc -c` -lt 2 ]]; then
+      echo "no job submitted for cache test"
+      cache_test_pass=false
+      break
+    fi
+    job_id=${job_line:16:8}  
+    echo "Slurm jobID = ${job_id}"
+
+    scomplete=`sacct --job ${job_id} | grep "COMPLETED" | wc -c`
+    while [ ${scomplete} -lt 2 ]; do
+      echo "waiting 1 min for job to finish..."
+      sleep 60
+      scomplete=`sacct --job ${job_id} | grep "COMPLETED" | wc -c`
+    done
+  done
+
+  if ${cache_test_pass}; then
+    echo "Jobs done. Start verification"
+    echo
+
+    # Perform verification using Python script
+    python check_cache_test.py > ./cache_test/test.log
+    err_cache=`tail -1 ./cache_test/test.log`
+    if [[ ${err_cache} -eq 0 ]]; then
+      echo "cache test passed"
+      cache_test_pass=true
+    else
+      echo "cache test failed, error code = ${err_cache}"
+      cache_test_pass=false
+    fi
+  fi
+fi
+
+
+################################################################################
+# Run Obs Error Statistics Test
+################################################################################
+
+if ${run_err_stats_test}; then
+  
+  echo
+  echo '==============================='
+  echo "Running Obs Error Statistics Test"
+  echo
+
+  cd ../
+  source activate_python_env.sh
+  cd ./tests/
+
+  # Perform verification using Python script (no job is submitted)
+  python check_err_stats_test.py > ./linear_interp_test/err_stats_test.log
+  err_err_stats=`tail -1 ./linear_interp_test/err_stats_test.log`
+  if [[ ${err_err_stats} -eq 0 ]]; then
+    echo "obs error statistics test passed"
+    err_stats_test_pass=true
+  else
+    echo "obs error statistics test failed, error code = ${err_err_stats}"
+    err_stats_test_pass=false
+  fi
+fi
+
+
 ################################################################################
 # Print Final Test Results
 ################################################################################
@@ -422,5 +535,11 @@ fi
 if ${run_sfc_obs_test}; then
   echo "Pass sfc ob Test? ${sfc_obs_test_pass}"
 fi
+if ${run_cache_test}; then
+  echo "Pass Cache Test? ${cache_test_pass}"
+fi
+if ${run_err_stats_test}; then
+  echo "Pass Obs Error Statistics Test? ${err_stats_test_pass}"
+fi
 echo
 
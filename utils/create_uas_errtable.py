@@ -9,9 +9,14 @@ shawn.s.murdzek@noaa.gov
 #---------------------------------------------------------------------------------------------------
 
 import numpy as np
+import sys
+import os
 
 import pyDA_utils.gsi_fcts as gsi
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+import errtable_index as eti
+
 
 #---------------------------------------------------------------------------------------------------
 # Input Parameters
@@ -38,7 +43,7 @@ out_fname = '/work2/noaa/wrfruc/murdzek/real_obs/errtables/2nd_iter_assim_only/i
 # Add UAS Errors
 #---------------------------------------------------------------------------------------------------
 
-in_errtable = gsi.read_errtable(in_fname)
+in_errtable = eti.read_errtable(in_fname).to_dict()
 
 n_prs_bins = len(in_errtable[100]['prs'])
 
@@ -15,9 +15,14 @@ import pandas as pd
 import datetime as dt
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
+import sys
+import os
 
 import pyDA_utils.gsi_fcts as gsi
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+import errtable_index as eti
+
 
 #---------------------------------------------------------------------------------------------------
 # Input Parameters
@@ -92,14 +97,14 @@ for run in ['real', 'osse']:
     omf_df[run] = omf_df[run].loc[omf_df[run]['Prep_QC_Mark'] < 3].copy()
 
 # Read initial errtable
-init_spread_errtable = gsi.read_errtable(initial_err_spread_fname)
+init_spread_errtable = eti.read_errtable(initial_err_spread_fname).to_dict()
 new_spread_errtable = init_spread_errtable.copy()
-init_mean_errtable = gsi.read_errtable(initial_err_mean_fname)
+init_mean_errtable = eti.read_errtable(initial_err_mean_fname).to_dict()
 new_mean_errtable = init_mean_errtable.copy()
 
 # Read upper bound errtable
 if use_upper_bound:
-    upper_spread_errtable = gsi.read_errtable(upper_bound_spread_fname)
+    upper_spread_errtable = eti.read_errtable(upper_bound_spread_fname).to_dict()
 
 # Compute obs errors and necessary adjustments
 if ob_types == None: